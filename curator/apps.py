@@ -4,3 +4,6 @@ class CuratorConfig(AppConfig):
 	default_auto_field = 'django.db.models.BigAutoField'
 	name = 'curator'
 	is_arches_application = True
+
+	def ready(self):
+		from . import signals  # noqa: F401
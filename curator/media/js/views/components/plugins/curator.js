@@ -11,22 +11,28 @@ define([
         this.datasets = ko.observable();
 
         this.getStatus = async function() {
-            const response = await fetch("/curator");
-            const data = await response.json();
+            // Show the first page straight away, then add the rest a page at a time
+            let response = await fetch("/curator");
+            let data = await response.json();
             self.datasets(data.datasets);
             self.loading(false);
+            while (data.next) {
+                response = await fetch("/curator?cursor=" + encodeURIComponent(data.next));
+                data = await response.json();
+                self.datasets(self.datasets().concat(data.datasets || []));
+            }
         };
 
         this.saveStatus = async function() {
-            const response = await fetch("/curator", {
+            await fetch("/curator", {
                 method: 'POST',
                 credentials: 'include',
                 headers: {
                     "X-CSRFToken": Cookies.get('csrftoken')
                 }
             });
-            const data = await response.json();
-            self.datasets(data.datasets);
+            // The POST only returns the first page, so reload the whole list
+            await self.getStatus();
         };
 
         this.uploadZenodo = function(){
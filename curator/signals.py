@@ -0,0 +1,11 @@
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from uuid import uuid4
+from .models import CuratedDataset
+
+@receiver(post_save, sender=CuratedDataset)
+@receiver(post_delete, sender=CuratedDataset)
+def dataset_changed(sender, instance, **kwargs):
+	"""Invalidate the cached dataset listing of the dataset's owner, by giving it a new version."""
+	cache.set('curator_datasets_version_' + str(instance.search_user_id), uuid4().hex, None)
@@ -5,6 +5,8 @@ from django.shortcuts import get_object_or_404, render
 from django.http import JsonResponse, Http404, HttpResponseRedirect
 from django.template.defaultfilters import slugify
 from django.utils.functional import cached_property
+from django.core.cache import cache
+from django.db.models import Q
 from arches.app.models import models
 from arches.app.models.card import Card
 from arches.app.models.graph import Graph
@@ -12,7 +14,7 @@ from arches.app.models.tile import Tile
 from arches.app.views.plugin import PluginView
 from arches.app.models.system_settings import settings
 from arches.app.utils.betterJSONSerializer import JSONSerializer
-from uuid import uuid4
+from uuid import uuid4, UUID
 from ..models import CuratedDataset
 from ..util.arches import local_api_search
 from ..util.curator import is_zenodo_enabled, is_ipfs_enabled
@@ -20,7 +22,29 @@ from ..util.zip import save_zip
 from ..zenodo.publish import zenodo_publish
 from ..zenodo.calculate import zenodo_contributors, zenodo_keywords, zenodo_dates
 
-import json, datetime, pytz, urllib.parse, ipfslib
+import json, datetime, pytz, urllib.parse, ipfslib, base64, binascii, hashlib
+
+def dataset_cache_key(user_id, position, limit):
+	"""The cache key of a page of a user's dataset listing, starting after position (a decoded cursor, or
+	None for the first page). Keys include the user's listing version, so bumping the version (see
+	curator.signals) invalidates every cached page at once."""
+	version = cache.get_or_set('curator_datasets_version_' + str(user_id), uuid4().hex, None)
+	page = ''
+	if not position is None:
+		page = hashlib.sha1((position[0].isoformat() + ' ' + str(position[1])).encode('utf-8')).hexdigest()
+	return 'curator_datasets_' + str(user_id) + '_' + version + '_' + str(limit) + '_' + page
+
+def encode_cursor(created_time, search_id):
+	return base64.urlsafe_b64encode(json.dumps([created_time.isoformat(), str(search_id)]).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+	try:
+		created_time, search_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+		if not(isinstance(created_time, str) and isinstance(search_id, str)):
+			raise ValueError('Invalid cursor')
+		return [datetime.datetime.fromisoformat(created_time), UUID(search_id)]
+	except (TypeError, AttributeError, binascii.Error, UnicodeError, json.JSONDecodeError) as e:
+		raise ValueError('Invalid cursor') from e
 
 @method_decorator(csrf_exempt, name="dispatch")
 class Curator(View):
@@ -28,9 +52,32 @@ class Curator(View):
 	assigned to the logged-in user. It's generally called from the Knockout Javascript within the Arches UI. If called with a POST,
 	it creates a new curated search based on the arguments passed, and redirects to the new istance."""
 
-	def serialize_datasets(self, user_id):
-		res = [{'id': str(dataset.search_id), 'label': dataset.search_label, 'results': dataset.search_results_count} for dataset in CuratedDataset.objects.filter(search_user__id=user_id).exclude(search_label='').exclude(search_results_count=0)]
-		return res
+	def serialize_datasets(self, user_id, cursor=None, limit=None):
+		"""Returns a page of the user's datasets, newest first, as [datasets, cursor of the next page (or None)].
+		Only the columns shown in the listing are read (never the search_results GeoJSON), and pages are cached
+		per user until one of their datasets is saved or deleted."""
+		if limit is None:
+			limit = getattr(settings, 'CURATOR_PAGE_SIZE', 100)
+		limit = max(1, min(int(limit), 500))
+		# Decode the cursor before it's used for anything, so that a bad one is a ValueError (and a 400)
+		position = None if cursor is None else decode_cursor(cursor)
+		key = dataset_cache_key(user_id, position, limit)
+		ret = cache.get(key)
+		if not ret is None:
+			return ret
+
+		datasets = CuratedDataset.objects.filter(search_user__id=user_id).exclude(search_label='').exclude(search_results_count=0)
+		if not position is None:
+			created_time, search_id = position
+			datasets = datasets.filter(Q(created_time__lt=created_time) | Q(created_time=created_time, search_id__gt=search_id))
+		rows = list(datasets.order_by('-created_time', 'search_id').values_list('search_id', 'search_label', 'search_results_count', 'created_time')[:limit + 1])
+		res = [{'id': str(search_id), 'label': label, 'results': count} for search_id, label, count, created_time in rows[:limit]]
+		next_cursor = None
+		if len(rows) > limit:
+			next_cursor = encode_cursor(rows[limit - 1][3], rows[limit - 1][0])
+		ret = [res, next_cursor]
+		cache.set(key, ret, getattr(settings, 'CURATOR_CACHE_TIMEOUT', 3600))
+		return ret
 
 	def tidy_up(self):
 		"""Remove all CuratedDataset objects that have no results and are over 48 hours old, to free up space and keep the database tidy."""
@@ -49,7 +96,11 @@ class Curator(View):
 		user = request.user
 		if not user.is_authenticated:
 			return JsonResponse({"datasets": []})
-		data = {"datasets": self.serialize_datasets(user.id), "exports_enabled": self.exports_enabled}
+		try:
+			datasets, next_cursor = self.serialize_datasets(user.id, cursor=request.GET.get('cursor') or None, limit=request.GET.get('limit') or None)
+		except ValueError:
+			return JsonResponse({"error": "Invalid cursor or limit"}, status=400)
+		data = {"datasets": datasets, "next": next_cursor, "exports_enabled": self.exports_enabled}
 		return JsonResponse(data)
 
 	def post(self, request):
@@ -84,7 +135,8 @@ class Curator(View):
 		else:
 			ret.save(update_fields=fields)
 
-		data = {"id": ret.search_id, "datasets": self.serialize_datasets(user.id), 'exports_enabled': self.exports_enabled}
+		datasets, next_cursor = self.serialize_datasets(user.id)
+		data = {"id": ret.search_id, "datasets": datasets, "next": next_cursor, 'exports_enabled': self.exports_enabled}
 		return JsonResponse(data)
 
 class CuratorReport(PluginView):
@@ -9,5 +9,7 @@ class EamenaConfig(AppConfig):
     is_arches_application = True
 
     def ready(self):
+        from eamena import signals  # noqa: F401
+
         if settings.APP_NAME.lower() == self.name:
             generate_frontend_configuration()
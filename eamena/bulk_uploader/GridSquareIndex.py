@@ -0,0 +1,137 @@
+from arches.app.models.models import Node, TileModel
+from shapely import wkt
+from shapely.geometry import shape
+from shapely.ops import unary_union
+from shapely.strtree import STRtree
+import logging
+
+logger = logging.getLogger(__name__)
+
+class GridSquareIndex:
+	"""An in-memory spatial index of the Grid Square resources in the database, used by the bulk uploader
+	to work out which grid square a Heritage Place falls within, without searching for it in Elasticsearch.
+	The index is built from the Grid Square graph tiles the first time it is needed, and then kept for the
+	lifetime of the process."""
+
+	graph_id = '77d18973-7428-11ea-b4d0-02e7594ce0a0'
+	grid_id_node = 'b3628db0-742d-11ea-b4d0-02e7594ce0a0'
+
+	__instance = None
+
+	@classmethod
+	def get(cls):
+		"""Returns the shared index for this process, building it if necessary."""
+		if cls.__instance is None:
+			cls.__instance = cls()
+		return cls.__instance
+
+	@classmethod
+	def reset(cls):
+		"""Forgets the shared index, so the next call to get() rebuilds it from the database."""
+		cls.__instance = None
+
+	def __label(self, value):
+
+		if isinstance(value, dict):
+			if 'en' in value:
+				value = value['en']
+			else:
+				for v in value.values():
+					value = v
+					break
+			if isinstance(value, dict):
+				value = value.get('value', '')
+		if value is None:
+			return ''
+		return str(value).strip()
+
+	def __geometry(self, value):
+
+		if not(isinstance(value, dict)):
+			return None
+		geoms = []
+		for feature in value.get('features', []):
+			if not('geometry' in feature):
+				continue
+			try:
+				geoms.append(shape(feature['geometry']))
+			except Exception:
+				continue
+		if len(geoms) == 0:
+			return None
+		if len(geoms) == 1:
+			return geoms[0]
+		return unary_union(geoms)
+
+	def __init__(self):
+
+		self.ids = []
+		self.labels = []
+		self.geometries = []
+		self.__ids_by_label = {}
+		self.tree = None
+
+		labels = {}
+		for resid, data in TileModel.objects.filter(resourceinstance__graph_id=self.graph_id, nodegroup_id=self.grid_id_node).values_list('resourceinstance_id', 'data'):
+			if not(isinstance(data, dict)):
+				continue
+			label = self.__label(data.get(self.grid_id_node))
+			if len(label) == 0:
+				continue
+			labels[str(resid)] = label
+			self.__ids_by_label[label] = str(resid)
+
+		geom_nodes = [str(x) for x in Node.objects.filter(graph_id=self.graph_id, datatype='geojson-feature-collection').values_list('nodeid', flat=True)]
+		geom_nodegroups = Node.objects.filter(graph_id=self.graph_id, datatype='geojson-feature-collection').values_list('nodegroup_id', flat=True)
+		for resid, data in TileModel.objects.filter(resourceinstance__graph_id=self.graph_id, nodegroup_id__in=geom_nodegroups).values_list('resourceinstance_id', 'data'):
+			id = str(resid)
+			if not(id in labels):
+				continue
+			for nodeid in geom_nodes:
+				geom = self.__geometry(data.get(nodeid))
+				if geom is None:
+					continue
+				self.ids.append(id)
+				self.labels.append(labels[id])
+				self.geometries.append(geom)
+
+		if len(self.geometries) > 0:
+			self.tree = STRtree(self.geometries)
+		logger.debug("Built grid square index with " + str(len(self.geometries)) + " geometries")
+
+	def __len__(self):
+
+		return len(self.geometries)
+
+	def lookup(self, label):
+		"""Returns the resource instance id of the grid square with the given Grid ID, or None."""
+		return self.__ids_by_label.get(str(label).strip())
+
+	def find(self, geometry):
+		"""Returns a [resourceid, label] pair for the grid square containing the centroid of a shapely
+		geometry, or None if it does not fall within any grid square. Points on a shared edge are
+		assigned to the grid square with the lowest Grid ID, so the result is always the same."""
+		if self.tree is None:
+			return None
+		if geometry is None or geometry.is_empty:
+			return None
+		point = geometry.centroid
+		matches = []
+		for i in self.tree.query(point, predicate='intersects'):
+			matches.append([self.labels[i], self.ids[i]])
+		if len(matches) == 0:
+			return None
+		matches.sort()
+		return [matches[0][1], matches[0][0]]
+
+	def find_wkt(self, text):
+		"""Like find, but takes a WKT string, as entered in the GEOMETRIC_PLACE_EXPRESSION column of a
+		bulk upload sheet. Bare co-ordinate pairs are treated as points, as in BulkUploader.geojson_from_wkt."""
+		try:
+			geom = wkt.loads(text)
+		except Exception:
+			try:
+				geom = wkt.loads("POINT(" + text + ")")
+			except Exception:
+				return None
+		return self.find(geom)
@@ -0,0 +1,210 @@
+from arches.app.models.models import EditLog, Node, TileModel
+from shapely.geometry import shape
+from shapely.ops import unary_union
+from shapely.strtree import STRtree
+import numpy as np
+import shapely, datetime, logging, os
+
+logger = logging.getLogger(__name__)
+
+class HeritagePlaceIndex:
+	"""A spatial index (STR-packed R-tree) of the geometries of every Heritage Place in the database, used
+	to spot bulk uploads that re-submit sites that already exist. The index can be loaded from the tiles
+	table or from a compact snapshot file, and is brought up to date using the Arches edit log, so only
+	resources that have changed since the index was built are re-read from the database."""
+
+	graph_id = '34cfe98e-c2c0-11ea-9026-02e7594ce0a0'
+	eamena_id_node = '34cfe992-c2c0-11ea-9026-02e7594ce0a0'
+
+	__instance = None
+
+	@classmethod
+	def get(cls, snapshot=''):
+		"""Returns the shared index for this process, building it (or loading it from the snapshot file,
+		if one is given and exists) the first time, and refreshing it from the edit log on every call."""
+		if cls.__instance is None:
+			cls.__instance = cls(snapshot)
+		else:
+			cls.__instance.refresh()
+		return cls.__instance
+
+	def __init__(self, snapshot=''):
+
+		self.snapshot = snapshot
+		self.timestamp = None
+		self.ids = []
+		self.labels = []
+		self.geometries = []
+		self.tree = None
+
+		if ((len(self.snapshot) > 0) and (os.path.exists(self.snapshot))):
+			self.load(self.snapshot)
+			self.refresh()
+		else:
+			self.timestamp = self.__last_edit()
+			self.__set(self.__read_tiles())
+			if len(self.snapshot) > 0:
+				self.save(self.snapshot)
+
+	def __len__(self):
+
+		return len(self.ids)
+
+	def __last_edit(self):
+
+		item = EditLog.objects.filter(resourceclassid=self.graph_id).order_by('-timestamp').values_list('timestamp', flat=True).first()
+		if item is None:
+			return datetime.datetime.now(datetime.timezone.utc)
+		return item
+
+	def __label(self, value):
+
+		if isinstance(value, dict):
+			if 'en' in value:
+				value = value['en']
+			if isinstance(value, dict):
+				value = value.get('value', '')
+		if value is None:
+			return ''
+		return str(value)
+
+	def __read_tiles(self, resourceids=None):
+
+		# Returns a dict of resourceinstanceid => [label, geometry] for every Heritage Place (or just the
+		# ones listed) that has a geometry.
+
+		geom_nodes = [str(x) for x in Node.objects.filter(graph_id=self.graph_id, datatype='geojson-feature-collection').values_list('nodeid', flat=True)]
+		geom_nodegroups = Node.objects.filter(graph_id=self.graph_id, datatype='geojson-feature-collection').values_list('nodegroup_id', flat=True)
+
+		tiles = TileModel.objects.filter(resourceinstance__graph_id=self.graph_id, nodegroup_id__in=geom_nodegroups)
+		if not(resourceids is None):
+			tiles = tiles.filter(resourceinstance_id__in=resourceids)
+		shapes = {}
+		for resid, data in tiles.values_list('resourceinstance_id', 'data').iterator(chunk_size=5000):
+			id = str(resid)
+			for nodeid in geom_nodes:
+				value = data.get(nodeid)
+				if not(isinstance(value, dict)):
+					continue
+				for feature in value.get('features', []):
+					try:
+						geom = shape(feature['geometry'])
+					except Exception:
+						continue
+					if not(id in shapes):
+						shapes[id] = []
+					shapes[id].append(geom)
+
+		labels = TileModel.objects.filter(resourceinstance__graph_id=self.graph_id, nodegroup_id=self.eamena_id_node)
+		if not(resourceids is None):
+			labels = labels.filter(resourceinstance_id__in=resourceids)
+		ret = {}
+		for resid, data in labels.values_list('resourceinstance_id', 'data').iterator(chunk_size=5000):
+			id = str(resid)
+			if not(id in shapes):
+				continue
+			ret[id] = [self.__label(data.get(self.eamena_id_node)), None]
+		for id in shapes.keys():
+			if not(id in ret):
+				ret[id] = [id, None]
+			if len(shapes[id]) == 1:
+				ret[id][1] = shapes[id][0]
+			else:
+				ret[id][1] = unary_union(shapes[id])
+		return ret
+
+	def __set(self, items):
+
+		self.ids = list(items.keys())
+		self.labels = [items[id][0] for id in self.ids]
+		self.geometries = np.array([items[id][1] for id in self.ids], dtype=object)
+		self.tree = None
+		if len(self.ids) > 0:
+			self.tree = STRtree(self.geometries)
+
+	def refresh(self):
+		"""Re-reads any Heritage Places that have been created, edited or deleted since the index was last
+		brought up to date, and rebuilds the tree. Returns the number of resources re-read."""
+		edits = EditLog.objects.filter(resourceclassid=self.graph_id, timestamp__gt=self.timestamp)
+		last_edit = edits.order_by('-timestamp').values_list('timestamp', flat=True).first()
+		if last_edit is None:
+			return 0
+		changed = set([str(x) for x in edits.filter(timestamp__lte=last_edit).values_list('resourceinstanceid', flat=True).distinct()])
+		items = {}
+		for i in range(0, len(self.ids)):
+			if self.ids[i] in changed:
+				continue
+			items[self.ids[i]] = [self.labels[i], self.geometries[i]]
+		items.update(self.__read_tiles(list(changed)))
+		self.timestamp = last_edit
+		self.__set(items)
+		if len(self.snapshot) > 0:
+			self.save(self.snapshot)
+		logger.debug("Refreshed " + str(len(changed)) + " resources in the Heritage Place index")
+		return len(changed)
+
+	def save(self, filename):
+		"""Writes the index to a compressed numpy file, with the geometries stored as WKB."""
+		wkb = [shapely.to_wkb(geom) for geom in self.geometries]
+		offsets = np.cumsum([0] + [len(x) for x in wkb], dtype=np.int64)
+		np.savez_compressed(filename,
+			ids=np.array(self.ids, dtype=str),
+			labels=np.array(self.labels, dtype=str),
+			wkb=np.frombuffer(b''.join(wkb), dtype=np.uint8),
+			offsets=offsets,
+			timestamp=np.array([self.timestamp.isoformat()]))
+		if ((not(filename.endswith('.npz'))) and (os.path.exists(filename + '.npz'))):
+			os.replace(filename + '.npz', filename)
+
+	def load(self, filename):
+		"""Reads an index previously written with save()."""
+		with np.load(filename, allow_pickle=False) as data:
+			ids = [str(x) for x in data['ids']]
+			labels = [str(x) for x in data['labels']]
+			buffer = data['wkb'].tobytes()
+			offsets = data['offsets']
+			self.timestamp = datetime.datetime.fromisoformat(str(data['timestamp'][0]))
+		geoms = shapely.from_wkb([buffer[offsets[i]:offsets[i + 1]] for i in range(0, len(ids))])
+		items = {}
+		for i in range(0, len(ids)):
+			items[ids[i]] = [labels[i], geoms[i]]
+		self.__set(items)
+
+	def find_duplicates(self, geometries, distance=None, overlap=None):
+		"""Compares a list of shapely geometries against the index. Returns a list of
+		[input index, resourceinstanceid, EAMENA ID, reason] for every input geometry that is within
+		`distance` metres of an existing Heritage Place, or whose overlap with one (as a fraction of the
+		smaller of the two areas) is at least `overlap`. Either test can be switched off by passing None.
+		Distances are converted to degrees at the latitude of each input geometry, so are approximate."""
+		ret = []
+		if ((self.tree is None) or (len(geometries) == 0)):
+			return ret
+		geoms = np.array(geometries, dtype=object)
+		found = {}
+
+		if not(distance is None):
+			if distance > 0:
+				lat = shapely.get_y(shapely.centroid(geoms))
+				degrees = distance / (111320.0 * np.maximum(np.cos(np.radians(lat)), 0.01))
+				left, right = self.tree.query(geoms, predicate='dwithin', distance=degrees)
+			else:
+				left, right = self.tree.query(geoms, predicate='intersects')
+			for i, j in zip(left, right):
+				found[(int(i), int(j))] = 'The geometry is within ' + str(distance) + 'm of an existing site.'
+
+		if not(overlap is None):
+			left, right = self.tree.query(geoms, predicate='intersects')
+			if len(left) > 0:
+				a = geoms[left]
+				b = self.geometries[right]
+				smaller = np.minimum(shapely.area(a), shapely.area(b))
+				shared = shapely.area(shapely.intersection(a, b))
+				ratio = np.divide(shared, smaller, out=np.zeros(len(left)), where=(smaller > 0))
+				for i, j, r in zip(left, right, ratio):
+					if r < overlap:
+						continue
+					found[(int(i), int(j))] = 'The geometry overlaps an existing site by ' + str(int(round(r * 100))) + '%.'
+
+		for key in sorted(found.keys()):
+			ret.append([key[0], self.ids[key[1]], self.labels[key[1]], found[key]])
+		return ret
@@ -1,5 +1,45 @@
 import json, uuid, re, urllib.request
 
+class TileRecord:
+	"""A compact tile, used while a resource is being built. Supports the same item access as the
+	Arches JSON tile dict it represents, and is only converted to one by to_dict()."""
+
+	__slots__ = ('parenttile_id', 'provisionaledits', 'sortorder', 'tileid', 'nodegroup_id', 'resourceinstance_id', 'data')
+	fields = __slots__
+
+	def __init__(self, tileid, nodegroup_id, resourceinstance_id, parenttile_id=None):
+
+		self.parenttile_id = parenttile_id
+		self.provisionaledits = None
+		self.sortorder = 0
+		self.tileid = tileid
+		self.nodegroup_id = nodegroup_id
+		self.resourceinstance_id = resourceinstance_id
+		self.data = {}
+
+	def __getitem__(self, key):
+
+		if not(key in self.fields):
+			raise KeyError(key)
+		return getattr(self, key)
+
+	def __setitem__(self, key, value):
+
+		if not(key in self.fields):
+			raise KeyError(key)
+		setattr(self, key, value)
+
+	def __contains__(self, key):
+
+		return (key in self.fields)
+
+	def to_dict(self):
+
+		ret = {}
+		for key in self.fields:
+			ret[key] = getattr(self, key)
+		return ret
+
 class ResourceModel:
 
 	def __init__(self, rm_file, legacy_uuid=''):
@@ -15,6 +55,8 @@ class ResourceModel:
 		self.name = jsondata['graph'][0]['name']
 		self.nodes = {}
 		self.tiles = []
+		self.nodegroup_tiles = {} # nodegroupid => index of the first tile in self.tiles
+		self.parent_nodegroups = {} # nodegroupid => parent nodegroupid, or None
 		for node in jsondata['graph'][0]['nodes']:
 			nodeid = node['nodeid']
 			for nodegroup in jsondata['graph'][0]['nodegroups']:
@@ -51,45 +93,44 @@ class ResourceModel:
 			return ''
 		return self.nodes[nodeid]['nodegroup_id']
 
+	def get_parent_nodegroup(self, nodegroupid):
+
+		if nodegroupid in self.parent_nodegroups:
+			return self.parent_nodegroups[nodegroupid]
+		parentid = None
+		if nodegroupid in self.nodes:
+			node = self.nodes[nodegroupid]
+			if 'nodegroup' in node:
+				if 'parentnodegroup_id' in node['nodegroup']:
+					parentid = node['nodegroup']['parentnodegroup_id']
+		self.parent_nodegroups[nodegroupid] = parentid
+		return parentid
+
 	def get_nodegroup_index(self, nodegroupid):
 
-		for i in range(0, len(self.tiles)):
-			if self.tiles[i]['nodegroup_id'] == nodegroupid:
-				return i
+		if nodegroupid in self.nodegroup_tiles:
+			return self.nodegroup_tiles[nodegroupid]
 		if not(nodegroupid in self.nodes):
 			return -1
-		node = self.nodes[nodegroupid]
-		if not('nodegroup' in node):
-			self.tiles.append(self.create_tile(nodegroupid))
-			return (len(self.tiles) - 1)
-		if not('parentnodegroup_id' in node['nodegroup']):
-			self.tiles.append(self.create_tile(nodegroupid))
-			return (len(self.tiles) - 1)
-		if node['nodegroup']['parentnodegroup_id'] is None:
-			self.tiles.append(self.create_tile(nodegroupid))
-			return (len(self.tiles) - 1)
-		parentid = node['nodegroup']['parentnodegroup_id']
-		parent = self.get_nodegroup_index(parentid)
-		if parent < 0:
-			self.tiles.append(self.create_tile(nodegroupid))
-			return (len(self.tiles) - 1)
-		parenttile = self.tiles[parent]
-		self.tiles.append(self.create_tile(nodegroupid, parenttile['tileid']))
-		return (len(self.tiles) - 1)
+		parentid = self.get_parent_nodegroup(nodegroupid)
+		parenttile = None
+		if not(parentid is None):
+			parent = self.get_nodegroup_index(parentid)
+			if parent >= 0:
+				parenttile = self.tiles[parent]['tileid']
+		return self.append_tile(self.create_tile(nodegroupid, parenttile))
+
+	def append_tile(self, tile):
+
+		self.tiles.append(tile)
+		ix = len(self.tiles) - 1
+		if not(tile.nodegroup_id in self.nodegroup_tiles):
+			self.nodegroup_tiles[tile.nodegroup_id] = ix
+		return ix
 
 	def create_tile(self, nodegroupid, parent=None):
 
-		ret = {}
-		ret['parenttile_id'] = None
-		ret['provisionaledits'] = None
-		ret['sortorder'] = 0
-		ret['tileid'] = str(uuid.uuid4())
-		ret['nodegroup_id'] = nodegroupid
-		ret['resourceinstance_id'] = self.resid
-		ret['data'] = {}
-		if parent:
-			ret['parenttile_id'] = parent
-		return ret
+		return TileRecord(str(uuid.uuid4()), nodegroupid, self.resid, parent or None)
 
 	def add(self, id, value):
 
@@ -105,7 +146,7 @@ class ResourceModel:
 			# Called if we're adding a subsequent new sub-tile
 			newtile = self.create_tile(self.tiles[ix]['nodegroup_id'], self.tiles[ix]['parenttile_id'])
 			newtile['data'][id] = value
-			self.tiles.append(newtile)
+			self.append_tile(newtile)
 			return newtile
 		else:
 			# Called if we're adding a new value to an existing card, or the first new sub-tile
@@ -117,7 +158,7 @@ class ResourceModel:
 		item = {}
 		item['resourceinstance'] = {
 			"resourceinstanceid" : self.resid, "graph_id" : self.id, "legacyid" : self.resid}
-		item['tiles'] = self.tiles
+		item['tiles'] = [tile.to_dict() for tile in self.tiles]
 
 		business_data = {"resources": []}
 		business_data['resources'].append(item)
@@ -128,6 +169,6 @@ class ResourceModel:
 		item = {}
 		item['resourceinstance'] = {
 			"resourceinstanceid" : self.resid, "graph_id" : self.id, "legacyid" : self.resid}
-		item['tiles'] = self.tiles
+		item['tiles'] = [tile.to_dict() for tile in self.tiles]
 
 		return json.dumps(item)
@@ -2,3 +2,5 @@ from .BulkUploadSheet import BulkUploadSheet
 from .HeritagePlaceBulkUploadSheet import HeritagePlaceBulkUploadSheet
 from .GridSquareBulkUploadSheet import GridSquareBulkUploadSheet
 from .ResourceModel import ResourceModel
+from .GridSquareIndex import GridSquareIndex
+from .HeritagePlaceIndex import HeritagePlaceIndex
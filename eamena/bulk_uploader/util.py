@@ -3,16 +3,20 @@ from django.contrib.gis.geos import GEOSGeometry
 from django.http import HttpRequest
 from django.core.exceptions import ValidationError, ObjectDoesNotExist
 from django.conf import settings
+from django.db import connections
 from arches.app.models.models import GraphModel, Node, ResourceInstance, TileModel, Language
 from arches.app.models.concept import Concept, get_preflabel_from_valueid, get_valueids_from_concept_label
 from arches.app.views import search
 from django.core.management.base import BaseCommand
 from django.contrib.gis.geos.error import GEOSException
-from eamena.bulk_uploader import HeritagePlaceBulkUploadSheet, GridSquareBulkUploadSheet
+from eamena.bulk_uploader import HeritagePlaceBulkUploadSheet, GridSquareBulkUploadSheet, GridSquareIndex, HeritagePlaceIndex
 from elasticsearch import Elasticsearch
 from elasticsearch.exceptions import RequestError, NotFoundError
 from geomet import wkt
-import json, os, sys, logging, re, uuid, hashlib, datetime, warnings
+from concurrent.futures import ProcessPoolExecutor
+from shapely import wkt as shapely_wkt
+import json, os, sys, logging, re, uuid, hashlib, datetime, warnings, math, multiprocessing
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +26,8 @@ class BulkUploader():
 
 		self.idcache = {}
 		self.graphcache = {}
+		self.nodecache = {}
+		self.tiledefaults = {}
 		self.errors = []
 		self.warnings = []
 
@@ -47,14 +53,69 @@ class BulkUploader():
 		ret['nodegroup_id'] = nodegroupid
 		ret['resourceinstance_id'] = resid
 		ret['data'] = {}
-		for node in Node.objects.filter(nodegroup_id=nodegroupid):
-			if node.datatype in required_datatypes:
-				node_uuid = str(node.nodeid)
-				ret['data'][node_uuid] = None
+		key = str(nodegroupid)
+		if not(key in self.tiledefaults):
+			self.tiledefaults[key] = []
+			for node in Node.objects.filter(nodegroup_id=nodegroupid):
+				if node.datatype in required_datatypes:
+					self.tiledefaults[key].append(str(node.nodeid))
+		for node_uuid in self.tiledefaults[key]:
+			ret['data'][node_uuid] = None
 		if parent:
 			ret['parenttile_id'] = parent
 		return ret
 
+	def compile_nodes(self, graphid):
+
+		# Returns a dict of the nodes in a graph, keyed by nodeid, along with the nodes each new tile
+		# of each nodegroup needs (see create_tile). Both are cached, as they are read-only and are
+		# handed to every worker process when the uploader runs in parallel.
+
+		key = str(graphid)
+		if key in self.nodecache:
+			return self.nodecache[key]
+		required_datatypes = ['date', 'concept']
+		nodes = {}
+		tiledefaults = {}
+		for node in Node.objects.filter(graph__graphid=graphid).select_related('nodegroup').all():
+			value = {"nodeid": str(node.nodeid), "name": node.name, "datatype": str(node.datatype), "key": (re.sub(r'[^A-Z_]+', '_', node.name.replace(' ', '_').upper().strip('_'))), "config": node.config, "nodegroup_id": str(node.nodegroup_id), "parentnodegroup_id": None}
+			if not(node.nodegroup is None):
+				if not(node.nodegroup.parentnodegroup_id is None):
+					value['parentnodegroup_id'] = str(node.nodegroup.parentnodegroup_id)
+			nodes[value['nodeid']] = value
+			if node.nodegroup_id is None:
+				continue
+			if not(value['nodegroup_id'] in tiledefaults):
+				tiledefaults[value['nodegroup_id']] = []
+			if value['datatype'] in required_datatypes:
+				tiledefaults[value['nodegroup_id']].append(value['nodeid'])
+		for nodegroupid in tiledefaults.keys():
+			if not(nodegroupid in self.tiledefaults):
+				self.tiledefaults[nodegroupid] = tiledefaults[nodegroupid]
+		self.nodecache[key] = nodes
+		return nodes
+
+	def run_in_pool(self, function, items, workers, *args):
+
+		# Splits a list into contiguous shards and runs function(shard, *args) on each of them in a pool
+		# of worker processes. Each call must return [results, errors, warnings]; these are merged back
+		# in the original order, so the output is exactly the same as processing the list sequentially.
+		# The pool is forked, so the workers share anything already loaded, but not database connections.
+
+		size = max(1, int(math.ceil(len(items) / (workers * 4))))
+		shards = []
+		for i in range(0, len(items), size):
+			shards.append(items[i:i + size])
+		connections.close_all()
+		ret = []
+		context = multiprocessing.get_context('fork')
+		with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+			for results, shard_errors, shard_warnings in pool.map(function, shards, *[[arg] * len(shards) for arg in args]):
+				ret.extend(results)
+				self.errors.extend(shard_errors)
+				self.warnings.extend(shard_warnings)
+		return ret
+
 	def error(self, ref, text, info=''):
 
 		self.errors.append([ref, text, info])
@@ -132,104 +193,271 @@ class BulkUploader():
 				passed_uid = data['_']
 				del(data['_'])
 
-		nodes = {}
-		ret = []
-		for node in Node.objects.filter(graph__graphid=options['graph']).all():
-			value = {"nodeid": str(node.nodeid), "name": node.name, "datatype": str(node.datatype), "key": (re.sub(r'[^A-Z_]+', '_', node.name.replace(' ', '_').upper().strip('_'))), "config": node.config}
-			nodes[value['nodeid']] = value
+		nodes = self.compile_nodes(options['graph'])
+
+		# Date cells repeat heavily across rows, so parse each distinct value once, up front.
+		date_values = []
+		for resource in data:
+			if not(isinstance(resource, (dict))):
+				continue
+			for tile in resource.get('tiles', []):
+				if not('data' in tile):
+					continue
+				for ko in tile['data']:
+					key = str(ko)
+					if key in nodes:
+						if nodes[key]['datatype'] == 'date':
+							date_values.append(tile['data'][key])
+		dates = parse_dates(date_values)
 
+		items = []
 		for resource in data:
 			if 'resourceinstance' in resource:
 				if '_' in resource['resourceinstance']:
 					passed_uid = resource['resourceinstance']['_']
 					del(resource['resourceinstance']['_'])
-			if 'tiles' in resource:
-				tiles = resource['tiles']
-				resource['tiles'] = []
-				for tile in tiles:
-					if 'data' in tile:
-						for ko in tile['data']:
-							key = str(ko)
-							if key in nodes:
+			items.append([resource, passed_uid])
+
+		workers = int(options.get('workers', 1))
+		if ((workers > 1) and (len(items) > workers)):
+			if options['graph'] == HeritagePlaceIndex.graph_id:
+				GridSquareIndex.get() # Build the index before forking, so the workers share it
+			return self.run_in_pool(map_resources_shard, items, workers, nodes, dates, language, options, self.tiledefaults)
+
+		ret = []
+		for resource, passed_uid in items:
+			ret.append(self.map_resource(resource, nodes, dates, language, options, passed_uid))
+
+		return ret
+
+	def map_resource(self, resource, nodes, dates, language, options, passed_uid=''):
 
-								if tile['data'][key] is None:
-									continue
+		# Maps the tiles of a single converted resource into Arches JSON, given the compiled node
+		# schema from compile_nodes and the parsed date lookup from parse_dates.
 
-								if nodes[key]['datatype'] == 'string':
-									tile['data'][key] = {language.code: {'value': tile['data'][key], 'direction': language.default_direction}}
+		if 'tiles' in resource:
+			self.assign_grid_square(resource, nodes, options, passed_uid)
+			tiles = resource['tiles']
+			resource['tiles'] = []
+			for tile in tiles:
+				if 'data' in tile:
+					for ko in tile['data']:
+						key = str(ko)
+						if key in nodes:
 
-								if nodes[key]['datatype'] == 'date':
+							if tile['data'][key] is None:
+								continue
+
+							if nodes[key]['datatype'] == 'string':
+								tile['data'][key] = {language.code: {'value': tile['data'][key], 'direction': language.default_direction}}
+
+							if nodes[key]['datatype'] == 'date':
+								if isinstance(tile['data'][key], (str)):
+									date_object = dates.get(tile['data'][key])
+								else:
 									date_object = parse_date(tile['data'][key])
-									if date_object is None:
-										self.error(passed_uid, 'Cannot parse date string: "' + str(tile['data'][key]) + '"')
+								if date_object is None:
+									self.error(passed_uid, 'Cannot parse date string: "' + str(tile['data'][key]) + '"')
+								else:
+									new_date_string = date_object.strftime('%Y-%m-%d')
+									tile['data'][key] = new_date_string
+
+							if nodes[key]['datatype'] == 'concept-list':
+								if not(isinstance(tile['data'][key], (dict, list))):
+									tile['data'][key] = [tile['data'][key]]
+
+							if nodes[key]['datatype'] == 'geojson-feature-collection':
+								if isinstance(tile['data'][key], (str)):
+									geojson_data = self.geojson_from_wkt(tile['data'][key])
+									if isinstance(geojson_data, (dict)):
+										if 'features' in geojson_data:
+											for feature in geojson_data['features']:
+												if 'geometry' in feature:
+													try:
+														geom_collection = GEOSGeometry(json.dumps(feature['geometry']))
+													except GEOSException:
+														self.error(passed_uid, "Invalid geometry.", "The geometry is syntactically correct, but the shape is not supported by Arches. Please simplify and try again.")
+												else:
+													self.error(passed_uid, "Invalid geometry.", "FeatureCollection is missing a geometry.")
+
+										tile['data'][key] = geojson_data
+										tile['data'][key]['features'][0]['properties']['nodeId'] = str(key)
 									else:
-										new_date_string = date_object.strftime('%Y-%m-%d')
-										tile['data'][key] = new_date_string
-
-								if nodes[key]['datatype'] == 'concept-list':
-									if not(isinstance(tile['data'][key], (dict, list))):
-										tile['data'][key] = [tile['data'][key]]
-
-								if nodes[key]['datatype'] == 'geojson-feature-collection':
-									if isinstance(tile['data'][key], (str)):
-										geojson_data = self.geojson_from_wkt(tile['data'][key])
-										if isinstance(geojson_data, (dict)):
-											if 'features' in geojson_data:
-												for feature in geojson_data['features']:
-													if 'geometry' in feature:
-														try:
-															geom_collection = GEOSGeometry(json.dumps(feature['geometry']))
-														except GEOSException:
-															self.error(passed_uid, "Invalid geometry.", "The geometry is syntactically correct, but the shape is not supported by Arches. Please simplify and try again.")
-													else:
-														self.error(passed_uid, "Invalid geometry.", "FeatureCollection is missing a geometry.")
-
-											tile['data'][key] = geojson_data
-											tile['data'][key]['features'][0]['properties']['nodeId'] = str(key)
-										else:
-											self.error(passed_uid, "Invalid geometry.", "Please check your geometry data is in the WKT format, all co-ordinates are two-dimensional, and no co-ordinates are duplicated.")
-
-								if nodes[key]['datatype'] == 'resource-instance':
-									target_graphs = nodes[key]['config']['graphs']
-									id = ''
+										self.error(passed_uid, "Invalid geometry.", "Please check your geometry data is in the WKT format, all co-ordinates are two-dimensional, and no co-ordinates are duplicated.")
+
+							if nodes[key]['datatype'] == 'resource-instance':
+								target_graphs = nodes[key]['config']['graphs']
+								id = ''
+								for target_graph in target_graphs:
+									ri = self.resourceinstance_from_eamenaid(tile['data'][key], target_graph['graphid'])
+									if not(ri is None):
+										id = str(ri.resourceinstanceid)
+										tile['data'][key] = [{
+											"ontologyProperty": target_graph['ontologyProperty'],
+											"inverseOntologyProperty": target_graph['inverseOntologyProperty'],
+											"resourceId": id,
+											"resourceXresourceId": str(uuid.uuid4())
+										}]
+								if len(id) == 0:
+									help_text = []
 									for target_graph in target_graphs:
-										ri = self.resourceinstance_from_eamenaid(tile['data'][key], target_graph['graphid'])
-										if not(ri is None):
-											id = str(ri.resourceinstanceid)
-											tile['data'][key] = [{
-												"ontologyProperty": target_graph['ontologyProperty'],
-												"inverseOntologyProperty": target_graph['inverseOntologyProperty'],
-												"resourceId": id,
-												"resourceXresourceId": str(uuid.uuid4())
-											}]
-									if len(id) == 0:
-										help_text = []
-										for target_graph in target_graphs:
-											help_text.append(self.modelname_from_uuid(target_graph['graphid']))
-										self.error(passed_uid, "Cannot resolve linked resource: '" + str(tile['data'][key]) + "' is not in the database.", "Expecting: " + (', '.join(help_text)))
-
-								if nodes[key]['datatype'] == 'resource-instance-list':
-									target_graphs = nodes[key]['config']['graphs']
-									id = ''
+										help_text.append(self.modelname_from_uuid(target_graph['graphid']))
+									self.error(passed_uid, "Cannot resolve linked resource: '" + str(tile['data'][key]) + "' is not in the database.", "Expecting: " + (', '.join(help_text)))
+
+							if nodes[key]['datatype'] == 'resource-instance-list':
+								target_graphs = nodes[key]['config']['graphs']
+								id = ''
+								for target_graph in target_graphs:
+									ri = self.resourceinstance_from_eamenaid(tile['data'][key], target_graph['graphid'])
+									if not(ri is None):
+										id = str(ri.resourceinstanceid)
+										tile['data'][key] = [{
+											"ontologyProperty": target_graph['ontologyProperty'],
+											"inverseOntologyProperty": target_graph['inverseOntologyProperty'],
+											"resourceId": id,
+											"resourceXresourceId": str(uuid.uuid4())
+										}]
+								if len(id) == 0:
+									help_text = []
 									for target_graph in target_graphs:
-										ri = self.resourceinstance_from_eamenaid(tile['data'][key], target_graph['graphid'])
-										if not(ri is None):
-											id = str(ri.resourceinstanceid)
-											tile['data'][key] = [{
-												"ontologyProperty": target_graph['ontologyProperty'],
-												"inverseOntologyProperty": target_graph['inverseOntologyProperty'],
-												"resourceId": id,
-												"resourceXresourceId": str(uuid.uuid4())
-											}]
-									if len(id) == 0:
-										help_text = []
-										for target_graph in target_graphs:
-											help_text.append(self.modelname_from_uuid(target_graph['graphid']))
-										self.error(passed_uid, "Cannot resolve linked resource: '" + str(tile['data'][key]) + "' is not in the database.", "Expecting: " + (', '.join(help_text)))
-					resource['tiles'].append(tile)
-			ret.append(resource)
+										help_text.append(self.modelname_from_uuid(target_graph['graphid']))
+									self.error(passed_uid, "Cannot resolve linked resource: '" + str(tile['data'][key]) + "' is not in the database.", "Expecting: " + (', '.join(help_text)))
+				resource['tiles'].append(tile)
+		return resource
+
+	def assign_grid_square(self, resource, nodes, options, uid=''):
+
+		# Works out which grid square a resource falls in from its geometry, using the in-memory grid
+		# square index rather than a search. Any Grid ID supplied in the sheet is checked against the
+		# geometry, and if none is supplied, the computed one is added to the resource.
+
+		grid_nodes = []
+		geom_nodes = []
+		for key in nodes.keys():
+			node = nodes[key]
+			if node['datatype'] == 'geojson-feature-collection':
+				geom_nodes.append(key)
+			if ((node['datatype'] == 'resource-instance') or (node['datatype'] == 'resource-instance-list')):
+				for target_graph in (node['config'] or {}).get('graphs', []):
+					if target_graph['graphid'] == GridSquareIndex.graph_id:
+						grid_nodes.append(key)
+		if ((len(grid_nodes) == 0) or (len(geom_nodes) == 0)):
+			return None
 
-		return ret
+		index = GridSquareIndex.get()
+		if len(index) == 0:
+			return None
+
+		grids = []
+		supplied = []
+		for tile in resource['tiles']:
+			if not('data' in tile):
+				continue
+			for key in geom_nodes:
+				if not(key in tile['data']):
+					continue
+				if not(isinstance(tile['data'][key], (str))):
+					continue
+				grid = index.find_wkt(tile['data'][key])
+				if grid is None:
+					continue
+				if not(grid[1] in grids):
+					grids.append(grid[1])
+			for key in grid_nodes:
+				if not(key in tile['data']):
+					continue
+				if isinstance(tile['data'][key], (str)):
+					supplied.append(tile['data'][key].strip())
+
+		if len(grids) == 0:
+			return None
+
+		for value in supplied:
+			if value in grids:
+				continue
+			self.warn(uid, "Grid ID '" + value + "' does not match the geometry.", "The geometry falls within grid square '" + ("', '".join(grids)) + "'.")
+
+		if len(supplied) > 0:
+			return grids[0]
+		if options.get('append_mode', 'new') == 'append':
+			return grids[0]
+
+		grid_node = nodes[grid_nodes[0]]
+		for tile in resource['tiles']:
+			if tile['nodegroup_id'] != grid_node['nodegroup_id']:
+				continue
+			if not('data' in tile):
+				tile['data'] = {}
+			tile['data'][grid_node['nodeid']] = grids[0]
+			return grids[0]
+		parent = None
+		if not(grid_node['parentnodegroup_id'] is None):
+			for tile in resource['tiles']:
+				if tile['nodegroup_id'] == grid_node['parentnodegroup_id']:
+					parent = tile['tileid']
+					break
+			if parent is None:
+				return grids[0]
+		tile = self.create_tile(resource['resourceinstance']['resourceinstanceid'], grid_node['nodegroup_id'], parent)
+		tile['data'][grid_node['nodeid']] = grids[0]
+		resource['tiles'].append(tile)
+		return grids[0]
+
+	def check_duplicates(self, data, options):
+
+		# Compares the geometries of a list of converted (but not yet mapped) resources against the
+		# spatial index of existing Heritage Places, and warns about any that look like re-submissions
+		# of sites already in the database. Returns the number of possible duplicates found.
+
+		if options['graph'] != HeritagePlaceIndex.graph_id:
+			return 0
+		if options.get('append_mode', 'new') == 'append':
+			return 0
+		distance = getattr(settings, 'BULK_UPLOAD_DUPLICATE_DISTANCE', 10)
+		overlap = getattr(settings, 'BULK_UPLOAD_DUPLICATE_OVERLAP', 0.5)
+		if ((distance is None) and (overlap is None)):
+			return 0
+
+		geom_nodes = [str(x) for x in Node.objects.filter(graph_id=options['graph'], datatype='geojson-feature-collection').values_list('nodeid', flat=True)]
+		uids = []
+		geoms = []
+		for resource in data:
+			uid = ''
+			if 'resourceinstance' in resource:
+				if '_' in resource['resourceinstance']:
+					uid = resource['resourceinstance']['_']
+			for tile in resource.get('tiles', []):
+				if not('data' in tile):
+					continue
+				for key in geom_nodes:
+					if not(key in tile['data']):
+						continue
+					if not(isinstance(tile['data'][key], (str))):
+						continue
+					try:
+						geom = shapely_wkt.loads(tile['data'][key])
+					except Exception:
+						try:
+							geom = shapely_wkt.loads("POINT(" + tile['data'][key] + ")")
+						except Exception:
+							continue
+					if geom.is_empty:
+						continue
+					uids.append(uid)
+					geoms.append(geom)
+		if len(geoms) == 0:
+			return 0
+
+		index = HeritagePlaceIndex.get(getattr(settings, 'BULK_UPLOAD_HERITAGE_PLACE_INDEX', ''))
+		duplicates = index.find_duplicates(geoms, distance, overlap)
+		reported = set()
+		for item in duplicates:
+			key = uids[item[0]] + ' ' + item[1]
+			if key in reported:
+				continue
+			reported.add(key)
+			self.warn(uids[item[0]], "Possible duplicate of existing Heritage Place '" + item[2] + "'.", item[3])
+		return len(reported)
 
 	def modelname_from_uuid(self, graphid):
 
@@ -247,6 +475,13 @@ class BulkUploader():
 		key = str(graphid) + '_' + str(eamenaid)
 		if key in self.idcache:
 			return self.idcache[key]
+		if str(graphid) == GridSquareIndex.graph_id:
+			id = GridSquareIndex.get().lookup(eamenaid)
+			if not(id is None):
+				ret = ResourceInstance.objects.filter(resourceinstanceid=id).first()
+				if not(ret is None):
+					self.idcache[key] = ret
+					return ret
 		ret = self.resourceinstance_from_eamenaid_es(eamenaid, graphid)
 		if not(ret is None):
 			self.idcache[key] = ret
@@ -515,45 +750,58 @@ class BulkUploader():
 
 	def convert_translated_data(self, data, options):
 
-		append_mode = options['append_mode']
 		try:
 			rm = GraphModel.objects.get(graphid=options['graph'])
 		except GraphModel.DoesNotExist:
 			rm = None
 
+		workers = int(options.get('workers', 1))
+		if ((workers > 1) and (len(data) > workers)):
+			self.compile_nodes(options['graph'])
+			return self.run_in_pool(convert_translated_data_shard, data, workers, rm, options, self.tiledefaults)
+
 		ret = []
 		for item in data:
+			res = self.convert_translated_item(item, rm, options)
+			if not(res is None):
+				ret.append(res)
 
-			legacyid = ''
-			if append_mode == 'append':
-				if '_' in item:
-					uid = item['_']
-					resid = self.resourceinstance_from_eamenaid(uid, rm.graphid, quick=True)
-					if resid is None:
-						self.error(uid, 'Cannot resolve existing EAMENA ID', 'In append mode, the UNIQUEID column must contain a valid EAMENA ID, so the system knows which resource should be appended.')
-						continue
-					legacyid = str(resid.resourceinstanceid)
-				else:
-					self.error('', 'Missing UNIQUEID', '')
-					continue
+		return ret
 
-			res = self.create_res(rm.graphid, legacyid)
-			resid = res['resourceinstance']['resourceinstanceid']
-			if '_' in item:
-				res['resourceinstance']['_'] = item['_']
-			for nodegroupidkey in item.keys():
-				nodegroupid = str(nodegroupidkey)
-				if isinstance(item[nodegroupid], (list)):
-					for subitem in item[nodegroupid]:
-						for tile in self.recursive_data_conversion(subitem, str(nodegroupid), None, resid, rm):
-							res['tiles'].append(tile)
-				if isinstance(item[nodegroupid], (dict)):
-					for subtile in self.recursive_data_conversion(item[nodegroupid], str(nodegroupid), None, resid, rm):
-						res['tiles'].append(subtile)
+	def convert_translated_item(self, item, rm, options):
 
-			ret.append(res)
+		# Converts a single item of translated data into a resource with a flat list of tiles, or
+		# returns None if it cannot be converted.
 
-		return ret
+		append_mode = options['append_mode']
+		legacyid = ''
+		if append_mode == 'append':
+			if '_' in item:
+				uid = item['_']
+				resid = self.resourceinstance_from_eamenaid(uid, rm.graphid, quick=True)
+				if resid is None:
+					self.error(uid, 'Cannot resolve existing EAMENA ID', 'In append mode, the UNIQUEID column must contain a valid EAMENA ID, so the system knows which resource should be appended.')
+					return None
+				legacyid = str(resid.resourceinstanceid)
+			else:
+				self.error('', 'Missing UNIQUEID', '')
+				return None
+
+		res = self.create_res(rm.graphid, legacyid)
+		resid = res['resourceinstance']['resourceinstanceid']
+		if '_' in item:
+			res['resourceinstance']['_'] = item['_']
+		for nodegroupidkey in item.keys():
+			nodegroupid = str(nodegroupidkey)
+			if isinstance(item[nodegroupid], (list)):
+				for subitem in item[nodegroupid]:
+					for tile in self.recursive_data_conversion(subitem, str(nodegroupid), None, resid, rm):
+						res['tiles'].append(tile)
+			if isinstance(item[nodegroupid], (dict)):
+				for subtile in self.recursive_data_conversion(item[nodegroupid], str(nodegroupid), None, resid, rm):
+					res['tiles'].append(subtile)
+
+		return res
 
 	def convert_translated_grid_square(self, data, options):
 
@@ -840,6 +1088,34 @@ class BulkUploader():
 
 		return True
 
+def map_resources_shard(items, nodes, dates, language, options, tiledefaults):
+
+	# Worker function for BulkUploader.map_resources, run in a separate process. Takes a list of
+	# [resource, uid] pairs and returns the mapped resources, plus any errors and warnings.
+
+	bu = BulkUploader()
+	bu.tiledefaults = tiledefaults
+	ret = []
+	for resource, uid in items:
+		ret.append(bu.map_resource(resource, nodes, dates, language, options, uid))
+	return [ret, bu.errors, bu.warnings]
+
+def convert_translated_data_shard(items, rm, options, tiledefaults):
+
+	# Worker function for BulkUploader.convert_translated_data, run in a separate process.
+
+	bu = BulkUploader()
+	bu.tiledefaults = tiledefaults
+	ret = []
+	for item in items:
+		res = bu.convert_translated_item(item, rm, options)
+		if not(res is None):
+			ret.append(res)
+	return [ret, bu.errors, bu.warnings]
+
+simple_date_pattern = re.compile(r'^([0-9]{1,9})-([0-9]{1,9})-([0-9]{1,9})$')
+month_lengths = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
 def parse_date(datestring):
 
 	# This function is necessary because the behaviour of dateutil.parse is unpredictable.
@@ -868,6 +1144,49 @@ def parse_date(datestring):
 			return None
 	return None
 
+def parse_dates(datestrings):
+
+	# Batch version of parse_date, for use when the same dates appear many times in an upload. Each
+	# distinct string is only looked at once, and the common all-digit forms (YYYY-MM-DD and DD-MM-YYYY,
+	# with either separator) are range-checked as numpy arrays rather than by building datetimes inside
+	# try blocks. Anything unusual is passed to parse_date, so the results are always the same.
+	# Returns a dict mapping each string to a datetime, or None if it cannot be parsed.
+
+	ret = {}
+	simple = []
+	parts = []
+	for datestring in set(datestrings):
+		if not(isinstance(datestring, (str))):
+			continue
+		match = simple_date_pattern.match(datestring.split(" ")[0].replace("/", "-"))
+		if match is None:
+			ret[datestring] = parse_date(datestring)
+			continue
+		simple.append(datestring)
+		parts.append(match.groups())
+	if len(simple) == 0:
+		return ret
+
+	values = np.array(parts, dtype=np.int64)
+	v1 = values[:, 0]
+	v2 = values[:, 1]
+	v3 = values[:, 2]
+	ymd = (v1 > 100)
+	dmy = (np.logical_not(ymd) & (v3 > 100))
+	year = np.where(ymd, v1, v3)
+	day = np.where(ymd, v3, v1)
+	month = np.clip(v2, 1, 12)
+	leap = (((year % 4) == 0) & ((year % 100) != 0)) | ((year % 400) == 0)
+	month_length = month_lengths[month - 1] + (leap & (month == 2))
+	valid = (ymd | dmy) & (v2 >= 1) & (v2 <= 12) & (year >= datetime.MINYEAR) & (year <= datetime.MAXYEAR) & (day >= 1) & (day <= month_length)
+
+	for i in range(0, len(simple)):
+		if valid[i]:
+			ret[simple[i]] = datetime.datetime(int(year[i]), int(v2[i]), int(day[i]))
+		else:
+			ret[simple[i]] = None
+	return ret
+
 def eamenaid_from_resourceinstance(resourceinstanceid, lang='en'):
 
 	eamena_tile_uuid = '34cfe992-c2c0-11ea-9026-02e7594ce0a0'
@@ -896,11 +1215,11 @@ def list_nodes(graphid, language='en', warnings='warn'):
 	bu = BulkUploader()
 	return bu.list_nodes(options)
 
-def convert(graphid, source_file, language='en', warnings='warn', append=False):
+def convert(graphid, source_file, language='en', warnings='warn', append=False, workers=1):
 	"""Converts an XLSX bulk upload sheet into Arches JSON."""
 	rm = GraphModel.objects.get(graphid=graphid)
 	model_name = str(rm.name)
-	options = {'graph': graphid, 'source': source_file, 'bus_language': language, 'warn_mode': warnings, 'append_mode': 'new'}
+	options = {'graph': graphid, 'source': source_file, 'bus_language': language, 'warn_mode': warnings, 'append_mode': 'new', 'workers': workers}
 	if append:
 		options['append_mode'] = 'append'
 	bu = BulkUploader()
@@ -938,15 +1257,16 @@ def translate(graphid, source_file, language='en', warnings='warn', append=False
 			del(data[i]['_'])
 	return data
 
-def validate(graphid, source_file, language='en', warnings='warn', append=False):
+def validate(graphid, source_file, language='en', warnings='warn', append=False, workers=1):
 	"""Inspects an XLSX bulk upload sheet and lists errors."""
 	translated_data = translate(graphid, source_file, language, warnings, append)
-	options = {'graph': graphid, 'source': source_file, 'bus_language': language, 'warn_mode': warnings, 'append_mode': 'new'}
+	options = {'graph': graphid, 'source': source_file, 'bus_language': language, 'warn_mode': warnings, 'append_mode': 'new', 'workers': workers}
 	if append:
 		options['append_mode'] = 'append'
 	bu = BulkUploader()
 	if bu.check_translated_data(translated_data):
 		resources = bu.convert_translated_data(translated_data, options)
+		bu.check_duplicates(resources, options)
 		mapped_resources = bu.map_resources(resources, options)
 		business_data = {"resources": mapped_resources}
 		if (len(bu.warnings) + len(bu.errors)) == 0:
@@ -970,12 +1290,12 @@ def unflatten(graphid, source_file, language='en', warnings='warn', append=False
 	bu = BulkUploader()
 	return bu.unflatten(options)
 
-def prerequisites(graphid, source_file, language='en', warnings='warn', append=False):
+def prerequisites(graphid, source_file, language='en', warnings='warn', append=False, workers=1):
 	"""Returns an Arches JSON file containing all the prerequisite
 	objects (grid ids, etc) that do not already exist in the
 	database."""
 	translated_data = translate(graphid, source_file, language, warnings, append)
-	options = {'graph': graphid, 'source': source_file, 'bus_language': language, 'warn_mode': warnings, 'append_mode': 'new'}
+	options = {'graph': graphid, 'source': source_file, 'bus_language': language, 'warn_mode': warnings, 'append_mode': 'new', 'workers': workers}
 	if append:
 		options['append_mode'] = 'append'
 	bu = BulkUploader()
@@ -1,2 +1,3 @@
 from .jsonl import JsonLWriter
 from .rdf import RdfWriter, JsonLdWriter
+from .columnar import ColumnarWriter
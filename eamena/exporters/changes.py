@@ -0,0 +1,118 @@
+import os
+import json
+import datetime
+from io import StringIO
+from arches.app.models.models import EditLog
+from arches.app.models.models import GraphModel
+from arches.app.models.models import ResourceInstance
+
+
+def parse_timestamp(value):
+    # Accepts a datetime, an ISO 8601 string or None.
+    if value is None or isinstance(value, datetime.datetime):
+        return value
+    value = str(value).strip()
+    if len(value) == 0:
+        return None
+    return datetime.datetime.fromisoformat(value)
+
+
+def load_cursor(path, graph_id):
+    """Returns the timestamp stored for a graph in a cursor file, or None if there isn't one."""
+    if not (os.path.exists(path)):
+        return None
+    with open(path, "r") as fp:
+        cursors = json.load(fp)
+    return parse_timestamp(cursors.get(str(graph_id)))
+
+
+def save_cursor(path, graph_id, timestamp):
+    """Stores the timestamp for a graph in a cursor file, keeping the cursors of any other graphs."""
+    cursors = {}
+    if os.path.exists(path):
+        with open(path, "r") as fp:
+            cursors = json.load(fp)
+    cursors[str(graph_id)] = timestamp.isoformat()
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as fp:
+        json.dump(cursors, fp, indent=2)
+    os.replace(temp_path, path)
+
+
+def resource_changes(graph_id, since=None):
+    """Uses the Arches edit log to find the resources of a graph that have been created, edited or
+    deleted after a given time. Returns a dict with the ids of the resources to export ('changed'),
+    [id, timestamp] pairs for deleted resources ('deleted') and the timestamp of the last edit seen
+    ('cursor'), from which the next run should continue. If since is None, every resource is changed."""
+    edits = EditLog.objects.filter(resourceclassid=str(graph_id))
+    if since is not None:
+        edits = edits.filter(timestamp__gt=since)
+    latest = {}
+    cursor = since
+    for resourceinstanceid, edittype, timestamp in edits.order_by("timestamp").values_list("resourceinstanceid", "edittype", "timestamp").iterator():
+        latest[str(resourceinstanceid)] = [edittype, timestamp]
+        cursor = timestamp
+
+    if since is None:
+        changed = [str(x) for x in ResourceInstance.objects.filter(graph_id=graph_id).values_list("resourceinstanceid", flat=True)]
+    else:
+        changed = [id for id in latest.keys() if latest[id][0] != "delete"]
+        changed = [str(x) for x in ResourceInstance.objects.filter(resourceinstanceid__in=changed).values_list("resourceinstanceid", flat=True)]
+    existing = set(changed)
+
+    deleted = []
+    for id in latest.keys():
+        if id in existing:
+            continue
+        if since is None and latest[id][0] != "delete":
+            continue
+        deleted.append([id, latest[id][1]])
+
+    if cursor is None:
+        cursor = datetime.datetime.now(datetime.timezone.utc)
+    return {"changed": sorted(changed), "deleted": deleted, "cursor": cursor}
+
+
+class IncrementalExportMixin(object):
+    """Adds 'changed since' exports to a resource Writer. When write_resources is called with a `since`
+    timestamp, or the path of a `cursor` file, only resources changed since then are exported and a
+    tombstone file lists the resources deleted since then. The cursor file is only moved on by
+    commit_cursor, which the caller runs once the export files have been written out."""
+
+    def prepare_export(self, graph_id=None, resourceinstanceids=None):
+        # Sets the graph and file name details that Writer.get_tiles would, without loading
+        # every tile of the export into memory.
+        if (graph_id is None or graph_id is False) and resourceinstanceids:
+            graph_id = ResourceInstance.objects.filter(resourceinstanceid=resourceinstanceids[0]).values_list("graph_id", flat=True).first()
+        self.graph_id = graph_id
+        self.graph_model = GraphModel.objects.get(graphid=graph_id)
+        self.file_name = "{0}_{1}".format(str(self.graph_model.name).replace(" ", "_"), datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S"))
+
+    def is_incremental(self, **kwargs):
+        return kwargs.get("since") is not None or len(kwargs.get("cursor") or "") > 0
+
+    def get_changes(self, graph_id, **kwargs):
+        # Works out what to export, and keeps it in self.changes for write_tombstones and
+        # commit_cursor. The since argument takes priority over the cursor file.
+        since = parse_timestamp(kwargs.get("since"))
+        cursor_file = kwargs.get("cursor") or ""
+        if since is None and len(cursor_file) > 0:
+            since = load_cursor(cursor_file, graph_id)
+        self.changes = resource_changes(graph_id, since)
+        self.changes["cursor_file"] = cursor_file
+        return self.changes["changed"]
+
+    def write_tombstones(self):
+        # Returns an export file, in the same form as write_resources, listing deleted resources.
+        dest = StringIO()
+        for resourceinstanceid, timestamp in self.changes["deleted"]:
+            dest.write(json.dumps({"resourceinstanceid": resourceinstanceid, "graph_id": str(self.graph_id), "deleted": timestamp.isoformat()}))
+            dest.write("\n")
+        dest.seek(0)
+        return {"name": "{0}.deleted.jsonl".format(self.file_name), "outputfile": dest}
+
+    def commit_cursor(self):
+        # Moves the cursor file on to the last edit exported. Does nothing if the last export
+        # wasn't incremental or didn't use a cursor file.
+        if len(getattr(self, "changes", {}).get("cursor_file", "")) > 0:
+            save_cursor(self.changes["cursor_file"], self.graph_id, self.changes["cursor"])
@@ -0,0 +1,285 @@
+"""
+Exports the resources of a graph as a flat table, one row per resource and one column per node, in
+GeoParquet or FlatGeobuf format. Concepts and domain values are written as their labels, nodes that
+can hold more than one value are list columns (JSON text in FlatGeobuf, which has no list type) and
+the geometries of every geometry node are combined into a single WKB 'geometry' column.
+
+Resources are read and written a chunk at a time (EXPORT_CHUNK_SIZE), as one Parquet row group or one
+batch of features per chunk, so memory use doesn't depend on the size of the export. Both formats need
+the pyarrow package; FlatGeobuf also needs pyogrio.
+"""
+
+import os
+import re
+import json
+import shutil
+from tempfile import mkstemp
+from arches.app.models.models import Node, NodeGroup, Value
+from arches.app.utils.data_management.resources.formats.format import Writer
+from eamena.exporters.changes import IncrementalExportMixin
+from eamena.exporters.jsonl import ExportFile, resource_chunks
+from shapely.geometry import shape
+import shapely
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+try:
+    import pyogrio
+except ImportError:
+    pyogrio = None
+
+COLUMNAR_EXTENSIONS = {"parquet": "parquet", "fgb": "fgb"}
+
+# Datatypes whose values are lists, whatever the cardinality of their nodegroup
+LIST_DATATYPES = ["concept-list", "domain-value-list", "resource-instance-list", "file-list"]
+
+# Datatypes that aren't written as columns of their own
+SKIPPED_DATATYPES = ["semantic", "geojson-feature-collection"]
+
+
+def column_name(name):
+    return re.sub(r"[^a-z0-9]+", "_", str(name).lower()).strip("_")
+
+
+def text_value(value):
+    # Localised strings are stored as {"en": {"value": ..., "direction": ...}, ...}
+    if isinstance(value, dict):
+        if "en" in value:
+            value = value["en"]
+        elif len(value) > 0:
+            value = list(value.values())[0]
+        if isinstance(value, dict):
+            value = value.get("value")
+    if value is None or value == "":
+        return None
+    return str(value)
+
+
+def combine_geometries(geoms):
+    if len(geoms) == 1:
+        return geoms[0]
+    parts = shapely.get_parts(geoms)
+    types = set(shapely.get_type_id(parts).tolist())
+    if types == set([0]):
+        return shapely.multipoints(parts)
+    if types <= set([1, 2]):
+        return shapely.multilinestrings(parts)
+    if types == set([3]):
+        return shapely.multipolygons(parts)
+    return shapely.geometrycollections(parts)
+
+
+class Column(object):
+    def __init__(self, node, name, multiple):
+        self.nodeid = str(node.nodeid)
+        self.nodegroupid = str(node.nodegroup_id)
+        self.name = name
+        self.datatype = node.datatype
+        self.multiple = multiple
+        self.options = {}
+        for option in (node.config or {}).get("options", []) or []:
+            self.options[str(option.get("id"))] = text_value(option.get("text"))
+
+    def arrow_type(self, lists=True):
+        if self.datatype == "number":
+            base = pyarrow.float64()
+        elif self.datatype == "boolean":
+            base = pyarrow.bool_()
+        else:
+            base = pyarrow.string()
+        if self.multiple:
+            return pyarrow.list_(base) if lists else pyarrow.string()
+        return base
+
+    def values(self, value, labels):
+        # Converts a node value from a tile to a list of plain values
+        if value is None:
+            return []
+        if self.datatype in ["concept", "concept-list"]:
+            ids = value if isinstance(value, list) else [value]
+            return [labels.get(str(id)) for id in ids if id]
+        if self.datatype in ["domain-value", "domain-value-list"]:
+            ids = value if isinstance(value, list) else [value]
+            return [self.options.get(str(id)) for id in ids if id]
+        if self.datatype in ["resource-instance", "resource-instance-list"]:
+            return [str(item.get("resourceId")) for item in value if isinstance(item, dict) and item.get("resourceId")]
+        if self.datatype == "file-list":
+            return [item.get("name") for item in value if isinstance(item, dict)]
+        if self.datatype == "number":
+            try:
+                return [float(value)]
+            except (TypeError, ValueError):
+                return []
+        if self.datatype == "boolean":
+            return [bool(value)]
+        if self.datatype == "url":
+            return [value.get("url")] if isinstance(value, dict) else [str(value)]
+        if self.datatype in ["string", "date", "edtf", "non-localized-string"]:
+            value = text_value(value)
+            return [] if value is None else [value]
+        return [json.dumps(value, sort_keys=True)]
+
+
+class ColumnarWriter(IncrementalExportMixin, Writer):
+    def __init__(self, **kwargs):
+        self.format = kwargs.pop("format", "parquet")
+        super(ColumnarWriter, self).__init__(**kwargs)
+
+    def get_columns(self, graph_id):
+        """Returns a Column for every node of the graph that holds data, in a stable order. Column names
+        are the node names; where a name is used more than once, it is prefixed by its nodegroup's name."""
+        nodegroups = {}
+        for nodegroupid, parentid, cardinality in NodeGroup.objects.filter(node__graph_id=graph_id).distinct().values_list("nodegroupid", "parentnodegroup_id", "cardinality"):
+            nodegroups[str(nodegroupid)] = [None if parentid is None else str(parentid), cardinality]
+        nodes = list(Node.objects.filter(graph_id=graph_id).exclude(datatype__in=SKIPPED_DATATYPES).exclude(nodegroup_id=None).order_by("sortorder", "name", "nodeid"))
+        group_names = dict([(str(nodeid), name) for nodeid, name in Node.objects.filter(graph_id=graph_id, nodeid__in=nodegroups.keys()).values_list("nodeid", "name")])
+
+        def repeatable(nodegroupid):
+            while nodegroupid is not None and nodegroupid in nodegroups:
+                if nodegroups[nodegroupid][1] == "n":
+                    return True
+                nodegroupid = nodegroups[nodegroupid][0]
+            return False
+
+        counts = {}
+        for node in nodes:
+            counts[column_name(node.name)] = counts.get(column_name(node.name), 0) + 1
+        used = set(["resourceinstanceid", "geometry"])
+        columns = []
+        for node in nodes:
+            name = column_name(node.name)
+            if counts[name] > 1:
+                name = column_name(group_names.get(str(node.nodegroup_id), "") + "_" + node.name)
+            unique = name
+            i = 1
+            while unique in used:
+                i = i + 1
+                unique = name + "_" + str(i)
+            used.add(unique)
+            columns.append(Column(node, unique, (node.datatype in LIST_DATATYPES) or repeatable(str(node.nodegroup_id))))
+        return columns
+
+    def get_schema(self, columns, lists=True):
+        fields = [pyarrow.field("resourceinstanceid", pyarrow.string())]
+        for column in columns:
+            fields.append(pyarrow.field(column.name, column.arrow_type(lists)))
+        fields.append(pyarrow.field("geometry", pyarrow.binary()))
+        return pyarrow.schema(fields)
+
+    def record_batches(self, columns, geometry_nodes, graph_id=None, resourceinstanceids=None, lists=True):
+        """Yields a pyarrow RecordBatch of rows for each chunk of resources."""
+        schema = self.get_schema(columns, lists)
+        by_nodegroup = {}
+        for column in columns:
+            by_nodegroup.setdefault(column.nodegroupid, []).append(column)
+        concept_columns = [column.nodeid for column in columns if column.datatype in ["concept", "concept-list"]]
+        labels = {}
+        for chunk in resource_chunks(graph_id=graph_id, resourceinstanceids=resourceinstanceids):
+            # Look up the labels of every concept value in the chunk that hasn't been seen already
+            missing = set()
+            for resourceinstance, tiles in chunk:
+                for tile in tiles:
+                    for nodeid in concept_columns:
+                        value = (tile.data or {}).get(nodeid)
+                        for id in value if isinstance(value, list) else [value]:
+                            if id and not (str(id) in labels):
+                                missing.add(str(id))
+            if len(missing) > 0:
+                for valueid, value in Value.objects.filter(valueid__in=list(missing)).values_list("valueid", "value"):
+                    labels[str(valueid)] = value
+
+            data = dict([(field.name, []) for field in schema])
+            for resourceinstance, tiles in chunk:
+                row = {}
+                geoms = []
+                for tile in tiles:
+                    tiledata = tile.data or {}
+                    for column in by_nodegroup.get(str(tile.nodegroup_id), []):
+                        row.setdefault(column.name, []).extend(column.values(tiledata.get(column.nodeid), labels))
+                    for nodeid in geometry_nodes:
+                        value = tiledata.get(nodeid)
+                        if not (isinstance(value, dict)):
+                            continue
+                        for feature in value.get("features", []):
+                            try:
+                                geoms.append(shape(feature["geometry"]))
+                            except Exception:
+                                continue
+                data["resourceinstanceid"].append(str(resourceinstance.resourceinstanceid))
+                for column in columns:
+                    values = [x for x in row.get(column.name, []) if x is not None]
+                    if column.multiple:
+                        if len(values) == 0:
+                            data[column.name].append(None)
+                        elif lists:
+                            data[column.name].append(values)
+                        else:
+                            data[column.name].append(json.dumps(values))
+                    else:
+                        data[column.name].append(values[-1] if len(values) > 0 else None)
+                data["geometry"].append(shapely.to_wkb(combine_geometries(geoms)) if len(geoms) > 0 else None)
+            yield pyarrow.RecordBatch.from_arrays([pyarrow.array(data[field.name], type=field.type) for field in schema], schema=schema)
+
+    def geo_metadata(self, columns):
+        return {
+            b"geo": json.dumps({"version": "1.0.0", "primary_column": "geometry", "columns": {"geometry": {"encoding": "WKB", "geometry_types": []}}}).encode("utf-8"),
+            b"eamena": json.dumps({"graph_id": str(self.graph_id), "columns": dict([(column.name, column.nodeid) for column in columns])}).encode("utf-8"),
+        }
+
+    def write_file(self, path, graph_id=None, resourceinstanceids=None):
+        """Writes the resources to a GeoParquet or FlatGeobuf file, depending on self.format. Returns
+        the number of resources written."""
+        if pyarrow is None:
+            raise ImportError("Columnar exports need the pyarrow package")
+        if self.format not in COLUMNAR_EXTENSIONS:
+            raise ValueError("Unknown columnar format: " + str(self.format))
+        columns = self.get_columns(graph_id)
+        geometry_nodes = [str(x) for x in Node.objects.filter(graph_id=graph_id, datatype="geojson-feature-collection").values_list("nodeid", flat=True)]
+        count = [0]
+
+        def counted(batches):
+            for batch in batches:
+                count[0] = count[0] + batch.num_rows
+                yield batch
+
+        if self.format == "fgb":
+            if pyogrio is None:
+                raise ImportError("FlatGeobuf exports need the pyogrio package")
+            schema = self.get_schema(columns, lists=False)
+            batches = counted(self.record_batches(columns, geometry_nodes, graph_id=graph_id, resourceinstanceids=resourceinstanceids, lists=False))
+            reader = pyarrow.RecordBatchReader.from_batches(schema, batches)
+            pyogrio.write_arrow(reader, path, driver="FlatGeobuf", geometry_name="geometry", geometry_type="Unknown", crs="EPSG:4326")
+            return count[0]
+
+        schema = self.get_schema(columns).with_metadata(self.geo_metadata(columns))
+        with pyarrow.parquet.ParquetWriter(path, schema, compression="zstd") as writer:
+            for batch in counted(self.record_batches(columns, geometry_nodes, graph_id=graph_id, resourceinstanceids=resourceinstanceids)):
+                writer.write_table(pyarrow.Table.from_batches([batch], schema=schema))
+        return count[0]
+
+    def write_resources(self, graph_id=None, resourceinstanceids=None, **kwargs):
+        self.prepare_export(graph_id=graph_id, resourceinstanceids=resourceinstanceids)
+        incremental = self.is_incremental(**kwargs)
+        if incremental:
+            resourceinstanceids = self.get_changes(self.graph_id, **kwargs)
+
+        # pyogrio needs a file name, so write to a named file and hand back an open copy of it
+        fd, path = mkstemp(suffix="." + COLUMNAR_EXTENSIONS.get(self.format, self.format))
+        os.close(fd)
+        try:
+            self.write_file(path, graph_id=self.graph_id, resourceinstanceids=resourceinstanceids)
+            dest = ExportFile(mode="w+b")
+            with open(path, "rb") as fp:
+                shutil.copyfileobj(fp, dest)
+        finally:
+            os.remove(path)
+        dest.seek(0)
+
+        ret = [{"name": "{0}.{1}".format(self.file_name, COLUMNAR_EXTENSIONS[self.format]), "outputfile": dest}]
+        if incremental:
+            ret.append(self.write_tombstones())
+        return ret
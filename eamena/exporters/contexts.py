@@ -0,0 +1,162 @@
+"""
+A local store of JSON-LD context documents, used as pyld's document loader by the RDF exporters.
+
+Contexts are looked up in memory, then in an on-disk cache (JSONLD_CONTEXT_DIR), then in the
+contexts bundled with the package (eamena/exporters/contexts, listed in its index.json). A context
+that is found locally is always returned straight away; if it is older than
+JSONLD_CONTEXT_CACHE_TIMEOUT minutes it is re-checked in a background thread with a conditional
+(ETag / Last-Modified) request. Only a context that isn't stored anywhere is fetched while the caller
+waits, and with JSONLD_CONTEXT_OFFLINE set not even then.
+"""
+
+import os
+import json
+import hashlib
+import logging
+import datetime
+import threading
+import requests
+from arches.app.models.system_settings import settings
+from pyld.jsonld import JsonLdError
+
+logger = logging.getLogger(__name__)
+
+BUNDLED_CONTEXT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "contexts")
+
+
+def read_index(directory):
+    path = os.path.join(directory, "index.json")
+    if not (os.path.exists(path)):
+        return {}
+    with open(path, "r") as fp:
+        return json.load(fp)
+
+
+def write_json(path, data):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as fp:
+        json.dump(data, fp, indent=2)
+    os.replace(temp_path, path)
+
+
+class ContextStore(object):
+    def __init__(self, cache_dir=None, bundled_dir=BUNDLED_CONTEXT_DIR, offline=None, timeout=None):
+        if cache_dir is None:
+            cache_dir = getattr(settings, "JSONLD_CONTEXT_DIR", os.path.join(getattr(settings, "APP_ROOT", ""), "jsonld_contexts"))
+        if offline is None:
+            offline = getattr(settings, "JSONLD_CONTEXT_OFFLINE", False)
+        if timeout is None:
+            timeout = getattr(settings, "JSONLD_CONTEXT_CACHE_TIMEOUT", 60 * 24)
+        self.cache_dir = cache_dir
+        self.bundled_dir = bundled_dir
+        self.offline = offline
+        self.timeout = timeout
+        self.request_timeout = getattr(settings, "JSONLD_CONTEXT_REQUEST_TIMEOUT", 10)
+        self.entries = {}
+        self.refreshing = set()
+        self.lock = threading.Lock()
+
+    def cache_path(self, url):
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".json")
+
+    def read_entry(self, url):
+        # An entry is {"url", "document", "etag", "last_modified", "fetched"}; bundled contexts have
+        # no fetch time, so are always re-checked (in the background) the first time they are used.
+        if len(self.cache_dir or "") > 0 and os.path.exists(self.cache_path(url)):
+            try:
+                with open(self.cache_path(url), "r") as fp:
+                    return json.load(fp)
+            except ValueError:
+                logger.warning("Ignoring unreadable cached JSON-LD context for " + url)
+        filename = read_index(self.bundled_dir).get(url)
+        if filename is not None:
+            with open(os.path.join(self.bundled_dir, filename), "r") as fp:
+                return {"url": url, "document": json.load(fp), "etag": None, "last_modified": None, "fetched": None}
+        return None
+
+    def save_entry(self, entry):
+        self.entries[entry["url"]] = entry
+        if len(self.cache_dir or "") == 0:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            write_json(self.cache_path(entry["url"]), entry)
+        except OSError as e:
+            logger.warning("Could not save JSON-LD context " + entry["url"] + ": " + str(e))
+
+    def is_stale(self, entry):
+        if entry["fetched"] is None:
+            return True
+        if self.timeout is None:
+            return False
+        fetched = datetime.datetime.fromisoformat(entry["fetched"])
+        return fetched + datetime.timedelta(minutes=self.timeout) < datetime.datetime.now()
+
+    def fetch(self, url, entry=None):
+        """Downloads a context, sending the ETag / Last-Modified of the stored copy if there is one, and
+        saves it. Returns the new entry (or the stored one, with a new fetch time, if it hasn't changed)."""
+        headers = {"Accept": "application/ld+json, application/json"}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        resp = requests.get(url, headers=headers, timeout=self.request_timeout)
+        now = datetime.datetime.now().isoformat()
+        if resp.status_code == 304 and entry is not None:
+            entry = dict(entry, fetched=now)
+        else:
+            resp.raise_for_status()
+            entry = {"url": url, "document": resp.json(), "etag": resp.headers.get("ETag"), "last_modified": resp.headers.get("Last-Modified"), "fetched": now}
+        self.save_entry(entry)
+        return entry
+
+    def refresh_in_background(self, url, entry):
+        with self.lock:
+            if url in self.refreshing:
+                return
+            self.refreshing.add(url)
+
+        def run():
+            try:
+                self.fetch(url, entry)
+            except Exception as e:
+                logger.warning("Could not refresh JSON-LD context " + url + ": " + str(e))
+            finally:
+                with self.lock:
+                    self.refreshing.discard(url)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def get(self, url):
+        """Returns the context document for url, from the store if possible."""
+        entry = self.entries.get(url)
+        if entry is None:
+            entry = self.read_entry(url)
+            if entry is not None:
+                self.entries[url] = entry
+        if entry is not None:
+            if (not (self.offline)) and self.is_stale(entry):
+                self.refresh_in_background(url, entry)
+            return entry["document"]
+        if self.offline:
+            raise JsonLdError("The JSON-LD context " + url + " is not in the local store, and JSONLD_CONTEXT_OFFLINE is set.", "jsonld.LoadDocumentError", {"url": url}, code="loading document failed")
+        try:
+            return self.fetch(url)["document"]
+        except Exception as e:
+            raise JsonLdError("Could not retrieve the JSON-LD context " + url + ".", "jsonld.LoadDocumentError", {"url": url}, code="loading document failed", cause=e)
+
+    def load_document(self, url, options=None):
+        # pyld document loader; PyLD 2.0 / JSON-LD 1.1 passes a second argument we don't need
+        return {"contextUrl": None, "documentUrl": url, "document": self.get(url)}
+
+    def bundle(self, url):
+        """Fetches a context and adds it to the bundled contexts directory, so it ships with the package."""
+        entry = self.fetch(url)
+        index = read_index(self.bundled_dir)
+        filename = index.get(url, hashlib.sha1(url.encode("utf-8")).hexdigest() + ".json")
+        os.makedirs(self.bundled_dir, exist_ok=True)
+        write_json(os.path.join(self.bundled_dir, filename), entry["document"])
+        index[url] = filename
+        write_json(os.path.join(self.bundled_dir, "index.json"), index)
+        return filename
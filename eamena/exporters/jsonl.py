@@ -1,9 +1,14 @@
+import io
 import os
 import sys
 import csv
 import json
 import uuid
+import gzip
+import hashlib
 import datetime
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from tempfile import TemporaryFile
 from time import time
 from copy import deepcopy
@@ -13,19 +18,123 @@ from arches.app.utils.data_management.resource_graphs.importer import import_gra
 from arches.app.models.tile import Tile, TileValidationError
 from arches.app.models.resource import Resource
 from arches.app.models.models import ResourceInstance
+from arches.app.models.models import TileModel
 from arches.app.models.models import FunctionXGraph
 from arches.app.models.models import Node
 from arches.app.models.models import NodeGroup
 from arches.app.models.models import GraphModel
 from arches.app.models.system_settings import settings
 from django.core.exceptions import ValidationError
+from django.db import connections
 from arches.app.utils.betterJSONSerializer import JSONSerializer, JSONDeserializer
 from arches.app.utils.data_management.resources.formats.format import Writer
 from arches.app.utils.data_management.resources.formats.format import Reader
 from arches.app.utils.data_management.resources.formats.format import ResourceImportReporter
+from eamena.exporters.changes import IncrementalExportMixin
 
+try:
+        import zstandard
+except ImportError:
+        zstandard = None
 
-class JsonLWriter(Writer):
+COMPRESSION_EXTENSIONS = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+
+
+def open_compressed(path, compression):
+        # Opens a file for writing text, compressed with gzip or zstd, or not at all.
+        if compression == "gzip":
+                return gzip.open(path, "wt", encoding="utf-8")
+        if compression == "zstd":
+                if zstandard is None:
+                        raise ImportError("zstd compression needs the zstandard package")
+                return io.TextIOWrapper(zstandard.ZstdCompressor().stream_writer(open(path, "wb"), closefd=True), encoding="utf-8")
+        return open(path, "w", encoding="utf-8")
+
+
+def file_checksum(path):
+        sha = hashlib.sha256()
+        with open(path, "rb") as fp:
+                for block in iter(lambda: fp.read(1048576), b""):
+                        sha.update(block)
+        return sha.hexdigest()
+
+
+class ExportFile(object):
+        """A temporary file to write export output to, so that large exports don't have to fit in memory.
+        Writers return it rewound, and like the StringIO returned by Arches' own writers it has a
+        getvalue(), which returns the whole contents without moving the file position."""
+
+        def __init__(self, mode="w+", suffix=""):
+                self.file = TemporaryFile(mode=mode, suffix=suffix)
+
+        def __getattr__(self, name):
+                return getattr(self.file, name)
+
+        def __iter__(self):
+                return iter(self.file)
+
+        def __enter__(self):
+                return self
+
+        def __exit__(self, *args):
+                self.file.close()
+
+        def getvalue(self):
+                position = self.file.tell()
+                self.file.seek(0)
+                value = self.file.read()
+                self.file.seek(position)
+                return value
+
+
+def resource_chunks(graph_id=None, resourceinstanceids=None, chunk_size=None, first=None, last=None):
+        # Yields lists of (resourceinstance, tiles) pairs, chunk_size resources at a time, paging
+        # through the resources in id order so only one chunk is ever held in memory. If first
+        # and/or last are given, only resources with ids in that range (inclusive) are included.
+        if chunk_size is None:
+                chunk_size = getattr(settings, "EXPORT_CHUNK_SIZE", 1000)
+        if resourceinstanceids is not None:
+                resources = ResourceInstance.objects.filter(resourceinstanceid__in=resourceinstanceids)
+        else:
+                resources = ResourceInstance.objects.filter(graph_id=graph_id)
+        if not(first is None):
+                resources = resources.filter(resourceinstanceid__gte=first)
+        if not(last is None):
+                resources = resources.filter(resourceinstanceid__lte=last)
+        resources = resources.order_by("resourceinstanceid")
+        previous = None
+        while True:
+                page = resources
+                if not(previous is None):
+                        page = page.filter(resourceinstanceid__gt=previous)
+                ids = list(page.values_list("resourceinstanceid", flat=True)[:chunk_size])
+                if len(ids) == 0:
+                        break
+                previous = ids[-1]
+                instances = ResourceInstance.objects.in_bulk(ids)
+                tiles = {}
+                for tile in TileModel.objects.filter(resourceinstance_id__in=ids).order_by("resourceinstance_id", "sortorder"):
+                        if not(tile.resourceinstance_id in tiles):
+                                tiles[tile.resourceinstance_id] = []
+                        tiles[tile.resourceinstance_id].append(tile)
+                chunk = []
+                for id in ids:
+                        if not(id in tiles):
+                                continue
+                        chunk.append((instances[id], tiles[id]))
+                yield chunk
+
+
+def write_shard(graph_id, first, last, path, compression):
+        # Worker function for JsonLWriter.write_shards, run in a separate process. Writes the resources
+        # of a graph with ids from first to last (inclusive) to a file, and returns its manifest entry.
+        writer = JsonLWriter()
+        with open_compressed(path, compression) as dest:
+                count = writer.write_jsonl(dest, graph_id=graph_id, first=first, last=last)
+        return {"file": os.path.basename(path), "resources": count, "first": str(first), "last": str(last), "bytes": os.path.getsize(path), "sha256": file_checksum(path)}
+
+
+class JsonLWriter(IncrementalExportMixin, Writer):
         def __init__(self, **kwargs):
                 self.type_cache = {}
                 super(JsonLWriter, self).__init__(**kwargs)
@@ -42,33 +151,87 @@ class JsonLWriter(Writer):
                 self.type_cache[sid] = str(node.datatype)
                 return self.type_cache[sid]
 
+        def resource_chunks(self, graph_id=None, resourceinstanceids=None, chunk_size=None, first=None, last=None):
+                return resource_chunks(graph_id=graph_id, resourceinstanceids=resourceinstanceids, chunk_size=chunk_size, first=first, last=last)
+
+        def write_jsonl(self, dest, graph_id=None, resourceinstanceids=None, first=None, last=None):
+                # Writes one line of JSON per resource to an open text stream, and returns the number
+                # of resources written.
+                count = 0
+                serializer = JSONSerializer()
+                for chunk in self.resource_chunks(graph_id=graph_id, resourceinstanceids=resourceinstanceids, first=first, last=last):
+                        for resourceinstance, tiles in chunk:
+                                dest.write(serializer.serialize({"tiles": tiles, "resourceinstance": resourceinstance}))
+                                dest.write("\n")
+                                count = count + 1
+                return count
+
         def write_resources(self, graph_id=None, resourceinstanceids=None, **kwargs):
-                super(JsonLWriter, self).write_resources(graph_id=graph_id, resourceinstanceids=resourceinstanceids, **kwargs)
+                self.prepare_export(graph_id=graph_id, resourceinstanceids=resourceinstanceids)
+                incremental = self.is_incremental(**kwargs)
+                if incremental:
+                        resourceinstanceids = self.get_changes(self.graph_id, **kwargs)
 
                 json_for_export = []
-                resources = []
-                relations = []
-                export = {}
-                export["business_data"] = {}
 
                 if str(self.graph_id) != settings.SYSTEM_SETTINGS_RESOURCE_MODEL_ID:
                         json_name = os.path.join("{0}.{1}".format(self.file_name, "jsonl"))
                 else:
                         json_name = os.path.join("{0}".format(os.path.basename(settings.SYSTEM_SETTINGS_LOCAL_PATH)))
 
-                dest = TemporaryFile(mode='w+', suffix='.jsonl')
-
-                for resourceinstanceid, tiles in self.resourceinstances.items():
-                        resourceinstanceid = uuid.UUID(str(resourceinstanceid))
-                        resource = {}
-                        resource["tiles"] = tiles
-                        resource["resourceinstance"] = ResourceInstance.objects.get(resourceinstanceid=resourceinstanceid)
-                        jl = JSONDeserializer().deserialize(JSONSerializer().serialize(JSONSerializer().serializeToPython(resource)))
-
-                        json.dump(jl, dest)
-                        dest.write('\n')
+                dest = ExportFile(mode='w+', suffix='.jsonl')
+                self.write_jsonl(dest, graph_id=self.graph_id, resourceinstanceids=resourceinstanceids)
+                dest.seek(0)
 
                 json_for_export.append({"name": json_name, "outputfile": dest})
+                if incremental:
+                        json_for_export.append(self.write_tombstones())
 
                 return json_for_export
 
+        def write_shards(self, dest_dir, graph_id, shards=1, workers=1, compression="gzip"):
+                """Exports every resource of a graph to dest_dir as a set of JSONL files, each covering a
+                contiguous range of resource ids, written in parallel by a pool of worker processes. The
+                files are in the same format as write_resources, so they can be concatenated or imported
+                separately. A manifest listing the files, with their resource counts and SHA-256 checksums,
+                is written alongside them. Returns the manifest."""
+                if not(compression in COMPRESSION_EXTENSIONS):
+                        raise ValueError("Unknown compression: " + str(compression))
+                self.prepare_export(graph_id=graph_id)
+                ids = list(ResourceInstance.objects.filter(graph_id=graph_id).order_by("resourceinstanceid").values_list("resourceinstanceid", flat=True))
+                shards = max(1, min(int(shards), len(ids)))
+                size = max(1, int((len(ids) + shards - 1) / shards))
+                ranges = []
+                for i in range(0, len(ids), size):
+                        ranges.append([ids[i], ids[min(i + size, len(ids)) - 1]])
+
+                paths = []
+                for i in range(0, len(ranges)):
+                        paths.append(os.path.join(dest_dir, "{0}_{1:04d}.jsonl{2}".format(self.file_name, i + 1, COMPRESSION_EXTENSIONS[compression])))
+
+                results = []
+                if ((workers > 1) and (len(ranges) > 1)):
+                        connections.close_all()
+                        context = multiprocessing.get_context("fork")
+                        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+                                futures = []
+                                for i in range(0, len(ranges)):
+                                        futures.append(pool.submit(write_shard, self.graph_id, ranges[i][0], ranges[i][1], paths[i], compression))
+                                for future in futures:
+                                        results.append(future.result())
+                else:
+                        for i in range(0, len(ranges)):
+                                results.append(write_shard(self.graph_id, ranges[i][0], ranges[i][1], paths[i], compression))
+
+                manifest = {
+                        "graph_id": str(self.graph_id),
+                        "graph": str(self.graph_model.name),
+                        "format": "jsonl",
+                        "compression": compression,
+                        "created": datetime.datetime.now().isoformat(),
+                        "resources": sum([shard["resources"] for shard in results]),
+                        "shards": results,
+                }
+                with open(os.path.join(dest_dir, "{0}.manifest.json".format(self.file_name)), "w") as fp:
+                        json.dump(manifest, fp, indent=2)
+                return manifest
@@ -0,0 +1,182 @@
+"""
+Builds framed JSON-LD for a resource directly from the rdflib graph made by RdfWriter.get_rdf_graph.
+
+JsonLdWriter normally serialises the graph to N-Quads, parses it back with pyld's from_rdf, and then
+frames it on the resource URI. The functions here produce the same tree by converting the triples
+straight into a JSON-LD node map, embedding it from the resource node the way pyld's framing does
+(@embed @last, no circular embeds, blank node identifiers pruned), and compacting the result.
+"""
+
+import copy
+from pyld.jsonld import compact
+from rdflib import BNode, Literal
+from rdflib.namespace import RDF
+
+XSD_BOOLEAN = "http://www.w3.org/2001/XMLSchema#boolean"
+XSD_DOUBLE = "http://www.w3.org/2001/XMLSchema#double"
+XSD_INTEGER = "http://www.w3.org/2001/XMLSchema#integer"
+XSD_STRING = "http://www.w3.org/2001/XMLSchema#string"
+
+
+def term_id(term):
+    if isinstance(term, BNode):
+        return "_:" + str(term)
+    return str(term)
+
+
+def is_numeric(value):
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+
+def literal_object(literal, use_native_types=True):
+    # Same conversion as pyld's _rdf_to_object
+    value = {"@value": str(literal)}
+    if literal.language:
+        value["@language"] = literal.language
+        return value
+    datatype = XSD_STRING if literal.datatype is None else str(literal.datatype)
+    if use_native_types:
+        if datatype == XSD_BOOLEAN:
+            if value["@value"] == "true":
+                value["@value"] = True
+            elif value["@value"] == "false":
+                value["@value"] = False
+        elif is_numeric(value["@value"]):
+            if datatype == XSD_INTEGER:
+                if value["@value"].isdigit():
+                    value["@value"] = int(value["@value"])
+            elif datatype == XSD_DOUBLE:
+                value["@value"] = float(value["@value"])
+        if datatype not in [XSD_BOOLEAN, XSD_INTEGER, XSD_DOUBLE, XSD_STRING]:
+            value["@type"] = datatype
+    elif datatype != XSD_STRING:
+        value["@type"] = datatype
+    return value
+
+
+def add_value(node, prop, value):
+    values = node.setdefault(prop, [])
+    if value not in values:
+        values.append(value)
+
+
+def node_map(g, use_native_types=True):
+    """Converts an rdflib graph into a JSON-LD node map ({id: node}), with properties in the order
+    the N-Quads serialiser would write them."""
+    nodes = {}
+    if hasattr(g, "contexts"):
+        triples = (triple for context in g.contexts() for triple in context)
+    else:
+        triples = iter(g)
+    for s, p, o in triples:
+        sid = term_id(s)
+        if sid not in nodes:
+            nodes[sid] = {"@id": sid}
+        node = nodes[sid]
+        if isinstance(o, Literal):
+            add_value(node, str(p), literal_object(o, use_native_types))
+            continue
+        oid = term_id(o)
+        if oid not in nodes:
+            nodes[oid] = {"@id": oid}
+        if p == RDF.type:
+            add_value(node, "@type", oid)
+        else:
+            add_value(node, str(p), {"@id": oid})
+    return nodes
+
+
+def frame_node_map(nodes, root_id):
+    """Embeds a node map into a tree, starting from root_id, following pyld's framing rules for a
+    frame of {"@id": root_id}: each node is embedded at the last place it is referenced, nodes are
+    never embedded inside themselves, and blank node identifiers are only kept where a blank node
+    is referenced more than once. Returns the expanded tree, or None if root_id isn't in the map."""
+    if root_id not in nodes:
+        return None
+    embeds = {}
+    stack = []
+    bnodes = {}
+
+    def add_output(parent, prop, output):
+        if isinstance(parent, list):
+            parent.append(output)
+        else:
+            parent.setdefault(prop, []).append(output)
+
+    def remove_embed(id_):
+        parent, prop = embeds[id_]
+        reference = {"@id": id_}
+        if isinstance(parent, list):
+            for i in range(0, len(parent)):
+                if parent[i].get("@id") == id_:
+                    parent[i] = reference
+                    break
+        else:
+            parent[prop] = [value for value in parent.get(prop, []) if value.get("@id") != id_]
+            parent[prop].append(reference)
+
+        def remove_dependents(id_):
+            for next_id in list(embeds.keys()):
+                if next_id in embeds and isinstance(embeds[next_id][0], dict) and embeds[next_id][0].get("@id") == id_:
+                    del embeds[next_id]
+                    remove_dependents(next_id)
+
+        remove_dependents(id_)
+
+    def match(id_, parent, prop):
+        subject = nodes[id_]
+        output = {"@id": id_}
+        if id_.startswith("_:"):
+            bnodes.setdefault(id_, []).append(output)
+        if id_ in stack[:-1]:
+            add_output(parent, prop, output)
+            return
+        if id_ in embeds:
+            remove_embed(id_)
+        embeds[id_] = (parent, prop)
+        stack.append(id_)
+        for key in sorted(subject.keys()):
+            if key.startswith("@"):
+                output[key] = copy.deepcopy(subject[key])
+                continue
+            for value in subject[key]:
+                if "@id" in value:
+                    match(value["@id"], output, key)
+                else:
+                    add_output(output, key, copy.deepcopy(value))
+        add_output(parent, prop, output)
+        stack.pop()
+
+    framed = []
+    match(root_id, framed, None)
+
+    for id_, outputs in bnodes.items():
+        if len(outputs) == 1:
+            clear_id(framed, id_)
+    return framed
+
+
+def clear_id(value, id_):
+    if isinstance(value, list):
+        for item in value:
+            clear_id(item, id_)
+    elif isinstance(value, dict):
+        if value.get("@id") == id_:
+            del value["@id"]
+        for key, item in value.items():
+            if not key.startswith("@"):
+                clear_id(item, id_)
+
+
+def build_framed_jsonld(g, root_id, context=None):
+    """Returns the compacted JSON-LD tree for the resource root_id in rdflib graph g, or None if
+    the resource has no triples."""
+    framed = frame_node_map(node_map(g), root_id)
+    if framed is None:
+        return None
+    ctx = {"@context": context} if context else {}
+    return compact(framed, ctx)
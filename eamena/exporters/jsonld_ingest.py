@@ -0,0 +1,159 @@
+"""
+Bulk import of JSON-LD documents. Documents are read from a directory of .json/.jsonld files or from
+a JSONL file (optionally gzipped), expanded and matched to the graph by JsonLdReader in a pool of
+worker processes, and the resulting resources are saved in batches with Resource.bulk_save by the
+parent process, which is the only one that writes to the database.
+"""
+
+import os
+import json
+import gzip
+import logging
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from django.db import connections, transaction
+from arches.app.models.models import GraphModel
+from arches.app.models.resource import Resource
+from arches.app.models.tile import Tile
+from eamena.exporters.rdf import JsonLdReader
+
+logger = logging.getLogger(__name__)
+
+# The reader used by read_batch, made once per worker process
+workerState = {}
+
+
+def read_documents(source):
+    """Yields [name, text] for every JSON-LD document in a directory (one document, or a list of them,
+    per file) or in a JSONL file (one per line)."""
+    if os.path.isdir(source):
+        for filename in sorted(os.listdir(source)):
+            if not (filename.endswith(".json") or filename.endswith(".jsonld")):
+                continue
+            with open(os.path.join(source, filename), "r") as fp:
+                yield [filename, fp.read()]
+        return
+    opener = gzip.open if source.endswith(".gz") else open
+    with opener(source, "rt") as fp:
+        for lineno, line in enumerate(fp, 1):
+            if len(line.strip()) > 0:
+                yield ["{0}:{1}".format(os.path.basename(source), lineno), line]
+
+
+def batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def tile_record(tile):
+    return {
+        "tileid": str(tile.tileid),
+        "parenttile_id": None if tile.parenttile_id is None else str(tile.parenttile_id),
+        "nodegroup_id": str(tile.nodegroup_id),
+        "data": tile.data,
+        "sortorder": tile.sortorder,
+    }
+
+
+def read_batch(batch, graphid, use_ids):
+    """Reads a list of [name, text] documents. Returns [resources, errors], where each resource is a dict
+    of its id, the document it came from and its tiles, and each error is a dict of document and message."""
+    reader = workerState.get("reader")
+    if reader is None:
+        reader = JsonLdReader(verbosity=0)
+        workerState["reader"] = reader
+    reader.graphtree = reader.process_graph(graphid)
+    resources = []
+    errors = []
+    for name, text in batch:
+        try:
+            data = json.loads(text)
+            reader.read_resource(data, use_ids=(use_ids or isinstance(data, list)), graphid=graphid)
+        except Exception as e:
+            errors.append({"document": name, "error": str(e)})
+            continue
+        for resource in reader.resources:
+            resources.append({"document": name, "resourceinstanceid": str(resource.pk), "tiles": [tile_record(tile) for tile in resource.tiles]})
+    return [resources, errors]
+
+
+def save_resources(records, graphid):
+    """Saves a batch of resources returned by read_batch in one transaction. If that fails, the resources
+    are saved one by one so that only the ones at fault are lost. Returns a list of errors."""
+    publication_id = GraphModel.objects.filter(pk=graphid).values_list("publication_id", flat=True).first()
+    resources = []
+    for record in records:
+        resource = Resource(resourceinstanceid=record["resourceinstanceid"], graph_id=graphid, graph_publication_id=publication_id)
+        resource.tiles = [Tile(resourceinstance_id=record["resourceinstanceid"], **tile) for tile in record["tiles"]]
+        resources.append(resource)
+    try:
+        with transaction.atomic():
+            Resource.bulk_save(resources=resources)
+    except Exception as e:
+        if len(records) == 1:
+            return [{"document": records[0]["document"], "resourceinstanceid": records[0]["resourceinstanceid"], "error": "Save failed: " + str(e)}]
+        # Save the resources one at a time, to find the ones that fail
+        logger.warning("Could not save a batch of " + str(len(records)) + " resources, retrying them individually: " + str(e))
+        errors = []
+        for record in records:
+            errors.extend(save_resources([record], graphid))
+        return errors
+    return []
+
+
+def import_documents(source, graphid, workers=1, batch_size=500, use_ids=False, dry_run=False):
+    """Imports every document in source into graph graphid. Documents are read in batches of batch_size
+    by `workers` processes; at most two batches per worker are in flight at a time, so memory use does
+    not grow with the size of the import. Returns a dict with the number of documents read, resources
+    saved, and a list of per-document errors."""
+    ret = {"documents": 0, "resources": 0, "errors": []}
+    pending = []
+
+    def collect(result):
+        resources, errors = result
+        ret["errors"].extend(errors)
+        pending.extend(resources)
+        while len(pending) >= batch_size:
+            flush(pending[:batch_size])
+            del pending[:batch_size]
+
+    def flush(records):
+        if dry_run:
+            ret["resources"] = ret["resources"] + len(records)
+            return
+        errors = save_resources(records, graphid)
+        ret["errors"].extend(errors)
+        ret["resources"] = ret["resources"] + len(records) - len(errors)
+
+    def counted(documents):
+        for document in documents:
+            ret["documents"] = ret["documents"] + 1
+            yield document
+
+    documents = batches(counted(read_documents(source)), batch_size)
+    if workers <= 1:
+        for batch in documents:
+            collect(read_batch(batch, graphid, use_ids))
+    else:
+        # Build the graph tree before forking, so every worker inherits it
+        JsonLdReader(verbosity=0).process_graph(graphid)
+        connections.close_all()
+        context = multiprocessing.get_context("fork")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            futures = deque()
+            for batch in documents:
+                futures.append(pool.submit(read_batch, batch, graphid, use_ids))
+                if len(futures) >= workers * 2:
+                    collect(futures.popleft().result())
+            while futures:
+                collect(futures.popleft().result())
+    if len(pending) > 0:
+        flush(pending)
+    return ret
@@ -2,8 +2,7 @@ import os
 import re
 import json
 import uuid
-import requests
-import datetime
+import pickle
 import logging
 from io import StringIO
 from django.urls import reverse
@@ -17,6 +16,10 @@ from arches.app.models.concept import Concept
 from arches.app.models.system_settings import settings
 from arches.app.datatypes.datatypes import DataTypeFactory
 from arches.app.utils.betterJSONSerializer import JSONSerializer, JSONDeserializer
+from eamena.exporters.changes import IncrementalExportMixin
+from eamena.exporters.contexts import ContextStore
+from eamena.exporters.jsonl import ExportFile, resource_chunks
+from eamena.exporters.jsonld import build_framed_jsonld
 from rdflib import Namespace
 from rdflib import URIRef, Literal
 from rdflib import ConjunctiveGraph as Graph
@@ -24,55 +27,142 @@ from rdflib.namespace import RDF, RDFS
 from pyld.jsonld import compact, frame, from_rdf, to_rdf, expand, set_document_loader
 
 
-# Stop code from looking up the contexts online for every operation
-docCache = {}
-
-
-def fetch(url):
-    resp = requests.get(url)
-    return resp.json()
-
-
-def use_cache(url):
-    if docCache[url]["expires"] is not None and docCache[url]["expires"] < datetime.datetime.now():
-        return False
-    else:
-        return True
+# Stop code from looking up the contexts online for every operation: contexts come from the bundled
+# and on-disk context store, and are only refreshed in the background
+contextStore = ContextStore()
 
 
 # PyLD 2.0 / JSON-LD 1.1 passes two params, we don't need the second
 def load_document_and_cache(url, cache=None):
-    if url in docCache and use_cache(url):
-        return docCache[url]
-
-    doc = {"expires": None, "contextUrl": None, "documentUrl": None, "document": ""}
-    data = fetch(url)
-    doc["document"] = data
-    doc["expires"] = datetime.datetime.now() + datetime.timedelta(minutes=settings.JSONLD_CONTEXT_CACHE_TIMEOUT)
-    docCache[url] = doc
-    return doc
+    return contextStore.load_document(url)
 
 
 set_document_loader(load_document_and_cache)
 
 
-class RdfWriter(Writer):
+# Graph topology (edges per nodegroup and node datatypes) is cached per graph for the lifetime of the
+# process, and reloaded if the graph is republished
+graphCache = {}
+
+
+def load_graph_parts(graphid):
+    nodes = {}
+    for node in models.Node.objects.filter(graph_id=graphid):
+        nodes[str(node.nodeid)] = node
+    edges_by_domain = {}
+    edges_by_range = {}
+    for edge in models.Edge.objects.filter(graph_id=graphid).select_related("domainnode", "rangenode").order_by("edgeid"):
+        edges_by_domain.setdefault(str(edge.domainnode_id), []).append(edge)
+        edges_by_range[str(edge.rangenode_id)] = edge
+
+    def get_nodegroup_edges_by_collector_node(node):
+        edges = []
+        nodegroup_id = node.nodegroup_id
+
+        def getchildedges(nodeid):
+            for edge in edges_by_domain.get(nodeid, []):
+                if nodegroup_id == edge.rangenode.nodegroup_id:
+                    edges.append(edge)
+                    getchildedges(str(edge.rangenode_id))
+
+        getchildedges(str(node.nodeid))
+        return edges
+
+    parts = {"rootedges": [], "subgraphs": {}, "nodedatatypes": {}}
+    nodegroups = set()
+    for nodeid, node in nodes.items():
+        parts["nodedatatypes"][nodeid] = node.datatype
+        if node.nodegroup_id:
+            nodegroups.add(str(node.nodegroup_id))
+        if node.istopnode:
+            for edge in get_nodegroup_edges_by_collector_node(node):
+                if edge.rangenode.nodegroup_id is None:
+                    parts["rootedges"].append(edge)
+    for nodegroup_id in nodegroups:
+        inedge = edges_by_range[nodegroup_id]
+        parts["subgraphs"][nodegroup_id] = {
+            "edges": get_nodegroup_edges_by_collector_node(nodes[nodegroup_id]),
+            "inedge": inedge,
+            "parentnode_nodegroup": inedge.domainnode.nodegroup_id,
+        }
+    return parts
+
+
+def get_graph_parts(graphid):
+    key = str(graphid)
+    publication_id = models.GraphModel.objects.filter(pk=graphid).values_list("publication_id", flat=True).first()
+    if key not in graphCache or graphCache[key]["publication_id"] != publication_id:
+        graphCache[key] = {"publication_id": publication_id, "parts": load_graph_parts(graphid)}
+    return graphCache[key]["parts"]
+
+
+class RdfWriter(IncrementalExportMixin, Writer):
+    # Line-based formats, which can be written one resource at a time
+    streaming_formats = ["nt", "nquads"]
+
     def __init__(self, **kwargs):
         self.format = kwargs.pop("format", "xml")
+        self.stream = kwargs.pop("stream", getattr(settings, "RDF_EXPORT_STREAMING", True))
         self.logger = logging.getLogger(__name__)
         super(RdfWriter, self).__init__(**kwargs)
 
+    def write_rdf_stream(self, dest, graph_id=None, resourceinstanceids=None):
+        # Builds a small graph for each resource in turn, appends it to dest as N-Triples/N-Quads and
+        # throws it away, so memory use is bounded by the largest resource rather than the export.
+        # Returns the number of resources written.
+        count = 0
+        graph_info = get_graph_parts(self.graph_id)
+        for chunk in resource_chunks(graph_id=graph_id, resourceinstanceids=resourceinstanceids):
+            for resourceinstance, tiles in chunk:
+                g = self.get_rdf_graph({resourceinstance.resourceinstanceid: tiles}, graph_info)
+                value = g.serialize(format=self.format)
+                if isinstance(value, bytes):
+                    value = value.decode("utf-8")
+                dest.write(value)
+                count = count + 1
+        return count
+
     def write_resources(self, graph_id=None, resourceinstanceids=None, **kwargs):
-        super(RdfWriter, self).write_resources(graph_id=graph_id, resourceinstanceids=resourceinstanceids, **kwargs)
+        incremental = self.is_incremental(**kwargs)
+        if self.stream and self.format in self.streaming_formats:
+            self.prepare_export(graph_id=graph_id, resourceinstanceids=resourceinstanceids)
+            if incremental:
+                resourceinstanceids = self.get_changes(self.graph_id, **kwargs)
+            dest = ExportFile(mode="w+", suffix=".rdf")
+            if resourceinstanceids is None:
+                self.write_rdf_stream(dest, graph_id=self.graph_id)
+            else:
+                self.write_rdf_stream(dest, resourceinstanceids=resourceinstanceids)
+            dest.seek(0)
+        elif incremental:
+            self.prepare_export(graph_id=graph_id, resourceinstanceids=resourceinstanceids)
+            graph_id = self.graph_id
+            resourceinstanceids = self.get_changes(graph_id, **kwargs)
+            kwargs = {k: v for k, v in kwargs.items() if k not in ["since", "cursor"]}
+            if len(resourceinstanceids) == 0:
+                self.resourceinstances = {}
+            else:
+                super(RdfWriter, self).write_resources(graph_id=None, resourceinstanceids=resourceinstanceids, **kwargs)
+                self.prepare_export(graph_id=graph_id)
+        else:
+            super(RdfWriter, self).write_resources(graph_id=graph_id, resourceinstanceids=resourceinstanceids, **kwargs)
 
-        dest = StringIO()
-        g = self.get_rdf_graph()
-        g.serialize(destination=dest, format=self.format)
+        if not (self.stream and self.format in self.streaming_formats):
+            dest = StringIO()
+            g = self.get_rdf_graph()
+            g.serialize(destination=dest, format=self.format)
 
         full_file_name = os.path.join("{0}.{1}".format(self.file_name, "rdf"))
-        return [{"name": full_file_name, "outputfile": dest}]
-
-    def get_rdf_graph(self):
+        ret = [{"name": full_file_name, "outputfile": dest}]
+        if incremental:
+            ret.append(self.write_tombstones())
+        return ret
+
+    def get_rdf_graph(self, resourceinstances=None, graph_info=None):
+        # Builds an rdflib graph of the given {resourceinstanceid: tiles} (by default, everything
+        # loaded by write_resources). graph_info can be passed in when calling this repeatedly.
+        if resourceinstances is None:
+            resourceinstances = self.resourceinstances
         archesproject = Namespace(settings.ARCHES_NAMESPACE_FOR_DATA_EXPORT)
         graph_uri = URIRef(archesproject[reverse("graph", args=[self.graph_id]).lstrip("/")])
         self.logger.debug("Using `{0}` for Arches URI namespace".format(settings.ARCHES_NAMESPACE_FOR_DATA_EXPORT))
@@ -80,49 +170,6 @@ class RdfWriter(Writer):
 
         g = Graph()
         g.bind("archesproject", archesproject, False)
-        graph_cache = {}
-
-        def get_nodegroup_edges_by_collector_node(node):
-            edges = []
-            nodegroup = node.nodegroup
-
-            def getchildedges(node):
-                for edge in models.Edge.objects.filter(domainnode=node):
-                    if nodegroup == edge.rangenode.nodegroup:
-                        edges.append(edge)
-                        getchildedges(edge.rangenode)
-
-            getchildedges(node)
-            return edges
-
-        def get_graph_parts(graphid):
-            if graphid not in graph_cache:
-                graph_cache[graphid] = {
-                    "rootedges": [],
-                    "subgraphs": {},
-                    "nodedatatypes": {},
-                }
-                graph = models.GraphModel.objects.get(pk=graphid)
-                nodegroups = set()
-                for node in graph.node_set.all():
-                    graph_cache[graphid]["nodedatatypes"][str(node.nodeid)] = node.datatype
-                    if node.nodegroup:
-                        nodegroups.add(node.nodegroup)
-                    if node.istopnode:
-                        for edge in get_nodegroup_edges_by_collector_node(node):
-                            if edge.rangenode.nodegroup is None:
-                                graph_cache[graphid]["rootedges"].append(edge)
-                for nodegroup in nodegroups:
-                    graph_cache[graphid]["subgraphs"][nodegroup] = {"edges": [], "inedge": None, "parentnode_nodegroup": None}
-                    graph_cache[graphid]["subgraphs"][nodegroup]["inedge"] = models.Edge.objects.get(rangenode_id=nodegroup.pk)
-                    graph_cache[graphid]["subgraphs"][nodegroup]["parentnode_nodegroup"] = graph_cache[graphid]["subgraphs"][nodegroup][
-                        "inedge"
-                    ].domainnode.nodegroup
-                    graph_cache[graphid]["subgraphs"][nodegroup]["edges"] = get_nodegroup_edges_by_collector_node(
-                        models.Node.objects.get(pk=nodegroup.pk)
-                    )
-
-            return graph_cache[graphid]
 
         def add_edge_to_graph(graph, domainnode, rangenode, edge, tile, graph_info):
             pkg = {}
@@ -217,26 +264,32 @@ class RdfWriter(Writer):
 
 
 
-        for resourceinstanceid, tiles in self.resourceinstances.items():
+        if graph_info is None:
             graph_info = get_graph_parts(self.graph_id)
+        for resourceinstanceid, tiles in resourceinstances.items():
+            # point each tile at its parent from the same resource, so tile.parenttile doesn't query
+            tiles_by_id = {tile.pk: tile for tile in tiles}
+            for tile in tiles:
+                if tile.parenttile_id in tiles_by_id:
+                    tile.parenttile = tiles_by_id[tile.parenttile_id]
 
             # add the edges for the group of nodes that include the root (this group of nodes has no nodegroup)
-            for edge in graph_cache[self.graph_id]["rootedges"]:
+            for edge in graph_info["rootedges"]:
                 domainnode = archesproject[str(edge.domainnode.pk)]
                 rangenode = archesproject[str(edge.rangenode.pk)]
                 add_edge_to_graph(g, domainnode, rangenode, edge, None, graph_info)
 
             for tile in tiles:
                 # add all the edges for a given tile/nodegroup
-                for edge in graph_info["subgraphs"][tile.nodegroup]["edges"]:
+                for edge in graph_info["subgraphs"][str(tile.nodegroup_id)]["edges"]:
                     domainnode = archesproject["tile/%s/node/%s" % (str(tile.pk), str(edge.domainnode.pk))]
                     rangenode = archesproject["tile/%s/node/%s" % (str(tile.pk), str(edge.rangenode.pk))]
                     add_edge_to_graph(g, domainnode, rangenode, edge, tile, graph_info)
 
                 # add the edge from the parent node to this tile's root node
                 # where the tile has no parent tile, which means the domain node has no tile_id
-                if graph_info["subgraphs"][tile.nodegroup]["parentnode_nodegroup"] is None:
-                    edge = graph_info["subgraphs"][tile.nodegroup]["inedge"]
+                if graph_info["subgraphs"][str(tile.nodegroup_id)]["parentnode_nodegroup"] is None:
+                    edge = graph_info["subgraphs"][str(tile.nodegroup_id)]["inedge"]
                     if edge.domainnode.istopnode:
                         domainnode = archesproject[reverse("resources", args=[resourceinstanceid]).lstrip("/")]
                     else:
@@ -246,22 +299,20 @@ class RdfWriter(Writer):
 
                 # add the edge from the parent node to this tile's root node
                 # where the tile has a parent tile
-                if graph_info["subgraphs"][tile.nodegroup]["parentnode_nodegroup"] is not None:
-                    edge = graph_info["subgraphs"][tile.nodegroup]["inedge"]
-                    domainnode = archesproject["tile/%s/node/%s" % (str(tile.parenttile.pk), str(edge.domainnode.pk))]
+                if graph_info["subgraphs"][str(tile.nodegroup_id)]["parentnode_nodegroup"] is not None:
+                    edge = graph_info["subgraphs"][str(tile.nodegroup_id)]["inedge"]
+                    domainnode = archesproject["tile/%s/node/%s" % (str(tile.parenttile_id), str(edge.domainnode.pk))]
                     rangenode = archesproject["tile/%s/node/%s" % (str(tile.pk), str(edge.rangenode.pk))]
                     add_edge_to_graph(g, domainnode, rangenode, edge, tile, graph_info)
         return g
 
 
 class JsonLdWriter(RdfWriter):
-    def build_json(self, graph_id=None, resourceinstanceids=None, **kwargs):
-        # Build the JSON separately serializing it, so we can use internally
+    def build_json(self, graph_id=None, resourceinstanceids=None, direct=None, **kwargs):
+        # Build the JSON separately serializing it, so we can use internally. direct chooses between
+        # the direct builder and the N-Quads pipeline; None leaves it to JSONLD_DIRECT_BUILD
         super(RdfWriter, self).write_resources(graph_id=graph_id, resourceinstanceids=resourceinstanceids, **kwargs)
         g = self.get_rdf_graph()
-        value = g.serialize(format="nquads").decode("utf-8")
-
-        js = from_rdf(value, {"format": "application/nquads", "useNativeTypes": True})
 
         assert len(resourceinstanceids) == 1  # currently, this should be limited to a single top resource
 
@@ -269,6 +320,17 @@ class JsonLdWriter(RdfWriter):
         resource_inst_uri = archesproject[reverse("resources", args=[resourceinstanceids[0]]).lstrip("/")]
 
         context = self.graph_model.jsonldcontext
+
+        if direct is None:
+            direct = getattr(settings, "JSONLD_DIRECT_BUILD", True)
+        if direct:
+            # Frame the rdflib graph directly, rather than going via N-Quads and pyld's from_rdf
+            js = build_framed_jsonld(g, str(resource_inst_uri), context)
+            if js is not None:
+                return js
+
+        value = g.serialize(format="nquads").decode("utf-8")
+        js = from_rdf(value, {"format": "application/nquads", "useNativeTypes": True})
         framing = {"@omitDefault": True, "@omitGraph": False, "@id": str(resource_inst_uri)}
 
         if context:
@@ -302,6 +364,52 @@ class JsonLdWriter(RdfWriter):
         return [{"name": full_file_name, "outputfile": dest}]
 
 
+# Trees built by JsonLdReader.process_graph, keyed by graph id, with the publications of the graph and
+# the graphs it refers to that they were built from
+graphTreeCache = {}
+
+# Ontology class of the top node of each resource graph, with the publications they were read from
+rootClassCache = {"publications": None, "classes": {}}
+
+
+def get_root_ontology_classes():
+    publications = sorted([(str(graphid), str(publication_id)) for graphid, publication_id in models.GraphModel.objects.filter(isresource=True).values_list("graphid", "publication_id")])
+    if rootClassCache["publications"] != publications:
+        classes = {}
+        for graphid, ontologyclass in models.Node.objects.filter(graph__isresource=True, istopnode=True).values_list("graph_id", "ontologyclass"):
+            classes[str(graphid)] = ontologyclass
+        rootClassCache["publications"] = publications
+        rootClassCache["classes"] = classes
+    return dict(rootClassCache["classes"])
+
+
+def graph_tree_references(tree):
+    # The ids of the graphs that resource instance nodes in a graph tree refer to
+    ret = set()
+    seen = set()
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        for entry in node["config"].get("graphs", []):
+            ret.add(str(entry["graphid"]))
+        for children in node["children"].values():
+            stack.extend(children)
+    return sorted(ret)
+
+
+def graph_tree_current(entry, publications):
+    # Whether a graph tree was built from the current publications of its graph and the graphs it refers to
+    return all([publications.get(gid) == publication_id for gid, publication_id in entry["publications"].items()])
+
+
+# Concept collection membership, shared by every JsonLdReader in the process when
+# JSONLD_SHARED_COLLECTION_CACHE is set. Collections are only re-read when the process restarts.
+collectionCache = {}
+
+
 class JsonLdReader(Reader):
     def __init__(self, *args, **kwargs):
         super(JsonLdReader, self).__init__(*args, **kwargs)
@@ -314,23 +422,103 @@ class JsonLdReader(Reader):
         self.print_buf = []
         self.verbosity = kwargs.get("verbosity", 1)
         self.ignore_errors = kwargs.get("ignore_errors", False)
+        self.collection_cache = {}
+        self.shared_collection_cache = kwargs.get("shared_collection_cache", getattr(settings, "JSONLD_SHARED_COLLECTION_CACHE", False))
+        self.graph_tree_dir = kwargs.get("graph_tree_dir", getattr(settings, "JSONLD_GRAPH_TREE_DIR", ""))
         self.logger = logging.getLogger(__name__)
-        for graph in models.GraphModel.objects.filter(isresource=True):
-            node = models.Node.objects.get(graph_id=graph.pk, istopnode=True)
-            self.root_ontologyclass_lookup[str(graph.pk)] = node.ontologyclass
+        self.root_ontologyclass_lookup = get_root_ontology_classes()
         self.logger.info("Initialized JsonLdReader")
 
+    def collection_identifiers(self, collection):
+        # The concept ids and identifier values of every concept in a collection, worked out once per
+        # collection for this reader (and for the whole process, if shared_collection_cache is set)
+        collection = str(collection)
+        if collection in self.collection_cache:
+            return self.collection_cache[collection]
+        if self.shared_collection_cache and collection in collectionCache:
+            ids = collectionCache[collection]
+        else:
+            cdata = Concept().get_child_collections(collection, columns="conceptidto")
+            concept_ids = [str(x[0]) for x in cdata]
+            values = models.Value.objects.filter(concept_id__in=concept_ids, valuetype__category="identifiers").values_list("value", flat=True)
+            ids = frozenset(concept_ids + [str(x) for x in values])
+            if self.shared_collection_cache:
+                collectionCache[collection] = ids
+        self.collection_cache[collection] = ids
+        return ids
+
     def validate_concept_in_collection(self, value, collection):
-        cdata = Concept().get_child_collections(collection, columns="conceptidto")
-        ids = [str(x[0]) for x in cdata]
-        for c in cdata:
-            cids = [x.value for x in models.Value.objects.all().filter(concept_id__exact=c[0], valuetype__category="identifiers")]
-            ids.extend(cids)
         if value.startswith(settings.ARCHES_NAMESPACE_FOR_DATA_EXPORT):
             value = value.rsplit("/", 1)[-1]
-        return str(value) in ids
+        return str(value) in self.collection_identifiers(collection)
 
     def process_graph(self, graphid):
+        # The tree for each published version of a graph is built once per process, or loaded from
+        # graph_tree_dir if an earlier process saved it there. Trees hold the root classes of the graphs
+        # they refer to, so they're also rebuilt when one of those is published again
+        key = str(graphid)
+        self.root_ontologyclass_lookup = get_root_ontology_classes()
+        publications = dict(rootClassCache["publications"])
+        if key in graphTreeCache and graph_tree_current(graphTreeCache[key], publications):
+            return graphTreeCache[key]["tree"]
+        path = ""
+        if len(self.graph_tree_dir or "") > 0:
+            path = os.path.join(self.graph_tree_dir, "{0}_{1}.pickle".format(key, publications.get(key)))
+        entry = None
+        if len(path) > 0 and os.path.exists(path):
+            try:
+                entry = self.load_graph_tree(path)
+            except Exception as e:
+                self.logger.warning("Could not load graph tree from {0}: {1}".format(path, e))
+            if not (isinstance(entry, dict) and "publications" in entry and graph_tree_current(entry, publications)):
+                entry = None
+        if entry is None:
+            tree = self.build_graph_tree(graphid)
+            references = [key] + graph_tree_references(tree)
+            entry = {"publications": dict([(gid, publications.get(gid)) for gid in references]), "tree": tree}
+            if len(path) > 0:
+                try:
+                    self.save_graph_tree(entry, path)
+                except OSError as e:
+                    self.logger.warning("Could not save graph tree to {0}: {1}".format(path, e))
+        graphTreeCache[key] = entry
+        return entry["tree"]
+
+    def save_graph_tree(self, entry, path):
+        # Saves a graph tree and the publications it was built from. Datatype instances aren't pickled;
+        # they are stored by name and taken from the datatype factory again when the tree is loaded
+        datatypes = {}
+        seen = set()
+        stack = [entry["tree"]]
+        while stack:
+            node = stack.pop()
+            if id(node) in seen:
+                continue
+            seen.add(id(node))
+            datatypes[id(node["datatype"])] = node["datatype_type"]
+            for children in node["children"].values():
+                stack.extend(children)
+
+        class TreePickler(pickle.Pickler):
+            def persistent_id(self, obj):
+                return datatypes.get(id(obj))
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path + ".tmp", "wb") as fp:
+            TreePickler(fp, protocol=pickle.HIGHEST_PROTOCOL).dump(entry)
+        os.replace(path + ".tmp", path)
+
+    def load_graph_tree(self, path):
+        datatype_factory = self.datatype_factory
+
+        class TreeUnpickler(pickle.Unpickler):
+            def persistent_load(self, pid):
+                return datatype_factory.get_instance(pid)
+
+        with open(path, "rb") as fp:
+            return TreeUnpickler(fp).load()
+
+    def build_graph_tree(self, graphid):
         root_node = None
         nodes = {}
         graph = GraphProxy.objects.get(graphid=graphid)
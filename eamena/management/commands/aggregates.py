@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from eamena.statistics.aggregates import rebuild_aggregates, get_aggregates
+import logging, sys, json
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+	"""
+	Maintains the Heritage Place counts served by /statistics/aggregates. --rebuild recomputes them from
+	scratch (needed once after installation, and after bulk imports that bypass tile saves); --show
+	writes the current counts to standard output as JSON.
+
+
+	"""
+	def add_arguments(self, parser):
+
+		parser.add_argument(
+			"--rebuild", action="store_true", dest="rebuild", default=False, help="Recompute the counts.",
+		)
+
+		parser.add_argument(
+			"--show", action="store_true", dest="show", default=False, help="Write the counts to standard output.",
+		)
+
+		parser.add_argument(
+			"-b", "--batch-size", action="store", dest="batch_size", type=int, default=1000, help="Number of resources read at a time when rebuilding.",
+		)
+
+	def handle(self, *args, **options):
+
+		if not(options['rebuild'] or options['show']):
+			raise CommandError("Nothing to do. Use --rebuild and/or --show")
+
+		if options['rebuild']:
+			done = 0
+			for done in rebuild_aggregates(batch_size=max(1, options['batch_size'])):
+				sys.stderr.write("\rCounted " + str(done) + " resources")
+			sys.stderr.write("\rCounted " + str(done) + " resources\n")
+
+		if options['show']:
+			self.stdout.write(json.dumps(get_aggregates(), indent=2))
@@ -89,6 +89,16 @@ class Command(BaseCommand):
 			"-d", "--dest_dir", action="store", dest="dest_dir", default="", help="Directory where you want to save exported files. Omitting this argument dumps to STDOUT."
 		)
 
+		parser.add_argument(
+			"-p",
+			"--workers",
+			action="store",
+			dest="workers",
+			type=int,
+			default=getattr(settings, 'BULK_UPLOAD_WORKERS', 1),
+			help="Number of processes to use when converting and validating resources. The default is 1, which does everything in this process.",
+		)
+
 		parser.add_argument(
 			"-g",
 			"--graph",
@@ -119,13 +129,13 @@ class Command(BaseCommand):
 			self.__error("", "No operation selected. Use --operation")
 
 		if options['operation'] == 'convert':
-			data = convert(options['graph'], options['source'], options['bus_language'], options['warn_mode'], (options['append_mode'] == 'append'))
+			data = convert(options['graph'], options['source'], options['bus_language'], options['warn_mode'], (options['append_mode'] == 'append'), options['workers'])
 
 		if options['operation'] == 'validate':
-			data = validate(options['graph'], options['source'], options['bus_language'], options['warn_mode'], (options['append_mode'] == 'append'))
+			data = validate(options['graph'], options['source'], options['bus_language'], options['warn_mode'], (options['append_mode'] == 'append'), options['workers'])
 
 		if options['operation'] == 'prerequisites':
-			data = prerequisites(options['graph'], options['source'], options['bus_language'], options['warn_mode'], (options['append_mode'] == 'append'))
+			data = prerequisites(options['graph'], options['source'], options['bus_language'], options['warn_mode'], (options['append_mode'] == 'append'), options['workers'])
 
 		if options['operation'] == 'unflatten':
 			data = unflatten(options['graph'], options['source'], options['bus_language'], options['warn_mode'], (options['append_mode'] == 'append'))
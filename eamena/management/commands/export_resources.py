@@ -0,0 +1,108 @@
+from django.core.management.base import BaseCommand, CommandError
+from arches.app.models.system_settings import settings
+from eamena.exporters.jsonl import JsonLWriter, COMPRESSION_EXTENSIONS, open_compressed
+from eamena.exporters.rdf import RdfWriter
+from eamena.exporters.columnar import ColumnarWriter, COLUMNAR_EXTENSIONS
+import logging, sys, os, json, shutil
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+	"""
+	Exports all the resources of a graph as a set of compressed JSONL files, in parallel, or just
+	the resources that have changed since a given time or since the last run. Can also export a
+	graph as a single GeoParquet or FlatGeobuf table, one row per resource
+
+
+	"""
+	def add_arguments(self, parser):
+
+		parser.add_argument(
+			"-g", "--graph", action="store", dest="graph", default="", help="The graphid of the resources you would like to export.",
+		)
+
+		parser.add_argument(
+			"-d", "--dest_dir", action="store", dest="dest_dir", default="", help="Directory where you want to save exported files.",
+		)
+
+		parser.add_argument(
+			"-n", "--shards", action="store", dest="shards", type=int, default=0, help="Number of files to split the export into. Defaults to the number of workers.",
+		)
+
+		parser.add_argument(
+			"-p", "--workers", action="store", dest="workers", type=int, default=1, help="Number of worker processes.",
+		)
+
+		parser.add_argument(
+			"-c",
+			"--compression",
+			action="store",
+			dest="compression",
+			default="gzip",
+			choices=list(COMPRESSION_EXTENSIONS.keys()),
+			help="Compression for the exported files; 'zstd' needs the zstandard package.",
+		)
+
+		parser.add_argument(
+			"-f", "--format", action="store", dest="format", default="jsonl", choices=["jsonl", "nt", "n3", "parquet", "fgb"], help="Export format. GeoParquet (parquet) and FlatGeobuf (fgb) exports are written as a single uncompressed file.",
+		)
+
+		parser.add_argument(
+			"--since", action="store", dest="since", default="", help="Only export resources changed after this ISO 8601 timestamp. Deleted resources are listed in a separate .deleted.jsonl file.",
+		)
+
+		parser.add_argument(
+			"--cursor", action="store", dest="cursor", default="", help="A JSON file recording when each graph was last exported. Only resources changed since then are exported, and the file is updated afterwards.",
+		)
+
+	def handle(self, *args, **options):
+
+		if len(options['graph']) == 0:
+			raise CommandError("No graph selected. Use --graph")
+		if not(os.path.isdir(options['dest_dir'])):
+			raise CommandError("Output path is not a directory: " + options['dest_dir'])
+
+		workers = max(1, options['workers'])
+		shards = options['shards']
+		if shards < 1:
+			shards = workers
+
+		if options['format'] in COLUMNAR_EXTENSIONS:
+			writer = ColumnarWriter(format=options['format'])
+			if ((len(options['since']) > 0) or (len(options['cursor']) > 0)):
+				exports = writer.write_resources(graph_id=options['graph'], since=(options['since'] or None), cursor=options['cursor'])
+			else:
+				writer.prepare_export(graph_id=options['graph'])
+				path = os.path.join(options['dest_dir'], writer.file_name + "." + COLUMNAR_EXTENSIONS[options['format']])
+				count = writer.write_file(path, graph_id=options['graph'])
+				self.stdout.write(os.path.basename(path) + "\t" + str(count))
+				return
+			for item in exports:
+				path = os.path.join(options['dest_dir'], item['name'])
+				item['outputfile'].seek(0)
+				with open(path, 'wb') as fp:
+					data = item['outputfile'].read()
+					fp.write(data.encode('utf-8') if isinstance(data, str) else data)
+				self.stdout.write(os.path.basename(path))
+			writer.commit_cursor()
+			return
+
+		if ((len(options['since']) > 0) or (len(options['cursor']) > 0) or (options['format'] != 'jsonl')):
+			if options['format'] == 'jsonl':
+				writer = JsonLWriter()
+			else:
+				writer = RdfWriter(format=options['format'])
+			exports = writer.write_resources(graph_id=options['graph'], since=(options['since'] or None), cursor=options['cursor'])
+			for item in exports:
+				path = os.path.join(options['dest_dir'], item['name'] + COMPRESSION_EXTENSIONS[options['compression']])
+				item['outputfile'].seek(0)
+				with open_compressed(path, options['compression']) as fp:
+					shutil.copyfileobj(item['outputfile'], fp)
+				self.stdout.write(os.path.basename(path))
+			writer.commit_cursor()
+			return
+
+		manifest = JsonLWriter().write_shards(options['dest_dir'], options['graph'], shards=shards, workers=workers, compression=options['compression'])
+		for shard in manifest['shards']:
+			self.stdout.write(shard['file'] + "\t" + str(shard['resources']) + "\t" + shard['sha256'])
+		self.stdout.write("Exported " + str(manifest['resources']) + " resources in " + str(len(manifest['shards'])) + " files.")
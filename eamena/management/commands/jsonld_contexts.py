@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand, CommandError
+from arches.app.models.models import GraphModel
+from eamena.exporters.contexts import ContextStore, read_index
+import logging, sys
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+	"""
+	Downloads JSON-LD contexts into the context store used by the RDF exporters, so that exports
+	don't need to fetch them. With --bundle, the contexts are added to the set shipped with the
+	package; otherwise they are saved in the on-disk cache (JSONLD_CONTEXT_DIR).
+
+
+	"""
+	def add_arguments(self, parser):
+
+		parser.add_argument(
+			"urls", nargs="*", help="URLs of the contexts to download.",
+		)
+
+		parser.add_argument(
+			"--graphs", action="store_true", dest="graphs", default=False, help="Also download the contexts used by any of the resource models.",
+		)
+
+		parser.add_argument(
+			"--refresh", action="store_true", dest="refresh", default=False, help="Also re-check every context that is already bundled with the package.",
+		)
+
+		parser.add_argument(
+			"--bundle", action="store_true", dest="bundle", default=False, help="Add the contexts to the set bundled with the package.",
+		)
+
+	def handle(self, *args, **options):
+
+		store = ContextStore(offline=False)
+		urls = list(options['urls'])
+		if options['graphs']:
+			for context in GraphModel.objects.filter(isresource=True).values_list('jsonldcontext', flat=True):
+				if ((isinstance(context, str)) and (context.startswith('http'))):
+					urls.append(context)
+		if options['refresh']:
+			urls = urls + list(read_index(store.bundled_dir).keys())
+		if len(urls) == 0:
+			raise CommandError("No contexts to download. Give one or more URLs, or use --graphs or --refresh")
+
+		failed = 0
+		for url in sorted(set(urls)):
+			try:
+				if options['bundle']:
+					store.bundle(url)
+				else:
+					store.fetch(url, store.read_entry(url))
+			except Exception as e:
+				failed = failed + 1
+				sys.stderr.write(url + ": " + str(e) + "\n")
+				continue
+			sys.stdout.write(url + "\n")
+		if failed > 0:
+			raise CommandError(str(failed) + " context(s) could not be downloaded")
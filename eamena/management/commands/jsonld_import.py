@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand, CommandError
+from arches.app.models.models import GraphModel
+from eamena.exporters.jsonld_ingest import import_documents
+import logging, sys, os, json
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+	"""
+	Imports a directory, or a JSONL file, of JSON-LD documents as resources of a graph, reading the
+	documents in parallel and saving them in batches. Documents that can't be imported are listed
+	with the reason, and don't stop the rest of the import.
+
+
+	"""
+	def add_arguments(self, parser):
+
+		parser.add_argument(
+			"-s", "--source", action="store", dest="source", default="", help="A directory of .json/.jsonld files, or a .jsonl (or .jsonl.gz) file with one document per line.",
+		)
+
+		parser.add_argument(
+			"-g", "--graph", action="store", dest="graph", default="", help="The graphid of the resources being imported.",
+		)
+
+		parser.add_argument(
+			"-p", "--workers", action="store", dest="workers", type=int, default=1, help="Number of worker processes reading documents.",
+		)
+
+		parser.add_argument(
+			"-b", "--batch-size", action="store", dest="batch_size", type=int, default=500, help="Number of resources saved at a time.",
+		)
+
+		parser.add_argument(
+			"--use-ids", action="store_true", dest="use_ids", default=False, help="Use the @id of each document as the resource id.",
+		)
+
+		parser.add_argument(
+			"-e", "--errors", action="store", dest="errors", default="", help="A file in which to write the documents that couldn't be imported, as JSONL.",
+		)
+
+		parser.add_argument(
+			"--dry-run", action="store_true", dest="dry_run", default=False, help="Read and check the documents without saving anything.",
+		)
+
+	def handle(self, *args, **options):
+
+		if len(options['graph']) == 0:
+			raise CommandError("No graph selected. Use --graph")
+		if not(GraphModel.objects.filter(graphid=options['graph'], isresource=True).exists()):
+			raise CommandError("Not a resource model: " + options['graph'])
+		if not(os.path.exists(options['source'])):
+			raise CommandError("Source not found: " + options['source'])
+
+		result = import_documents(options['source'], options['graph'], workers=max(1, options['workers']), batch_size=max(1, options['batch_size']), use_ids=options['use_ids'], dry_run=options['dry_run'])
+
+		if len(options['errors']) > 0:
+			with open(options['errors'], 'w') as fp:
+				for error in result['errors']:
+					fp.write(json.dumps(error) + "\n")
+		else:
+			for error in result['errors']:
+				sys.stderr.write(error['document'] + ": " + error['error'] + "\n")
+		self.stdout.write("Read " + str(result['documents']) + " documents, " + ("checked " if options['dry_run'] else "saved ") + str(result['resources']) + " resources, " + str(len(result['errors'])) + " errors.")
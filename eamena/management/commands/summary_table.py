@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from eamena.statistics.summary_table import rebuild_summaries, stored_summaries, write_ndjson, write_csv
+import logging, sys
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+	"""
+	Maintains the table of resource summaries used for reporting. --rebuild recomputes every summary
+	(needed once after installation, and after bulk imports that bypass tile saves); --export writes the
+	stored summaries out as NDJSON or CSV.
+
+
+	"""
+	def add_arguments(self, parser):
+
+		parser.add_argument(
+			"--rebuild", action="store_true", dest="rebuild", default=False, help="Recompute the stored summaries.",
+		)
+
+		parser.add_argument(
+			"--export", action="store_true", dest="export", default=False, help="Write the stored summaries to standard output.",
+		)
+
+		parser.add_argument(
+			"-g", "--graph", action="store", dest="graph", default="", help="Only rebuild or export the resources of this graph.",
+		)
+
+		parser.add_argument(
+			"-f", "--format", action="store", dest="format", default="ndjson", choices=["ndjson", "csv"], help="Export format.",
+		)
+
+		parser.add_argument(
+			"-b", "--batch-size", action="store", dest="batch_size", type=int, default=1000, help="Number of resources summarised at a time when rebuilding.",
+		)
+
+	def handle(self, *args, **options):
+
+		if not(options['rebuild'] or options['export']):
+			raise CommandError("Nothing to do. Use --rebuild and/or --export")
+		graph = options['graph'] or None
+
+		if options['rebuild']:
+			done = 0
+			for done in rebuild_summaries(graph=graph, batch_size=max(1, options['batch_size'])):
+				sys.stderr.write("\rSummarised " + str(done) + " resources")
+			sys.stderr.write("\rSummarised " + str(done) + " resources\n")
+
+		if options['export']:
+			if options['format'] == 'csv':
+				write_csv(stored_summaries(graph), sys.stdout)
+			else:
+				write_ndjson(stored_summaries(graph), sys.stdout)
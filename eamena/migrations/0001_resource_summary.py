@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.CreateModel(
+            name="ResourceSummary",
+            fields=[
+                ("resourceinstanceid", models.UUIDField(primary_key=True, serialize=False)),
+                ("graph_id", models.UUIDField(db_index=True)),
+                ("summary", models.JSONField(default=dict)),
+                ("updated", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "db_table": "eamena_resource_summaries",
+            },
+        ),
+    ]
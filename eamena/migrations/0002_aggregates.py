@@ -0,0 +1,51 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("eamena", "0001_resource_summary"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AggregateFact",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                ("resourceinstanceid", models.UUIDField()),
+                ("nodeid", models.UUIDField()),
+                ("valueid", models.UUIDField()),
+                ("grid_id", models.UUIDField()),
+                ("month", models.DateField()),
+            ],
+            options={
+                "db_table": "eamena_aggregate_facts",
+            },
+        ),
+        migrations.CreateModel(
+            name="AggregateCount",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                ("nodeid", models.UUIDField()),
+                ("valueid", models.UUIDField()),
+                ("grid_id", models.UUIDField()),
+                ("month", models.DateField()),
+                ("count", models.IntegerField(default=0)),
+            ],
+            options={
+                "db_table": "eamena_aggregate_counts",
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="aggregatefact",
+            constraint=models.UniqueConstraint(fields=("resourceinstanceid", "nodeid", "valueid", "grid_id", "month"), name="eamena_aggregate_fact_unique"),
+        ),
+        migrations.AddConstraint(
+            model_name="aggregatecount",
+            constraint=models.UniqueConstraint(fields=("nodeid", "valueid", "grid_id", "month"), name="eamena_aggregate_count_unique"),
+        ),
+        migrations.AddIndex(
+            model_name="aggregatecount",
+            index=models.Index(fields=["nodeid", "grid_id", "month"], name="eamena_aggregate_count_idx"),
+        ),
+    ]
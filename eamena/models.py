@@ -0,0 +1,55 @@
+from django.db import models
+
+
+class ResourceSummary(models.Model):
+    """The reporting summary of a resource (EAMENA ID, dates, actors, roles, countries, grid squares and
+    missing minimum data standard fields), as produced by the summary command. Kept up to date when
+    tiles are saved or deleted; rebuild it with `manage.py summary_table --rebuild`."""
+
+    resourceinstanceid = models.UUIDField(primary_key=True)
+    graph_id = models.UUIDField(db_index=True)
+    summary = models.JSONField(default=dict)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "eamena_resource_summaries"
+
+
+class AggregateFact(models.Model):
+    """One concept value of a Heritage Place, with the grid square and month it is counted under. These
+    are the rows that AggregateCount totals, kept so that the counts can be corrected when a resource's
+    tiles change."""
+
+    id = models.BigAutoField(primary_key=True)
+    resourceinstanceid = models.UUIDField()
+    nodeid = models.UUIDField()
+    valueid = models.UUIDField()
+    grid_id = models.UUIDField()
+    month = models.DateField()
+
+    class Meta:
+        db_table = "eamena_aggregate_facts"
+        constraints = [
+            models.UniqueConstraint(fields=["resourceinstanceid", "nodeid", "valueid", "grid_id", "month"], name="eamena_aggregate_fact_unique"),
+        ]
+
+
+class AggregateCount(models.Model):
+    """The number of Heritage Places with a value of a concept node, in one grid square (or all of them)
+    and one month. Maintained from AggregateFact; rebuild it with `manage.py aggregates --rebuild`."""
+
+    id = models.BigAutoField(primary_key=True)
+    nodeid = models.UUIDField()
+    valueid = models.UUIDField()
+    grid_id = models.UUIDField()
+    month = models.DateField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = "eamena_aggregate_counts"
+        constraints = [
+            models.UniqueConstraint(fields=["nodeid", "valueid", "grid_id", "month"], name="eamena_aggregate_count_unique"),
+        ]
+        indexes = [
+            models.Index(fields=["nodeid", "grid_id", "month"], name="eamena_aggregate_count_idx"),
+        ]
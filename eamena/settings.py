@@ -192,6 +192,8 @@ RESOURCE_FORMATTERS['jsonl'] = "eamena.exporters.JsonLWriter"
 RESOURCE_FORMATTERS['nt'] = "eamena.exporters.RdfWriter"
 RESOURCE_FORMATTERS['n3'] = "eamena.exporters.RdfWriter"
 RESOURCE_FORMATTERS['json-ld'] = "eamena.exporters.JsonLdWriter"
+RESOURCE_FORMATTERS['parquet'] = "eamena.exporters.ColumnarWriter"
+RESOURCE_FORMATTERS['fgb'] = "eamena.exporters.ColumnarWriter"
 
 from .settings_local import *
 from .settings_custom import *
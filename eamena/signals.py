@@ -0,0 +1,124 @@
+import logging
+import threading
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from arches.app.models.models import Node, ResourceInstance, TileModel
+from arches.app.models.resource import Resource
+from arches.app.models.system_settings import settings
+from arches.app.models.tile import Tile
+
+logger = logging.getLogger(__name__)
+
+# Nodegroups whose tiles affect a resource summary, worked out the first time a tile is saved
+summaryNodegroups = set()
+# Nodegroups holding the names of the grid squares and people that summaries refer to
+labelNodegroups = set()
+
+
+class PendingUpdates(object):
+    """Resource ids waiting for an update once the current transaction commits, kept per thread. Every
+    tile save queues a flush with on_commit, but the first flush to run takes all of the ids, so a
+    resource whose tiles are saved many times in one transaction is only updated once. Ids left over
+    from a transaction that was rolled back are picked up by the next flush."""
+
+    def __init__(self, update, description):
+        self.update = update
+        self.description = description
+        self.local = threading.local()
+
+    def add(self, resourceinstanceid):
+        if not (hasattr(self.local, "ids")):
+            self.local.ids = set()
+        self.local.ids.add(str(resourceinstanceid))
+        transaction.on_commit(self.flush)
+
+    def flush(self):
+        ids = getattr(self.local, "ids", set())
+        if len(ids) == 0:
+            return
+        self.local.ids = set()
+        try:
+            self.update(sorted(ids))
+        except Exception:
+            logger.exception("Could not update the {0} of resources {1}".format(self.description, ", ".join(sorted(ids))))
+
+
+def summary_nodegroups():
+    from eamena.statistics.summary_table import PROPERTIES
+
+    if len(summaryNodegroups) == 0:
+        nodeids = [prop[0] for prop in PROPERTIES] + [str(x) for x in getattr(settings, "MINIMUM_DATA_STANDARD", [])]
+        for nodegroupid in Node.objects.filter(nodeid__in=nodeids).values_list("nodegroup_id", flat=True):
+            summaryNodegroups.add(str(nodegroupid))
+    return summaryNodegroups
+
+
+def label_nodegroups():
+    from eamena.statistics.summary_table import LABEL_NODES
+
+    if len(labelNodegroups) == 0:
+        for nodegroupid in Node.objects.filter(nodeid__in=list(LABEL_NODES.values())).values_list("nodegroup_id", flat=True):
+            labelNodegroups.add(str(nodegroupid))
+    return labelNodegroups
+
+
+def update_summaries(resourceids):
+    from eamena.statistics.summary_table import update_summaries
+
+    update_summaries(resourceids)
+
+
+def relabel_summaries(resourceids):
+    from eamena.statistics.summary_table import relabel_summaries
+
+    relabel_summaries(resourceids)
+
+
+def update_aggregates(resourceids):
+    from eamena.statistics.aggregates import update_aggregates
+
+    update_aggregates(resourceids)
+
+
+pendingSummaries = PendingUpdates(update_summaries, "summaries")
+pendingRenames = PendingUpdates(relabel_summaries, "summary labels")
+pendingAggregates = PendingUpdates(update_aggregates, "aggregate counts")
+
+
+# Tile and Resource are proxies of TileModel and ResourceInstance, and signals are sent with the class
+# that was saved, so each receiver is connected to both
+@receiver(post_save, sender=TileModel)
+@receiver(post_save, sender=Tile)
+@receiver(post_delete, sender=TileModel)
+@receiver(post_delete, sender=Tile)
+def tile_changed(sender, instance, **kwargs):
+    if not (getattr(settings, "RESOURCE_SUMMARY_AUTO_UPDATE", True)):
+        return
+    if str(instance.nodegroup_id) in summary_nodegroups():
+        pendingSummaries.add(instance.resourceinstance_id)
+    # Summaries show the names of the grid squares and people they refer to, so renaming one of
+    # those updates the summaries of the resources referring to it
+    if str(instance.nodegroup_id) in label_nodegroups():
+        pendingRenames.add(instance.resourceinstance_id)
+
+
+@receiver(post_save, sender=TileModel)
+@receiver(post_save, sender=Tile)
+@receiver(post_delete, sender=TileModel)
+@receiver(post_delete, sender=Tile)
+def aggregate_tile_changed(sender, instance, **kwargs):
+    if not (getattr(settings, "AGGREGATES_AUTO_UPDATE", True)):
+        return
+    from eamena.statistics.aggregates import aggregate_nodegroups
+
+    if str(instance.nodegroup_id) in aggregate_nodegroups():
+        pendingAggregates.add(instance.resourceinstance_id)
+
+
+@receiver(post_delete, sender=ResourceInstance)
+@receiver(post_delete, sender=Resource)
+def resource_deleted(sender, instance, **kwargs):
+    from eamena.models import ResourceSummary
+
+    ResourceSummary.objects.filter(resourceinstanceid=instance.resourceinstanceid).delete()
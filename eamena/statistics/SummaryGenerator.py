@@ -1,6 +1,8 @@
 from arches.app.models import models
-from arches.app.models.concept import Concept, get_preflabel_from_valueid, get_valueids_from_concept_label
+from arches.app.models.concept import Concept
 from arches.app.models.system_settings import settings
+from django.db import connection
+import json
 
 class SummaryGenerator:
 
@@ -8,55 +10,105 @@ class SummaryGenerator:
 
 		self._properties = []
 		self._cached_summaries = {}
+		self._node_names = {}
 
 	def missing_fields(self, resourceid):
-		ret = [x for x in settings.MINIMUM_DATA_STANDARD]
-		for x in list(models.TileModel.objects.filter(resourceinstance_id=resourceid).values_list('data')):
-			for y in x:
-				for z in list(y.keys()):
-					zz = str(z)
-					if zz in ret:
-						if not y[zz] is None:
-							ret.remove(zz)
-					if len(ret) == 0:
-						return ret
+		return self.missing_fields_bulk([resourceid])[str(resourceid)]
+
+	def missing_fields_bulk(self, resourceids):
+		"""Returns a dict of resourceid => list of the MINIMUM_DATA_STANDARD nodes with no value in any of
+		the resource's tiles, for every resource in the list, using one query for all of them."""
+		fields = [str(x) for x in settings.MINIMUM_DATA_STANDARD]
+		resourceids = [str(x) for x in resourceids]
+		nodegroups = {}
+		for nodeid, nodegroupid in models.Node.objects.filter(nodeid__in=fields).values_list('nodeid', 'nodegroup_id'):
+			if not(nodegroupid is None):
+				nodegroups[str(nodeid)] = str(nodegroupid)
+		keys = [x for x in fields if x in nodegroups]
+
+		present = {}
+		if ((len(keys) > 0) and (len(resourceids) > 0)):
+			sql = """
+				SELECT t.resourceinstanceid, array_agg(DISTINCT k.nodeid)
+				FROM unnest(%s::text[], %s::uuid[]) AS k(nodeid, nodegroupid)
+				JOIN tiles t ON t.nodegroupid = k.nodegroupid AND t.tiledata ? k.nodeid AND t.tiledata -> k.nodeid <> 'null'::jsonb
+				WHERE t.resourceinstanceid = ANY(%s::uuid[])
+				GROUP BY t.resourceinstanceid
+			"""
+			with connection.chunked_cursor() as cursor:
+				cursor.execute(sql, [keys, [nodegroups[x] for x in keys], resourceids])
+				while True:
+					rows = cursor.fetchmany(5000)
+					if len(rows) == 0:
+						break
+					for resid, nodeids in rows:
+						present[str(resid)] = set([str(x) for x in nodeids])
+
+		ret = {}
+		for resid in resourceids:
+			found = present.get(resid, set())
+			ret[resid] = [x for x in fields if not(x in found)]
 		return ret
 
 	def node_name(self, nodeid):
-		try:
-			return models.Node.objects.filter(pk=nodeid).first().name
-		except:
-			return nodeid
+		id = str(nodeid)
+		if not(id in self._node_names):
+			# Fill the cache with the names of all the MDS nodes at once, as they're the usual lookups
+			ids = set([str(x) for x in settings.MINIMUM_DATA_STANDARD] + [id]) - set(self._node_names.keys())
+			for nodeid, name in models.Node.objects.filter(nodeid__in=list(ids)).values_list('nodeid', 'name'):
+				self._node_names[str(nodeid)] = name
+			for x in ids:
+				if not(x in self._node_names):
+					self._node_names[x] = x
+		return self._node_names[id]
 
 	def find_concepts(self, nodeid):
 
+		# The English preferred label of every concept in the node's collection, read with one query
+		# rather than two get_preflabel_from_valueid calls per concept
 		ret = []
-		node = models.Node.objects.get(nodeid=nodeid)
-
-		if 'rdmCollection' in node.config:
-			conceptid = node.config['rdmCollection']
-			if not(conceptid is None):
-				for item in Concept().get_e55_domain(conceptid):
-					valueobj = get_preflabel_from_valueid(item['id'], 'en')
-					valueid = valueobj['id']
-					label = get_preflabel_from_valueid(valueid, 'en')
-					ret.append({'valueid': valueid, 'conceptid': item['conceptid'], 'label': label['value']})
+		config = models.Node.objects.filter(nodeid=nodeid).values_list('config', flat=True).first() or {}
+		conceptid = config.get('rdmCollection')
+		if conceptid is None:
+			return ret
+		conceptids = []
+		for item in Concept().get_e55_domain(conceptid):
+			if not(item['conceptid'] in conceptids):
+				conceptids.append(item['conceptid'])
+		labels = {}
+		for valueid, concept_id, value, language in models.Value.objects.filter(concept_id__in=conceptids, valuetype_id='prefLabel').values_list('valueid', 'concept_id', 'value', 'language_id'):
+			# Prefer 'en', then any English variant, then any language, as get_preflabel_from_valueid does
+			rank = 0 if language == 'en' else (1 if str(language).startswith('en') else 2)
+			key = str(concept_id)
+			if not(key in labels) or rank < labels[key][0]:
+				labels[key] = [rank, str(valueid), value]
+		for id in conceptids:
+			if str(id) in labels:
+				ret.append({'valueid': labels[str(id)][1], 'conceptid': id, 'label': labels[str(id)][2]})
 		return ret
 
-	def find_objects(self, graph_id, identifier_id):
+	def object_labels(self, graph_id, identifier_id, resourceids=None):
+		"""Returns a dict of resourceid => the value of node identifier_id (as plain text) for every
+		resource of the graph, or just the ones listed, reading only that value from each tile."""
 
 		ret = {}
-		for item in models.TileModel.objects.filter(resourceinstance__graph_id=graph_id, nodegroup_id=identifier_id):
-			id = str(item.resourceinstance_id)
+		tiles = models.TileModel.objects.filter(resourceinstance__graph_id=graph_id, nodegroup_id=identifier_id)
+		if not(resourceids is None):
+			tiles = tiles.filter(resourceinstance_id__in=list(resourceids))
+		for resid, label in tiles.values_list('resourceinstance_id', 'data__' + identifier_id).iterator(chunk_size=5000):
+			if isinstance(label, dict):
+				if 'en' in label:
+					label = label['en']['value']
+			ret[str(resid)] = label
+		return ret
+
+	def find_objects(self, graph_id, identifier_id, resourceids=None):
+
+		ret = {}
+		for id, label in self.object_labels(graph_id, identifier_id, resourceids).items():
 			value = {'id': id}
-			if item.data:
-				if isinstance(item.data, (dict)):
-					if identifier_id in item.data:
-						label = item.data[identifier_id]
-						if isinstance(label, dict):
-							if 'en' in label:
-								label = label['en']['value']
-						value['label'] = label
+			if not(label is None):
+				value['label'] = label
 			ret[id] = value
 		return ret
 
@@ -65,39 +117,71 @@ class SummaryGenerator:
 		self._properties.append([str(uuid), str(label)])
 		self._cached_summaries = {}
 
-	def get_summaries(self):
+	def get_summaries(self, resourceids=None):
 
-		if len(self._cached_summaries) > 0:
+		# Summaries of every resource are cached; summaries of a list of resources (resourceids) aren't
+		if ((resourceids is None) and (len(self._cached_summaries) > 0)):
 			return self._cached_summaries
 
+		# Every value of every property, read in one statement. Each property's tiles are found by their
+		# nodegroup and the jsonb key-existence operator, and the rows come back in property order, so
+		# values are added to each summary in the same order as querying the properties one at a time.
+		nodegroups = {}
+		for nodeid, nodegroupid in models.Node.objects.filter(nodeid__in=[prop[0] for prop in self._properties]).values_list('nodeid', 'nodegroup_id'):
+			if not(nodegroupid is None):
+				nodegroups[str(nodeid)] = str(nodegroupid)
+		keys = [[i, prop[0], nodegroups[prop[0]]] for i, prop in enumerate(self._properties) if prop[0] in nodegroups]
+
 		ret = {}
-		for prop in self._properties:
-			k = prop[0]
-			label = prop[1]
-			for tile in models.TileModel.objects.filter(data__icontains=k): # , nodegroup_id='34cfea2e-c2c0-11ea-9026-02e7594ce0a0'):
-				rid = str(tile.resourceinstance_id)
-				if not(rid in ret):
-					ri = models.ResourceInstance.objects.get(resourceinstanceid=rid)
-					ret[rid] = {'AddedToDatabase': ri.createdtime.strftime("%Y-%m-%d")}
-				data = tile.data[k]
-				if data is None:
-					continue
-				if isinstance(data, (list)):
-					if len(data) == 0:
-						continue
-					data = data[0]
-				if isinstance(data, (dict)):
-					if 'resourceId' in data:
-						data = data['resourceId']
-				if label in ret[rid]:
-					if isinstance(ret[rid][label], list):
-						ret[rid][label].append(data)
-						continue
-					if isinstance(ret[rid][label], str):
-						ret[rid][label] = [ret[rid][label], data]
+		if ((len(keys) == 0) or ((not(resourceids is None)) and (len(resourceids) == 0))):
+			if resourceids is None:
+				self._cached_summaries = ret
+			return ret
+		params = [[x[0] for x in keys], [x[1] for x in keys], [x[2] for x in keys]]
+		where = ""
+		if not(resourceids is None):
+			where = "WHERE t.resourceinstanceid = ANY(%s::uuid[])"
+			params.append([str(x) for x in resourceids])
+		sql = """
+			SELECT k.ord, t.resourceinstanceid, r.createdtime, (t.tiledata -> k.nodeid)::text
+			FROM unnest(%s::integer[], %s::text[], %s::uuid[]) AS k(ord, nodeid, nodegroupid)
+			JOIN tiles t ON t.nodegroupid = k.nodegroupid AND t.tiledata ? k.nodeid
+			JOIN resource_instances r ON r.resourceinstanceid = t.resourceinstanceid
+			{0}
+			ORDER BY k.ord, t.resourceinstanceid, t.sortorder
+		""".format(where)
+		with connection.chunked_cursor() as cursor:
+			cursor.execute(sql, params)
+			while True:
+				rows = cursor.fetchmany(5000)
+				if len(rows) == 0:
+					break
+				for index, resid, createdtime, value in rows:
+					label = self._properties[index][1]
+					rid = str(resid)
+					if not(rid in ret):
+						ret[rid] = {}
+						if not(createdtime is None):
+							ret[rid]['AddedToDatabase'] = createdtime.strftime("%Y-%m-%d")
+					data = None if value is None else json.loads(value)
+					if data is None:
 						continue
-				else:
-					ret[rid][label] = data
+					if isinstance(data, (list)):
+						if len(data) == 0:
+							continue
+						data = data[0]
+					if isinstance(data, (dict)):
+						if 'resourceId' in data:
+							data = data['resourceId']
+					if label in ret[rid]:
+						if isinstance(ret[rid][label], list):
+							ret[rid][label].append(data)
+							continue
+						if isinstance(ret[rid][label], str):
+							ret[rid][label] = [ret[rid][label], data]
+							continue
+					else:
+						ret[rid][label] = data
 
 		for kk in ret.keys():
 			k = str(kk)
@@ -106,6 +190,7 @@ class SummaryGenerator:
 			if 'AddedToDatabase' in ret[k]:
 				ret[k]['Date'] = ret[k]['AddedToDatabase']
 
-		self._cached_summaries = ret
+		if resourceids is None:
+			self._cached_summaries = ret
 		return ret
 
@@ -0,0 +1,219 @@
+"""
+Precomputed counts of Heritage Places by the value of a few concept nodes (country, cultural period,
+condition state and threat type), by grid square and by month of the latest assessment.
+
+Each resource contributes one AggregateFact per concept value, grid square and month (plus one for 'all
+grid squares'), and AggregateCount holds the totals of those facts. When a resource's tiles change, its
+facts are recomputed and only the difference is applied to the counts, so reading the counts for a node
+is a single indexed query however many resources there are.
+"""
+
+from arches.app.models.models import Node, TileModel, Value
+from django.db import connection, transaction
+from django.db.models import Sum
+from eamena.models import AggregateCount
+import datetime, re, uuid, logging
+
+logger = logging.getLogger(__name__)
+
+HERITAGE_PLACE_GRAPH = '34cfe98e-c2c0-11ea-9026-02e7594ce0a0'
+
+# The concept nodes that are counted, by the name used in the API
+AGGREGATE_NODES = {
+	'country': '34cfea43-c2c0-11ea-9026-02e7594ce0a0',
+	'cultural_period': '38cff73b-c77b-11ea-a292-02e7594ce0a0',
+	'condition_state': '34cfe9f5-c2c0-11ea-9026-02e7594ce0a0',
+	'threat_type': '34cfea76-c2c0-11ea-9026-02e7594ce0a0'
+}
+
+GRID_NODE = '34cfea5d-c2c0-11ea-9026-02e7594ce0a0'
+DATE_NODE = '34cfea81-c2c0-11ea-9026-02e7594ce0a0'
+
+# The grid_id of the counts over every grid square, and the month of resources with no assessment date
+ALL_GRIDS = uuid.UUID(int=0)
+UNDATED = datetime.date(1, 1, 1)
+
+aggregateNodegroups = set()
+
+def aggregate_nodegroups():
+
+	if len(aggregateNodegroups) == 0:
+		nodeids = list(AGGREGATE_NODES.values()) + [GRID_NODE, DATE_NODE]
+		for nodegroupid in Node.objects.filter(nodeid__in=nodeids).values_list('nodegroup_id', flat=True):
+			aggregateNodegroups.add(str(nodegroupid))
+	return aggregateNodegroups
+
+def parse_month(value):
+	"""Returns the first day of the month of a YYYY, YYYY-MM or YYYY-MM-DD date, or None for an empty
+	value. Raises ValueError for anything else."""
+
+	if value is None or len(str(value).strip()) == 0:
+		return None
+	m = re.match(r'^(\d{4})(?:-(\d{1,2}))?(?:-(\d{1,2}))?', str(value).strip())
+	if m is None:
+		raise ValueError("Not a date: " + str(value))
+	return datetime.date(int(m.group(1)), int(m.group(2) or 1), 1)
+
+def value_ids(value):
+
+	ret = []
+	for id in value if isinstance(value, list) else [value]:
+		if isinstance(id, str) and len(id) > 0:
+			ret.append(id)
+	return ret
+
+def build_facts(resourceids):
+	"""Returns a list of (resourceid, nodeid, valueid, grid_id, month) for the resources listed, read from
+	their tiles in one query."""
+
+	nodes = dict([(str(nodeid), []) for nodeid in AGGREGATE_NODES.values()])
+	resources = {}
+	tiles = TileModel.objects.filter(resourceinstance_id__in=resourceids, nodegroup_id__in=list(aggregate_nodegroups()))
+	for resid, data in tiles.values_list('resourceinstance_id', 'data').iterator(chunk_size=2000):
+		item = resources.setdefault(str(resid), {'values': {}, 'grids': set(), 'month': UNDATED})
+		data = data or {}
+		for nodeid in nodes.keys():
+			for id in value_ids(data.get(nodeid)):
+				item['values'].setdefault(nodeid, set()).add(id)
+		for ref in data.get(GRID_NODE) or []:
+			if isinstance(ref, dict) and ref.get('resourceId'):
+				item['grids'].add(str(ref['resourceId']))
+		try:
+			month = parse_month(data.get(DATE_NODE))
+		except ValueError:
+			month = None
+		if not(month is None) and month > item['month']:
+			item['month'] = month
+
+	ret = []
+	for resid, item in resources.items():
+		grids = [str(ALL_GRIDS)] + sorted(item['grids'])
+		for nodeid, ids in item['values'].items():
+			for id in sorted(ids):
+				for grid in grids:
+					ret.append((resid, nodeid, id, grid, item['month']))
+	return ret
+
+def insert_facts(cursor, facts):
+
+	# Returns the keys of the facts actually inserted; facts that already exist are skipped
+	if len(facts) == 0:
+		return []
+	columns = list(zip(*facts))
+	cursor.execute("""
+		INSERT INTO eamena_aggregate_facts (resourceinstanceid, nodeid, valueid, grid_id, month)
+		SELECT * FROM unnest(%s::uuid[], %s::uuid[], %s::uuid[], %s::uuid[], %s::date[])
+		ON CONFLICT DO NOTHING
+		RETURNING nodeid, valueid, grid_id, month
+	""", [list(x) for x in columns])
+	return cursor.fetchall()
+
+def apply_deltas(cursor, deltas):
+
+	rows = sorted([key + (delta,) for key, delta in deltas.items() if delta != 0])
+	if len(rows) == 0:
+		return
+	columns = list(zip(*rows))
+	cursor.execute("""
+		INSERT INTO eamena_aggregate_counts (nodeid, valueid, grid_id, month, count)
+		SELECT * FROM unnest(%s::uuid[], %s::uuid[], %s::uuid[], %s::date[], %s::int[])
+		ON CONFLICT (nodeid, valueid, grid_id, month) DO UPDATE SET count = eamena_aggregate_counts.count + EXCLUDED.count
+	""", [list(x) for x in columns])
+	cursor.execute("DELETE FROM eamena_aggregate_counts WHERE count <= 0 AND valueid = ANY(%s::uuid[])", [list(set(columns[1]))])
+
+def update_aggregates(resourceids):
+	"""Recomputes the facts of a list of resources, and applies the difference to the counts."""
+
+	resourceids = [str(x) for x in resourceids]
+	facts = build_facts(resourceids)
+	deltas = {}
+	with transaction.atomic(), connection.cursor() as cursor:
+		cursor.execute("DELETE FROM eamena_aggregate_facts WHERE resourceinstanceid = ANY(%s::uuid[]) RETURNING nodeid, valueid, grid_id, month", [resourceids])
+		for key in cursor.fetchall():
+			key = tuple([str(x) for x in key[:3]]) + (key[3],)
+			deltas[key] = deltas.get(key, 0) - 1
+		for key in insert_facts(cursor, facts):
+			key = tuple([str(x) for x in key[:3]]) + (key[3],)
+			deltas[key] = deltas.get(key, 0) + 1
+		apply_deltas(cursor, deltas)
+
+def rebuild_aggregates(batch_size=1000):
+	"""Recomputes the facts and counts of every Heritage Place, batch_size resources at a time.
+	Yields the number of resources processed after each batch.
+
+	Each batch is updated in its own transaction, like a tile save, so the counts stay readable and
+	up to date throughout. Finally, facts of resources that no longer exist are removed and the counts
+	are recomputed from the facts, to correct any drift; the tables are only locked against writes
+	(not reads) while that runs."""
+
+	from eamena.statistics.summary_table import resource_id_batches
+
+	done = 0
+	for ids in resource_id_batches(HERITAGE_PLACE_GRAPH, batch_size):
+		update_aggregates(ids)
+		done = done + len(ids)
+		yield done
+	with transaction.atomic(), connection.cursor() as cursor:
+		# Facts first, so a tile save holding it and waiting for the counts can finish
+		cursor.execute("LOCK TABLE eamena_aggregate_facts, eamena_aggregate_counts IN SHARE ROW EXCLUSIVE MODE")
+		cursor.execute("""
+			DELETE FROM eamena_aggregate_facts f WHERE NOT EXISTS (
+				SELECT 1 FROM resource_instances r WHERE r.resourceinstanceid = f.resourceinstanceid AND r.graphid = %s::uuid
+			)
+		""", [HERITAGE_PLACE_GRAPH])
+		cursor.execute("""
+			INSERT INTO eamena_aggregate_counts (nodeid, valueid, grid_id, month, count)
+			SELECT nodeid, valueid, grid_id, month, count(*) FROM eamena_aggregate_facts GROUP BY nodeid, valueid, grid_id, month
+			ON CONFLICT (nodeid, valueid, grid_id, month) DO UPDATE SET count = EXCLUDED.count
+			WHERE eamena_aggregate_counts.count <> EXCLUDED.count
+		""")
+		cursor.execute("""
+			DELETE FROM eamena_aggregate_counts c WHERE NOT EXISTS (
+				SELECT 1 FROM eamena_aggregate_facts f
+				WHERE f.nodeid = c.nodeid AND f.valueid = c.valueid AND f.grid_id = c.grid_id AND f.month = c.month
+			)
+		""")
+
+def concept_labels(valueids):
+
+	from eamena.statistics.summary_table import cached_lookup, CONCEPT_CACHE_TIMEOUT
+
+	entry = cached_lookup('aggregate_concept_labels', CONCEPT_CACHE_TIMEOUT)
+	missing = [id for id in valueids if not(id in entry['labels'])]
+	if len(missing) > 0:
+		for valueid, value in Value.objects.filter(valueid__in=missing).values_list('valueid', 'value'):
+			entry['labels'][str(valueid)] = value
+	return dict([(id, entry['labels'].get(id)) for id in valueids])
+
+def get_aggregates(nodes=None, grids=None, date_from=None, date_to=None):
+	"""Returns the counts of Heritage Places for each value of the nodes named (default: all of
+	AGGREGATE_NODES), as {name: {"nodeid": ..., "values": [{"valueid", "label", "count"}, ...]}}, most
+	frequent first. Counts can be limited to a list of grid square resource ids (a resource in more than
+	one of them is counted in each) and to a range of assessment months; date_from and date_to are
+	YYYY, YYYY-MM or YYYY-MM-DD, and only their year and month are used."""
+
+	names = list(AGGREGATE_NODES.keys()) if not(nodes) else nodes
+	for name in names:
+		if not(name in AGGREGATE_NODES):
+			raise ValueError("Unknown node: " + str(name))
+	counts = AggregateCount.objects.filter(nodeid__in=[AGGREGATE_NODES[name] for name in names])
+	if grids:
+		counts = counts.filter(grid_id__in=[str(uuid.UUID(str(x))) for x in grids])
+	else:
+		counts = counts.filter(grid_id=ALL_GRIDS)
+	start = parse_month(date_from)
+	end = parse_month(date_to)
+	if not(start is None and end is None):
+		counts = counts.exclude(month=UNDATED)
+	if not(start is None):
+		counts = counts.filter(month__gte=start)
+	if not(end is None):
+		counts = counts.filter(month__lte=end)
+
+	rows = list(counts.values_list('nodeid', 'valueid').annotate(total=Sum('count')).order_by('nodeid', '-total', 'valueid'))
+	labels = concept_labels(list(set([str(row[1]) for row in rows])))
+	ret = dict([(name, {'nodeid': AGGREGATE_NODES[name], 'values': []}) for name in names])
+	names_by_node = dict([(AGGREGATE_NODES[name], name) for name in names])
+	for nodeid, valueid, total in rows:
+		ret[names_by_node[str(nodeid)]]['values'].append({'valueid': str(valueid), 'label': labels.get(str(valueid)), 'count': total})
+	return ret
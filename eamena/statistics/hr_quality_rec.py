@@ -2,15 +2,98 @@
 Automated or semi-automated functions to audit the quality of heritage resources (HR).
 By convention, the recording quality of a HR is the ratio between completed and empty fields (eg. Archaeological Assessment, Condition Assessment).
 
+A category (eg. 'Material') is completed when the HR has at least one tile in the nodegroup of the node with
+that name. Scores are computed for many HRs at once from a presence matrix (HRs x nodegroups) built from a
+single tiles query, so scoring every Heritage Place takes one query and a few array operations.
+
 """
 
+from arches.app.models.models import Node, ResourceInstance, TileModel
+import numpy as np
+import pandas as pd
+
+HERITAGE_PLACE_GRAPH = '34cfe98e-c2c0-11ea-9026-02e7594ce0a0'
+
+def category_nodegroups(graph_layout, graph_id=HERITAGE_PLACE_GRAPH):
+    """
+    Returns a dictionary of category name => list of the nodegroup ids of the nodes with that name in the graph.
+    Categories with no matching node have an empty list, so they count towards the totals but are never completed.
+    """
+    names = set([category for categories in graph_layout.values() for category in categories])
+    ret = dict([(name, []) for name in names])
+    for name, nodegroupid in Node.objects.filter(graph_id=graph_id, name__in=list(names)).exclude(nodegroup_id=None).values_list('name', 'nodegroup_id'):
+        if not(str(nodegroupid) in ret[name]):
+            ret[name].append(str(nodegroupid))
+    return ret
+
+def presence_matrix(nodegroupids, hrs=None, graph_id=HERITAGE_PLACE_GRAPH):
+    """
+    Returns a boolean dataframe with a row for each HR (every resource of the graph, or the HRs listed) and a
+    column for each nodegroup, True where the HR has at least one tile in the nodegroup.
+    """
+    if hrs is None:
+        index = pd.Index([str(x) for x in ResourceInstance.objects.filter(graph_id=graph_id).values_list('resourceinstanceid', flat=True)])
+    else:
+        index = pd.Index([str(x) for x in hrs])
+    columns = pd.Index([str(x) for x in nodegroupids])
+    matrix = np.zeros((len(index), len(columns)), dtype=bool)
+    if len(index) > 0 and len(columns) > 0:
+        tiles = TileModel.objects.filter(nodegroup_id__in=list(columns))
+        if hrs is None:
+            tiles = tiles.filter(resourceinstance__graph_id=graph_id)
+        else:
+            tiles = tiles.filter(resourceinstance_id__in=list(index))
+        pairs = list(tiles.values_list('resourceinstance_id', 'nodegroup_id').distinct())
+        if len(pairs) > 0:
+            rows = index.get_indexer([str(x[0]) for x in pairs])
+            cols = columns.get_indexer([str(x[1]) for x in pairs])
+            found = (rows >= 0) & (cols >= 0)
+            matrix[rows[found], cols[found]] = True
+    return pd.DataFrame(matrix, index=index, columns=columns)
+
+def hr_rec_qual_batch(graph_layout, hrs=None, graph_id=HERITAGE_PLACE_GRAPH):
+    """
+    Evaluate the quality of recording of many HRs at once. Returns a dataframe with a row for each HR (every
+    resource of the graph, or the HRs listed) and a column for each super-category, giving the number of
+    completed fields in that super-category. The total number of fields in each super-category is in the
+    dataframe's attrs['totals'].
+
+    :param graph_layout: A dictionnary with the key as super-category, and names of categories in a list
+    :param hrs: A list of HR UUIDs, or None for every HR in the graph
+
+    :type graph_layout: dict
+    :type hrs: list
+
+    :return: A dataframe
+    """
+    categories = category_nodegroups(graph_layout, graph_id)
+    nodegroupids = sorted(set([x for ids in categories.values() for x in ids]))
+    presence = presence_matrix(nodegroupids, hrs, graph_id)
+    matrix = presence.to_numpy()
+    columns = dict([(id, i) for i, id in enumerate(nodegroupids)])
+
+    completed = {}
+    totals = {}
+    for super_category, names in graph_layout.items():
+        count = np.zeros(matrix.shape[0], dtype=int)
+        for name in names:
+            cols = [columns[id] for id in categories[name]]
+            if len(cols) > 0:
+                count = count + matrix[:, cols].any(axis=1)
+        completed[super_category] = count
+        totals[super_category] = len(names)
+
+    ret = pd.DataFrame(completed, index=presence.index, columns=list(graph_layout.keys()))
+    ret.attrs['totals'] = totals
+    return ret
+
 def hr_rec_qual(graph_layout, hr):
     """
     Evaluate the quality of recording of a single HR. Returns a dataframe with two rows:
         - the first row shows the total of completed fields in each super-category for the HR record
         - the second row shows the total of fields in each super-category
-    This dataframe is used in 
-    
+    This dataframe is used in hr_rec_qual_grad, and is computed with hr_rec_qual_batch.
+
     :param graph_layout: A dictionnary with the key as super-category, and names of categories in a list 
     :param hr: The UUID of a single HR
     
@@ -43,13 +126,32 @@ def hr_rec_qual(graph_layout, hr):
         +----+------------------------------+------------------------+
 
     """
-    pass
-    return None
+    batch = hr_rec_qual_batch(graph_layout, [hr])
+    totals = [batch.attrs['totals'][x] for x in batch.columns]
+    return pd.DataFrame([batch.iloc[0].tolist(), totals], columns=batch.columns)
 
 def hr_rec_qual_grad(hr_recq):
     """
     Plot a radar chart (ie, spider chart) showing the recording quality of a HR.
     ex: https://knowhow.visual-paradigm.com/openapi/radar-chart/
+
+    :param hr_recq: The dataframe returned by hr_rec_qual
+
+    :return: A matplotlib figure, with the share of completed fields in each super-category
     """
-    pass
-    return None
+    from matplotlib.figure import Figure
+
+    labels = list(hr_recq.columns)
+    completed = hr_recq.iloc[0].to_numpy(dtype=float)
+    totals = hr_recq.iloc[1].to_numpy(dtype=float)
+    ratios = np.divide(completed, totals, out=np.zeros(len(labels)), where=(totals > 0))
+
+    angles = np.linspace(0, 2 * np.pi, len(labels), endpoint=False)
+    fig = Figure()
+    ax = fig.add_subplot(projection='polar')
+    ax.plot(np.append(angles, angles[:1]), np.append(ratios, ratios[:1]))
+    ax.fill(np.append(angles, angles[:1]), np.append(ratios, ratios[:1]), alpha=0.25)
+    ax.set_xticks(angles)
+    ax.set_xticklabels(labels)
+    ax.set_ylim(0, 1)
+    return fig
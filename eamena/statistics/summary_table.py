@@ -0,0 +1,280 @@
+from arches.app.models import models
+from django.db import transaction
+from eamena.models import ResourceSummary
+from eamena.statistics.SummaryGenerator import SummaryGenerator
+import json, csv, time, logging
+
+logger = logging.getLogger(__name__)
+
+# The properties included in each resource summary, as [nodeid, label]
+PROPERTIES = [
+	['5297fa9f-8e16-11ea-a6a6-02e7594ce0a0', 'ID'],
+	['34cfe992-c2c0-11ea-9026-02e7594ce0a0', 'ID'],
+	['34cfea81-c2c0-11ea-9026-02e7594ce0a0', 'Date'],
+	['947ccaa3-1ea5-11eb-af98-02e7594ce0a0', 'Date'],
+	['5297faa9-8e16-11ea-a6a6-02e7594ce0a0', 'Actor'],
+	['34cfea8a-c2c0-11ea-9026-02e7594ce0a0', 'Actor'],
+	['d2e1ab96-cc05-11ea-a292-02e7594ce0a0', 'Role'],
+	['40c49e8c-cc08-11ea-a292-02e7594ce0a0', 'Role'],
+	['34cfea43-c2c0-11ea-9026-02e7594ce0a0', 'Country'],
+	['61ad1129-c7f1-11ea-a292-02e7594ce0a0', 'Country'],
+	['34cfea5d-c2c0-11ea-9026-02e7594ce0a0', 'Grid'],
+	['61ad1121-c7f1-11ea-a292-02e7594ce0a0', 'Grid']
+]
+
+CSV_FIELDS = ['resourceinstanceid', 'ID', 'Date', 'AddedToDatabase', 'Actor', 'Role', 'Country', 'Grid', 'MissingFields']
+
+# The graphs of the grid squares and people named in summaries, and the nodes their names are read from
+GRID_GRAPH = '77d18973-7428-11ea-b4d0-02e7594ce0a0'
+PERSON_GRAPH = 'e98e1cee-c38b-11ea-9026-02e7594ce0a0'
+LABEL_NODES = {
+	GRID_GRAPH: 'b3628db0-742d-11ea-b4d0-02e7594ce0a0',
+	PERSON_GRAPH: 'e98e1cfe-c38b-11ea-9026-02e7594ce0a0'
+}
+
+# Label lookups (id => label text), shared by every summary built in this process. Concepts (Role and
+# Country) only change when the reference data is edited; grid square and person labels are kept for
+# a shorter time, and the ones not yet seen are looked up when they're first needed.
+CONCEPT_CACHE_TIMEOUT = 3600
+OBJECT_CACHE_TIMEOUT = 600
+lookupCache = {}
+
+def cached_lookup(key, timeout):
+
+	entry = lookupCache.get(key)
+	if ((entry is None) or (entry['time'] < time.time() - timeout)):
+		entry = {'time': time.time(), 'labels': {}, 'complete': False}
+		lookupCache[key] = entry
+	return entry
+
+def concept_lookup(sg, nodeid):
+
+	entry = cached_lookup(nodeid, CONCEPT_CACHE_TIMEOUT)
+	if not(entry['complete']):
+		entry['labels'] = dict([(item['valueid'], item['label']) for item in sg.find_concepts(nodeid)])
+		entry['complete'] = True
+	return entry['labels']
+
+def object_lookup(sg, graph_id, identifier_id, resourceids=None):
+
+	entry = cached_lookup(graph_id, OBJECT_CACHE_TIMEOUT)
+	if resourceids is None:
+		if not(entry['complete']):
+			entry['labels'] = sg.object_labels(graph_id, identifier_id)
+			entry['complete'] = True
+	elif not(entry['complete']):
+		missing = [str(x) for x in resourceids if not(str(x) in entry['labels'])]
+		if len(missing) > 0:
+			entry['labels'].update(sg.object_labels(graph_id, identifier_id, missing))
+	return entry['labels']
+
+def get_roles(sg):
+
+	return concept_lookup(sg, 'd2e1ab96-cc05-11ea-a292-02e7594ce0a0')
+
+def get_countries(sg):
+
+	return concept_lookup(sg, '34cfea43-c2c0-11ea-9026-02e7594ce0a0')
+
+def get_grid_squares(sg, resourceids=None):
+
+	return object_lookup(sg, GRID_GRAPH, LABEL_NODES[GRID_GRAPH], resourceids)
+
+def get_people(sg, resourceids=None):
+
+	return object_lookup(sg, PERSON_GRAPH, LABEL_NODES[PERSON_GRAPH], resourceids)
+
+def resolve_labels(value, lookup):
+
+	# Replaces an id, or a list of ids, with {"id", "label"} for the ones in the lookup
+	if isinstance(value, str):
+		if value in lookup:
+			return {"id": value, "label": lookup[value]}
+		return value
+	if isinstance(value, list):
+		items = [{"id": id, "label": lookup[id]} for id in list(dict.fromkeys(value)) if id in lookup]
+		if len(items) == 1:
+			return items[0]
+		return items
+	return value
+
+def referenced_ids(summaries, label):
+
+	ret = set()
+	for item in summaries.values():
+		value = item.get(label)
+		for id in value if isinstance(value, list) else [value]:
+			if isinstance(id, str):
+				ret.add(id)
+	return list(ret)
+
+def build_summaries(resourceids=None):
+	"""Returns a dict of resourceid => summary for every resource (or just the ones listed) that has a
+	value for any of the summary PROPERTIES. When only some resources are summarised, only the grid
+	squares and people they refer to are looked up."""
+
+	gen = SummaryGenerator()
+	for prop in PROPERTIES:
+		gen.add_property(prop[1], prop[0])
+
+	ret = {}
+	sum = gen.get_summaries(resourceids)
+
+	if resourceids is None:
+		grid_lookup = get_grid_squares(gen)
+		people_lookup = get_people(gen)
+	else:
+		grid_lookup = get_grid_squares(gen, referenced_ids(sum, 'Grid'))
+		people_lookup = get_people(gen, referenced_ids(sum, 'Actor'))
+	lookups = {'Grid': grid_lookup, 'Actor': people_lookup, 'Country': get_countries(gen), 'Role': get_roles(gen)}
+	missing = gen.missing_fields_bulk(list(sum.keys()))
+
+	for k in sum.keys():
+		kk = str(k)
+		item = sum[kk]
+		if 'ID' in item:
+			id = item['ID']
+			if isinstance(id, dict):
+				if 'en' in id:
+					item['ID'] = id['en']['value']
+		for label, lookup in lookups.items():
+			if label in item:
+				item[label] = resolve_labels(item[label], lookup)
+		item['MissingFields'] = [gen.node_name(x) for x in missing[kk]]
+		ret[kk] = item
+	return ret
+
+def save_summaries(summaries):
+
+	graphs = {}
+	for resid, graphid in models.ResourceInstance.objects.filter(resourceinstanceid__in=list(summaries.keys())).values_list('resourceinstanceid', 'graph_id'):
+		graphs[str(resid)] = graphid
+	rows = [ResourceSummary(resourceinstanceid=id, graph_id=graphs[id], summary=summaries[id]) for id in summaries.keys() if id in graphs]
+	ResourceSummary.objects.bulk_create(rows, batch_size=1000, update_conflicts=True, unique_fields=['resourceinstanceid'], update_fields=['graph_id', 'summary', 'updated'])
+	return len(rows)
+
+def update_summaries(resourceids):
+	"""Recomputes the stored summaries of a list of resources, removing any that no longer have one."""
+
+	resourceids = [str(x) for x in resourceids]
+	summaries = build_summaries(resourceids)
+	with transaction.atomic():
+		save_summaries(summaries)
+		ResourceSummary.objects.filter(resourceinstanceid__in=[x for x in resourceids if not(x in summaries)]).delete()
+
+def relabel_summaries(resourceids):
+	"""Recomputes the stored summaries of the resources that refer to any of a list of grid squares or
+	people, whose names have changed. Their cached labels are dropped first, so the new names are read."""
+
+	for graph_id in LABEL_NODES.keys():
+		lookupCache.pop(graph_id, None)
+	referring = models.ResourceXResource.objects.filter(resourceinstanceidto__in=[str(x) for x in resourceids]).values_list('resourceinstanceidfrom', flat=True)
+	referring = sorted(set([str(x) for x in referring if not(x is None)]))
+	for i in range(0, len(referring), 1000):
+		update_summaries(referring[i:i + 1000])
+
+def resource_id_batches(graph=None, batch_size=1000):
+
+	# Yields lists of resource ids (of one graph, if given), batch_size at a time, in id order
+	resources = models.ResourceInstance.objects.all()
+	if not(graph is None):
+		resources = resources.filter(graph_id=graph)
+	resources = resources.order_by('resourceinstanceid')
+	previous = None
+	while True:
+		page = resources
+		if not(previous is None):
+			page = page.filter(resourceinstanceid__gt=previous)
+		ids = [str(x) for x in page.values_list('resourceinstanceid', flat=True)[:batch_size]]
+		if len(ids) == 0:
+			break
+		previous = ids[-1]
+		yield ids
+
+def iter_summaries(graph=None, batch_size=1000):
+	"""Yields [resourceid, summary] for every resource (of one graph, if given) that has a summary,
+	computing them batch_size resources at a time, so memory use doesn't grow with the database."""
+
+	for ids in resource_id_batches(graph, batch_size):
+		summaries = build_summaries(ids)
+		for id in ids:
+			if id in summaries:
+				yield [id, summaries[id]]
+
+def rebuild_summaries(graph=None, batch_size=1000):
+	"""Recomputes the stored summary of every resource (of one graph, if given), batch_size resources at
+	a time, and removes the summaries of resources that have been deleted. Yields the number of
+	resources processed after each batch."""
+
+	done = 0
+	for ids in resource_id_batches(graph, batch_size):
+		update_summaries(ids)
+		done = done + len(ids)
+		yield done
+	ResourceSummary.objects.exclude(resourceinstanceid__in=models.ResourceInstance.objects.values('resourceinstanceid')).delete()
+
+def stored_summaries(graph=None):
+	"""Yields [resourceid, summary] for every stored summary (of one graph, if given), in id order."""
+
+	rows = ResourceSummary.objects.all()
+	if not(graph is None):
+		rows = rows.filter(graph_id=graph)
+	for resid, summary in rows.order_by('resourceinstanceid').values_list('resourceinstanceid', 'summary').iterator(chunk_size=2000):
+		yield [str(resid), summary]
+
+def csv_value(value):
+
+	if value is None:
+		return ''
+	if isinstance(value, dict):
+		return str(value.get('label', value.get('id', '')))
+	if isinstance(value, list):
+		return '; '.join([csv_value(x) for x in value])
+	return str(value)
+
+def write_json(summaries, fp):
+	"""Writes [resourceid, summary] pairs to a text stream as a single JSON object keyed by resource id
+	(the summary command's original output), one entry at a time. Returns the number written."""
+
+	count = 0
+	fp.write("{")
+	for resid, summary in summaries:
+		if count > 0:
+			fp.write(", ")
+		fp.write(json.dumps(resid) + ": " + json.dumps(summary))
+		count = count + 1
+		if count % 1000 == 0:
+			fp.flush()
+	fp.write("}\n")
+	fp.flush()
+	return count
+
+def write_ndjson(summaries, fp):
+	"""Writes [resourceid, summary] pairs to a text stream as one JSON object per line, flushing every
+	thousand lines so that the output is usable up to that point if the run is interrupted. Returns the
+	number written."""
+
+	count = 0
+	for resid, summary in summaries:
+		fp.write(json.dumps(dict(summary, resourceinstanceid=resid)) + "\n")
+		count = count + 1
+		if count % 1000 == 0:
+			fp.flush()
+	fp.flush()
+	return count
+
+def write_csv(summaries, fp):
+	"""Writes [resourceid, summary] pairs to a text stream as CSV, with lists of values separated by
+	semicolons. Returns the number written."""
+
+	writer = csv.writer(fp)
+	writer.writerow(CSV_FIELDS)
+	count = 0
+	for resid, summary in summaries:
+		row = dict(summary, resourceinstanceid=resid)
+		writer.writerow([csv_value(row.get(field)) for field in CSV_FIELDS])
+		count = count + 1
+		if count % 1000 == 0:
+			fp.flush()
+	fp.flush()
+	return count
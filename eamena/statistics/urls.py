@@ -0,0 +1,6 @@
+from django.urls import re_path
+from eamena.statistics.views import aggregates
+
+urlpatterns = [
+	re_path(r"^aggregates$", aggregates, name="statistics_aggregates"),
+]
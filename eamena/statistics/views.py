@@ -0,0 +1,23 @@
+from django.http import HttpResponse
+from eamena.statistics.aggregates import get_aggregates
+import json
+
+def split_param(request, name):
+
+	ret = []
+	for value in request.GET.getlist(name):
+		ret.extend([x.strip() for x in value.split(',') if len(x.strip()) > 0])
+	return ret
+
+def aggregates(request):
+	"""Counts of Heritage Places by concept value. Query parameters: node (country, cultural_period,
+	condition_state and/or threat_type; default all), grid (grid square resource ids), from and to
+	(YYYY, YYYY-MM or YYYY-MM-DD, matched against the month of the latest assessment)."""
+
+	if not(request.user.is_authenticated):
+		return HttpResponse(json.dumps({"error": "Not logged in"}), status=403, content_type="application/json")
+	try:
+		data = get_aggregates(nodes=split_param(request, 'node'), grids=split_param(request, 'grid'), date_from=request.GET.get('from'), date_to=request.GET.get('to'))
+	except ValueError as e:
+		return HttpResponse(json.dumps({"error": str(e)}), status=400, content_type="application/json")
+	return HttpResponse(json.dumps(data), content_type="application/json")
@@ -6,7 +6,8 @@ from citations.urls import urlpatterns as citation_urlpatterns
 
 urlpatterns = [
     # project-level urls
-    path("bulk-upload/", include("eamena.bulk_uploader.urls"))
+    path("bulk-upload/", include("eamena.bulk_uploader.urls")),
+    path("statistics/", include("eamena.statistics.urls"))
 ]
 
 # Ensure Arches core urls are superseded by project-level urls
@@ -0,0 +1,128 @@
+import json, os, tempfile, time, unittest, uuid
+
+from eamena.bulk_uploader import ResourceModel
+from django.test import SimpleTestCase
+
+# Timings depend on the machine, so the timing benchmark only runs when asked for, like the export ones
+BENCHMARK = os.environ.get("EXPORT_BENCHMARK") == "1"
+
+def write_graph(nodegroup_count, children=True):
+    """Writes a minimal graph JSON file with nodegroup_count top-level nodegroups, each with a child
+    and a grandchild nodegroup, and returns its path."""
+    nodes = []
+    nodegroups = []
+    for i in range(0, nodegroup_count):
+        parent = None
+        for depth in range(0, 3 if children else 1):
+            nodegroupid = str(uuid.uuid4())
+            nodegroups.append({"nodegroupid": nodegroupid, "parentnodegroup_id": parent})
+            nodes.append({"nodeid": nodegroupid, "nodegroup_id": nodegroupid, "datatype": "semantic", "config": {}})
+            nodes.append({"nodeid": str(uuid.uuid4()), "nodegroup_id": nodegroupid, "datatype": "string", "config": {}})
+            parent = nodegroupid
+    fd, path = tempfile.mkstemp(suffix=".json")
+    with os.fdopen(fd, "w") as fp:
+        json.dump({"graph": [{"graphid": str(uuid.uuid4()), "name": "Test", "nodes": nodes, "nodegroups": nodegroups}]}, fp)
+    return path
+
+class CountingList(list):
+    """A list that counts how many of its items are read, by index or by iterating over it."""
+    reads = 0
+
+    def __getitem__(self, index):
+        value = super().__getitem__(index)
+        self.reads = self.reads + (len(value) if isinstance(index, slice) else 1)
+        return value
+
+    def __iter__(self):
+        for value in super().__iter__():
+            self.reads = self.reads + 1
+            yield value
+
+def value_nodes(rm):
+    return [node["nodeid"] for node in rm.nodes.values() if node["datatype"] == "string"]
+
+class TestResourceModel(SimpleTestCase):
+    def setUp(self):
+        self.path = write_graph(1)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_add_creates_parent_tiles(self):
+        rm = ResourceModel(self.path)
+        leaf = value_nodes(rm)[-1]
+        rm.add(leaf, "value")
+
+        tiles = json.loads(rm.dump_jsonl())["tiles"]
+        self.assertEqual(len(tiles), 3)
+        self.assertIsNone(tiles[0]["parenttile_id"])
+        self.assertEqual(tiles[1]["parenttile_id"], tiles[0]["tileid"])
+        self.assertEqual(tiles[2]["parenttile_id"], tiles[1]["tileid"])
+        self.assertEqual(tiles[2]["data"], {leaf: "value"})
+        self.assertEqual(set(tiles[2].keys()), set(["parenttile_id", "provisionaledits", "sortorder", "tileid", "nodegroup_id", "resourceinstance_id", "data"]))
+
+    def test_add_repeated_value(self):
+        rm = ResourceModel(self.path)
+        leaf = value_nodes(rm)[-1]
+        first = rm.add(leaf, ["one"])
+        second = rm.add(leaf, "two")
+        merged = rm.add(leaf, ["three"])
+
+        self.assertNotEqual(first["tileid"], second["tileid"])
+        self.assertEqual(first["parenttile_id"], second["parenttile_id"])
+        self.assertIs(merged, first)
+        self.assertEqual(merged["data"][leaf], ["one", "three"])
+        self.assertEqual(len(json.loads(rm.dump_json())["business_data"]["resources"][0]["tiles"]), 4)
+
+    def test_add_scales_linearly(self):
+        # The work per add() should not grow with the number of tiles already in the resource. Count
+        # the tiles read by each call: with an index of the tiles this is a constant, while a linear
+        # scan of the tiles reads about four times as many for four times as many tiles.
+        def tiles_read_per_add(nodegroup_count):
+            path = write_graph(nodegroup_count, children=False)
+            try:
+                rm = ResourceModel(path)
+                rm.tiles = CountingList(rm.tiles)
+                ids = value_nodes(rm)
+                for id in ids:
+                    rm.add(id, "a")
+                    rm.add(id, "b")
+                self.assertEqual(len(rm.tiles), len(ids) * 2)
+                return rm.tiles.reads / (len(ids) * 2)
+            finally:
+                os.remove(path)
+
+        small = tiles_read_per_add(500)
+        large = tiles_read_per_add(2000)
+        self.assertEqual(large, small)
+        self.assertLess(large, 10)
+
+    @unittest.skipUnless(BENCHMARK, "Timing benchmarks only run with EXPORT_BENCHMARK=1")
+    def test_add_and_dump_timing(self):
+        # Times add() and dump_json() per tile for a large resource and one four times larger. With
+        # an index of the tiles, the time per tile should stay about the same rather than growing with
+        # the size of the resource.
+        def seconds_per_tile(nodegroup_count):
+            path = write_graph(nodegroup_count, children=False)
+            try:
+                best = [None, None]
+                for attempt in range(0, 3):
+                    rm = ResourceModel(path)
+                    ids = value_nodes(rm)
+                    start = time.perf_counter()
+                    for id in ids:
+                        rm.add(id, "a")
+                        rm.add(id, "b")
+                    added = time.perf_counter()
+                    rm.dump_json()
+                    dumped = time.perf_counter()
+                    times = [(added - start) / len(rm.tiles), (dumped - added) / len(rm.tiles)]
+                    best = [x if (y is None or x < y) else y for x, y in zip(times, best)]
+                return best
+            finally:
+                os.remove(path)
+
+        small = seconds_per_tile(1000)
+        large = seconds_per_tile(4000)
+        self.assertLess(large[0], small[0] * 2, "add() per tile")
+        self.assertLess(large[1], small[1] * 2, "dump_json() per tile")
@@ -0,0 +1,135 @@
+import json, os, random, re, uuid
+from contextlib import contextmanager
+from unittest import mock
+
+from django.test import override_settings
+
+from pyld.jsonld import frame, from_rdf
+from rdflib import BNode, ConjunctiveGraph, Literal, Namespace
+from rdflib.namespace import RDF, RDFS, XSD
+
+GRAPH_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "pkg", "graphs", "resource_models")
+HERITAGE_PLACE_GRAPH = "34cfe98e-c2c0-11ea-9026-02e7594ce0a0"
+
+DATA = Namespace("http://localhost:8000/")
+CRM = Namespace("http://www.cidoc-crm.org/cidoc-crm/")
+CONTEXT = {"crm": "http://www.cidoc-crm.org/cidoc-crm/", "rdfs": "http://www.w3.org/2000/01/rdf-schema#"}
+
+def nquads_jsonld(g, root_id, context=None):
+    """The N-Quads -> from_rdf -> frame pipeline that JsonLdWriter.build_json used before the direct builder."""
+    value = g.serialize(format="nquads").decode("utf-8")
+    js = from_rdf(value, {"format": "application/nquads", "useNativeTypes": True})
+    framing = {"@omitDefault": True, "@omitGraph": False, "@id": root_id}
+    if context:
+        framing["@context"] = context
+    js = frame(js, framing)
+    if "@graph" in js and len(js["@graph"]) == 1:
+        for (k, v) in list(js["@graph"][0].items()):
+            js[k] = v
+        del js["@graph"]
+    return js
+
+def canonical(js):
+    # Blank node labels differ between the two pipelines, so number them in order of appearance.
+    labels = {}
+    def relabel(match):
+        labels.setdefault(match.group(0), "_:b" + str(len(labels)))
+        return labels[match.group(0)]
+    return re.sub(r"_:[A-Za-z0-9]+", relabel, json.dumps(js, sort_keys=True))
+
+def resource_graph(seed, size=None):
+    """Returns an rdflib graph shaped like the ones RdfWriter.get_rdf_graph makes (a resource, tile nodes,
+    blank nodes, concepts with labels, typed literals and cross references), and the resource URI."""
+    r = random.Random(seed)
+    g = ConjunctiveGraph()
+    root = DATA["resources/" + str(seed)]
+    nodes = [root]
+    concepts = [DATA["concepts/" + str(i)] for i in range(0, 4)]
+    for concept in concepts:
+        g.add((concept, RDF.type, CRM.E55_Type))
+        g.add((concept, RDFS.label, Literal("label " + str(concept)[-1], lang="en")))
+    for i in range(0, size or r.randint(3, 40)):
+        parent = r.choice(nodes)
+        child = BNode() if r.random() < 0.2 else DATA["tile/" + str(seed) + "/node/" + str(i)]
+        g.add((parent, CRM["P" + str(r.randint(1, 5))], child))
+        g.add((child, RDF.type, CRM["E" + str(r.randint(1, 5))]))
+        nodes.append(child)
+        k = r.random()
+        if k < 0.2:
+            g.add((child, CRM.P3, Literal(r.choice(["x", "true", "12", "-3", "1.5"]), datatype=r.choice([XSD.string, XSD.integer, XSD.boolean, XSD.double, XSD.dateTime, None]))))
+        elif k < 0.4:
+            g.add((child, CRM.P2, r.choice(concepts)))
+        elif k < 0.45:
+            g.add((child, CRM.P9, r.choice(nodes)))
+        elif k < 0.5:
+            g.add((child, CRM.P3, Literal("hello", lang="ar")))
+    g.add((root, RDF.type, CRM.E27_Site))
+    return g, str(root)
+
+def load_graph(filename):
+    """Imports a packaged resource model (a file in pkg/graphs/resource_models) if it isn't already loaded.
+    Returns its graphid, or None if it couldn't be imported."""
+    from arches.app.models.models import GraphModel
+
+    with open(os.path.join(GRAPH_DIR, filename), "r") as fp:
+        graph = json.load(fp)["graph"]
+    graph_id = graph[0]["graphid"]
+    if not (GraphModel.objects.filter(graphid=graph_id).exists()):
+        try:
+            from arches.app.utils.data_management.resource_graphs.importer import import_graph
+            import_graph(graph)
+        except Exception:
+            return None
+    if not (GraphModel.objects.filter(graphid=graph_id).exists()):
+        return None
+    return graph_id
+
+def seed_resources(count, tiles_per_resource, graph_id=HERITAGE_PLACE_GRAPH):
+    """Creates `count` resources of a graph, with between one and tiles_per_resource tiles each, filled
+    with string values. Returns the resource ids."""
+    from arches.app.models.models import Node, ResourceInstance, TileModel
+
+    nodegroups = {}
+    for nodeid, nodegroupid in Node.objects.filter(graph_id=graph_id, datatype="string", nodegroup__parentnodegroup=None).values_list("nodeid", "nodegroup_id"):
+        nodegroups.setdefault(str(nodegroupid), []).append(str(nodeid))
+    nodegroupids = sorted(nodegroups.keys())
+    resources = []
+    tiles = []
+    for i in range(0, count):
+        resource = ResourceInstance(resourceinstanceid=uuid.uuid4(), graph_id=graph_id)
+        resources.append(resource)
+        if len(nodegroupids) == 0:
+            continue
+        for j in range(0, 1 + (i % tiles_per_resource)):
+            nodegroupid = nodegroupids[j % len(nodegroupids)]
+            data = dict([(nodeid, {"en": {"value": "Value " + str(i) + "." + str(j), "direction": "ltr"}}) for nodeid in nodegroups[nodegroupid]])
+            tiles.append(TileModel(tileid=uuid.uuid4(), resourceinstance=resource, nodegroup_id=nodegroupid, data=data, sortorder=j))
+    ResourceInstance.objects.bulk_create(resources)
+    TileModel.objects.bulk_create(tiles)
+    return [str(resource.resourceinstanceid) for resource in resources]
+
+@contextmanager
+def export_settings(**kwargs):
+    """Overrides settings for the exporters. They read arches' system_settings, which
+    override_settings alone doesn't reach."""
+    from arches.test.utils import sync_overridden_test_settings_to_arches
+
+    with override_settings(**kwargs), sync_overridden_test_settings_to_arches():
+        yield
+
+@contextmanager
+def counted_chunks():
+    """Counts the chunks of resources fetched by the exporters while the block runs. Yields a list
+    whose first item is the count."""
+    from eamena.exporters import jsonl, rdf, columnar
+
+    count = [0]
+    original = jsonl.resource_chunks
+
+    def resource_chunks(*args, **kwargs):
+        for chunk in original(*args, **kwargs):
+            count[0] = count[0] + 1
+            yield chunk
+
+    with mock.patch.object(jsonl, "resource_chunks", resource_chunks), mock.patch.object(rdf, "resource_chunks", resource_chunks), mock.patch.object(columnar, "resource_chunks", resource_chunks):
+        yield count
@@ -0,0 +1,172 @@
+import json, os, time, tracemalloc
+
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from eamena.exporters import JsonLWriter, JsonLdWriter, RdfWriter
+from eamena.exporters.jsonld import build_framed_jsonld
+from tests.exporters import CONTEXT, HERITAGE_PLACE_GRAPH, counted_chunks, export_settings, load_graph, nquads_jsonld, resource_graph, seed_resources
+
+# Timings depend on the machine, so they are only checked when EXPORT_BENCHMARK=1, against this file
+# (which must then exist; the test fails without it).
+# Run with EXPORT_BENCHMARK_UPDATE=1 to (re)write it from the current code on the machine doing the
+# comparison, and EXPORT_BENCHMARK_TOLERANCE to change how much worse (as a fraction) throughput and peak
+# memory may get before the test fails. The other tests don't depend on the machine and always run.
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "export_benchmark_baseline.json")
+TOLERANCE = float(os.environ.get("EXPORT_BENCHMARK_TOLERANCE", "0.25"))
+
+# The most extra queries allowed for exporting all the resources rather than a quarter of them
+# in the same number of chunks; a per-resource or per-tile query would exceed it many times over
+EXTRA_QUERIES = 5
+
+def timing_enabled():
+    return os.environ.get("EXPORT_BENCHMARK") == "1" or os.environ.get("EXPORT_BENCHMARK_UPDATE") == "1"
+
+def drain(exports):
+    # Reads every export file to the end, so lazily written output is included in the measurement
+    size = 0
+    for item in exports:
+        item["outputfile"].seek(0)
+        for block in iter(lambda: item["outputfile"].read(65536), ""):
+            size = size + len(block)
+    return size
+
+def measure(function, resources):
+    tracemalloc.start()
+    start = time.perf_counter()
+    with CaptureQueriesContext(connection) as queries:
+        function()
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"resources_per_second": resources / max(elapsed, 1e-9), "peak_bytes": peak, "queries": len(queries)}
+
+class TestExportBenchmarks(TestCase):
+    resource_count = 200
+    tiles_per_resource = 12
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.resourceids = []
+        if load_graph("Heritage Place.json"):
+            cls.resourceids = seed_resources(cls.resource_count, cls.tiles_per_resource)
+
+    def setUp(self):
+        if len(self.resourceids) == 0:
+            self.skipTest("The Heritage Place graph could not be loaded")
+
+    def cases(self):
+        single = [self.resourceids[-1]]
+        return {
+            "jsonl_bulk": [lambda: drain(JsonLWriter().write_resources(graph_id=HERITAGE_PLACE_GRAPH)), self.resource_count],
+            "jsonl_single": [lambda: drain(JsonLWriter().write_resources(resourceinstanceids=single)), 1],
+            "nt_bulk": [lambda: drain(RdfWriter(format="nt").write_resources(graph_id=HERITAGE_PLACE_GRAPH)), self.resource_count],
+            "nt_single": [lambda: drain(RdfWriter(format="nt").write_resources(resourceinstanceids=single)), 1],
+            "n3_bulk": [lambda: drain(RdfWriter(format="n3").write_resources(graph_id=HERITAGE_PLACE_GRAPH)), self.resource_count],
+            "n3_single": [lambda: drain(RdfWriter(format="n3").write_resources(resourceinstanceids=single)), 1],
+            "jsonld_single": [lambda: drain(JsonLdWriter().write_resources(resourceinstanceids=single)), 1],
+        }
+
+    def test_against_baseline(self):
+        if not (timing_enabled()):
+            self.skipTest("Timing benchmarks only run with EXPORT_BENCHMARK=1")
+        results = {}
+        for name, (function, resources) in self.cases().items():
+            function()  # warm up the graph caches
+            results[name] = measure(function, resources)
+
+        if os.environ.get("EXPORT_BENCHMARK_UPDATE") == "1":
+            with open(BASELINE_FILE, "w") as fp:
+                json.dump(results, fp, indent=2, sort_keys=True)
+        if not (os.path.exists(BASELINE_FILE)):
+            self.fail("No benchmark baseline; run with EXPORT_BENCHMARK_UPDATE=1 to record one. Results: " + json.dumps(results, sort_keys=True))
+        with open(BASELINE_FILE, "r") as fp:
+            baseline = json.load(fp)
+
+        for name, result in results.items():
+            with self.subTest(name):
+                self.assertIn(name, baseline)
+                self.assertGreaterEqual(result["resources_per_second"], baseline[name]["resources_per_second"] * (1 - TOLERANCE))
+                self.assertLessEqual(result["peak_bytes"], baseline[name]["peak_bytes"] * (1 + TOLERANCE))
+                self.assertLessEqual(result["queries"], baseline[name]["queries"])
+
+    def test_queries_independent_of_resource_count(self):
+        # With every resource in one chunk, exporting all of them should take the same number of
+        # queries as exporting a quarter of them.
+        quarter = self.resourceids[:int(self.resource_count / 4)]
+        writers = {
+            "jsonl": lambda: JsonLWriter(),
+            "nt": lambda: RdfWriter(format="nt"),
+            "n3": lambda: RdfWriter(format="n3"),
+        }
+        with export_settings(EXPORT_CHUNK_SIZE=1000):
+            for name, writer in writers.items():
+                writer().write_resources(resourceinstanceids=quarter)  # warm up the graph caches
+                small = measure(lambda: drain(writer().write_resources(resourceinstanceids=quarter)), len(quarter))
+                with counted_chunks() as chunks:
+                    large = measure(lambda: drain(writer().write_resources(resourceinstanceids=self.resourceids)), self.resource_count)
+                with self.subTest(name):
+                    self.assertEqual(chunks[0], 1)
+                    self.assertLessEqual(large["queries"], small["queries"] + EXTRA_QUERIES)
+
+    def test_bulk_queries_per_chunk(self):
+        # Bulk exports fetch resources a chunk at a time, so the number of queries should be a small
+        # multiple of the number of chunks, whatever the number of tiles.
+        with export_settings(EXPORT_CHUNK_SIZE=50):
+            for name in ["jsonl_bulk", "nt_bulk"]:
+                function, resources = self.cases()[name]
+                function()
+                with counted_chunks() as chunks, CaptureQueriesContext(connection) as queries:
+                    function()
+                with self.subTest(name):
+                    self.assertEqual(chunks[0], -(-resources // 50))
+                    self.assertGreater(chunks[0], 1)
+                    self.assertLessEqual(len(queries), chunks[0] * EXTRA_QUERIES + EXTRA_QUERIES)
+
+    def test_jsonld_queries_independent_of_tiles(self):
+        # JSON-LD is exported a resource at a time. Each export should take the same number of
+        # queries, whether the resource has one tile or tiles_per_resource of them, so exporting
+        # every resource takes a number of queries proportional to the number of resources.
+        single = self.resourceids[0]
+        JsonLdWriter().write_resources(resourceinstanceids=[single])  # warm up the graph caches
+        with CaptureQueriesContext(connection) as queries:
+            drain(JsonLdWriter().write_resources(resourceinstanceids=[single]))
+        per_resource = len(queries)
+        largest = self.resourceids[self.tiles_per_resource - 1]
+        with CaptureQueriesContext(connection) as queries:
+            drain(JsonLdWriter().write_resources(resourceinstanceids=[largest]))
+        self.assertLessEqual(len(queries), per_resource + EXTRA_QUERIES)
+
+        sample = self.resourceids[:self.tiles_per_resource * 2]
+        with CaptureQueriesContext(connection) as queries:
+            for resourceid in sample:
+                drain(JsonLdWriter().write_resources(resourceinstanceids=[resourceid]))
+        self.assertLessEqual(len(queries), len(sample) * (per_resource + EXTRA_QUERIES))
+
+    def test_streaming_memory_bounded(self):
+        # The peak memory of a streamed N-Triples export should be about the same for a quarter of the
+        # resources as for all of them.
+        quarter = self.resourceids[:int(self.resource_count / 4)]
+        with export_settings(EXPORT_CHUNK_SIZE=10):
+            RdfWriter(format="nt").write_resources(resourceinstanceids=quarter)
+            small = measure(lambda: drain(RdfWriter(format="nt").write_resources(resourceinstanceids=quarter)), len(quarter))
+            with counted_chunks() as chunks:
+                large = measure(lambda: drain(RdfWriter(format="nt").write_resources(graph_id=HERITAGE_PLACE_GRAPH)), self.resource_count)
+        self.assertEqual(chunks[0], self.resource_count // 10)
+        self.assertLess(large["peak_bytes"], small["peak_bytes"] * 2)
+
+class TestJsonLdBuilderBenchmark(SimpleTestCase):
+    def test_faster_than_nquads_pipeline(self):
+        if not (timing_enabled()):
+            self.skipTest("Timing benchmarks only run with EXPORT_BENCHMARK=1")
+        g, root = resource_graph(7, size=400)
+        def best_time(function):
+            best = None
+            for attempt in range(0, 3):
+                start = time.perf_counter()
+                function(g, root, CONTEXT)
+                elapsed = time.perf_counter() - start
+                if ((best is None) or (elapsed < best)):
+                    best = elapsed
+            return best
+        self.assertLess(best_time(build_framed_jsonld) * 2, best_time(nquads_jsonld))
@@ -0,0 +1,68 @@
+import os
+from unittest import mock
+
+from eamena.exporters.jsonld import build_framed_jsonld
+from django.test import SimpleTestCase, TestCase
+from tests.exporters import CONTEXT, DATA, GRAPH_DIR, canonical, load_graph, nquads_jsonld, resource_graph, seed_resources
+
+class TestJsonLdBuilder(SimpleTestCase):
+    def test_matches_nquads_pipeline(self):
+        compared = 0
+        for seed in range(0, 100):
+            for context in [None, CONTEXT]:
+                g, root = resource_graph(seed)
+                try:
+                    expected = nquads_jsonld(g, root, context)
+                except KeyError:
+                    # pyld's framing fails on some shapes of circular reference
+                    continue
+                self.assertEqual(canonical(build_framed_jsonld(g, root, context)), canonical(expected), "seed " + str(seed))
+                compared = compared + 1
+        self.assertGreater(compared, 150)
+
+    def test_missing_resource(self):
+        g, root = resource_graph(1)
+        self.assertIsNone(build_framed_jsonld(g, str(DATA["resources/missing"])))
+
+    def test_reads_graph_once(self):
+        # The direct builder reads each triple once and never goes through a serialisation; the
+        # timing comparison with the N-Quads pipeline is in export_benchmark_tests.
+        g, root = resource_graph(7, size=400)
+        contexts = g.contexts
+        read = [0]
+        def counted_contexts(*args, **kwargs):
+            for context in contexts(*args, **kwargs):
+                for triple in context:
+                    read[0] = read[0] + 1
+                yield context
+        with mock.patch.object(g, "contexts", counted_contexts), mock.patch.object(g, "serialize", side_effect=AssertionError("serialize called")):
+            build_framed_jsonld(g, root, CONTEXT)
+        self.assertEqual(read[0], len(g))
+
+class TestJsonLdWriter(TestCase):
+    resources_per_graph = 3
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.graph_ids = []
+        cls.resource_ids = []
+        for filename in sorted(os.listdir(GRAPH_DIR)):
+            graph_id = load_graph(filename)
+            cls.graph_ids.append([filename, graph_id])
+            if not (graph_id is None):
+                cls.resource_ids.extend(seed_resources(cls.resources_per_graph, 4, graph_id=graph_id))
+
+    def test_packaged_graphs(self):
+        # Compares JsonLdWriter output with and without the direct builder for a few resources of each
+        # packaged resource model.
+        from eamena.exporters.rdf import JsonLdWriter
+        self.assertEqual([filename for filename, graph_id in self.graph_ids if graph_id is None], [])
+        self.assertEqual(len(self.resource_ids), len(self.graph_ids) * self.resources_per_graph)
+        from eamena.exporters import rdf
+        for resource_id in self.resource_ids:
+            with mock.patch.object(rdf, "from_rdf", wraps=rdf.from_rdf) as from_rdf:
+                expected = JsonLdWriter().build_json(resourceinstanceids=[resource_id], direct=False)
+                self.assertEqual(from_rdf.call_count, 1)
+                actual = JsonLdWriter().build_json(resourceinstanceids=[resource_id], direct=True)
+                self.assertEqual(from_rdf.call_count, 1)
+            self.assertEqual(canonical(actual), canonical(expected), resource_id)
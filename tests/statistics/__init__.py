@@ -0,0 +1,2 @@
+# these tests can be run from the command line via
+# python manage.py test tests.statistics --pattern="*.py" --settings="tests.test_settings"
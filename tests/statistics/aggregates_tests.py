@@ -0,0 +1,154 @@
+import datetime, json, uuid
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from eamena.statistics import aggregates
+from eamena.statistics.aggregates import ALL_GRIDS, AGGREGATE_NODES, DATE_NODE, GRID_NODE, HERITAGE_PLACE_GRAPH, apply_deltas, get_aggregates, insert_facts, rebuild_aggregates, update_aggregates
+from eamena.statistics.views import aggregates as aggregates_view
+from tests.exporters import load_graph
+
+COUNTRY = AGGREGATE_NODES["country"]
+CONDITION = AGGREGATE_NODES["condition_state"]
+
+def counts(node="country", **kwargs):
+    """Returns {valueid: count} for one node of get_aggregates."""
+    return dict([(item["valueid"], item["count"]) for item in get_aggregates(nodes=[node], **kwargs)[node]["values"]])
+
+class TestAggregates(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        from arches.app.models.models import Node
+
+        cls.graph_id = load_graph("Heritage Place.json")
+        cls.nodegroups = dict([(str(nodeid), str(nodegroupid)) for nodeid, nodegroupid in Node.objects.filter(nodeid__in=list(AGGREGATE_NODES.values()) + [GRID_NODE, DATE_NODE]).values_list("nodeid", "nodegroup_id")])
+        cls.values = [str(uuid.uuid4()) for i in range(0, 3)]
+        cls.grids = [str(uuid.uuid4()) for i in range(0, 2)]
+
+    def setUp(self):
+        self.assertIsNotNone(self.graph_id)
+        aggregates.aggregateNodegroups.clear()
+
+    def create(self, country=None, condition=None, grids=None, date=None):
+        """Creates a Heritage Place with the values given, without sending any signals, and returns its id."""
+        from arches.app.models.models import ResourceInstance
+
+        resource = ResourceInstance.objects.create(resourceinstanceid=uuid.uuid4(), graph_id=HERITAGE_PLACE_GRAPH)
+        self.set_tiles(resource.resourceinstanceid, country=country, condition=condition, grids=grids, date=date)
+        return str(resource.resourceinstanceid)
+
+    def set_tiles(self, resourceid, country=None, condition=None, grids=None, date=None):
+        """Replaces the tiles of a resource with ones holding the values given."""
+        from arches.app.models.models import TileModel
+
+        values = {COUNTRY: None if country is None else [country], CONDITION: condition, GRID_NODE: None, DATE_NODE: date}
+        if grids:
+            values[GRID_NODE] = [{"resourceId": grid} for grid in grids]
+        data = {}
+        for nodeid, value in values.items():
+            if not (value is None):
+                data.setdefault(self.nodegroups[nodeid], {})[nodeid] = value
+        TileModel.objects.filter(resourceinstance_id=resourceid).delete()
+        TileModel.objects.bulk_create([TileModel(tileid=uuid.uuid4(), resourceinstance_id=resourceid, nodegroup_id=nodegroupid, data=tiledata, sortorder=0) for nodegroupid, tiledata in data.items()])
+
+    def test_insert_change_delete(self):
+        a, b, c = self.values
+        first = self.create(country=a, condition=c)
+        second = self.create(country=a)
+        update_aggregates([first, second])
+        self.assertEqual(counts(), {a: 2})
+        self.assertEqual(counts("condition_state"), {c: 1})
+
+        self.set_tiles(first, country=b, condition=c)
+        update_aggregates([first])
+        self.assertEqual(counts(), {a: 1, b: 1})
+        self.assertEqual(counts("condition_state"), {c: 1})
+
+        self.set_tiles(second)
+        update_aggregates([second])
+        self.assertEqual(counts(), {b: 1})
+
+        # Updating again without any changes doesn't count anything twice
+        update_aggregates([first, second])
+        self.assertEqual(counts(), {b: 1})
+
+    def test_insert_facts_skips_existing(self):
+        resourceid = str(uuid.uuid4())
+        fact = (resourceid, COUNTRY, self.values[0], str(ALL_GRIDS), datetime.date(2020, 1, 1))
+        with connection.cursor() as cursor:
+            self.assertEqual(len(insert_facts(cursor, [fact])), 1)
+            self.assertEqual(insert_facts(cursor, [fact]), [])
+            self.assertEqual(insert_facts(cursor, []), [])
+
+    def test_apply_deltas(self):
+        a, b, c = self.values
+        month = datetime.date(2020, 1, 1)
+        with connection.cursor() as cursor:
+            apply_deltas(cursor, {(COUNTRY, a, str(ALL_GRIDS), month): 2, (COUNTRY, b, str(ALL_GRIDS), month): 1})
+            self.assertEqual(counts(), {a: 2, b: 1})
+            apply_deltas(cursor, {(COUNTRY, a, str(ALL_GRIDS), month): -1, (COUNTRY, b, str(ALL_GRIDS), month): -1, (COUNTRY, c, str(ALL_GRIDS), month): 0})
+            self.assertEqual(counts(), {a: 1})
+
+    def test_grid_filter(self):
+        a, b, c = self.values
+        first, second = self.grids
+        update_aggregates([self.create(country=a, grids=[first]), self.create(country=b, grids=[first, second]), self.create(country=c)])
+        self.assertEqual(counts(), {a: 1, b: 1, c: 1})
+        self.assertEqual(counts(grids=[first]), {a: 1, b: 1})
+        self.assertEqual(counts(grids=[second]), {b: 1})
+        # A resource in both grid squares is counted in each
+        self.assertEqual(counts(grids=[first, second]), {a: 1, b: 2})
+
+    def test_date_filter(self):
+        a, b, c = self.values
+        update_aggregates([self.create(country=a, date="2019-06-30"), self.create(country=b, date="2020-02-01"), self.create(country=c)])
+        self.assertEqual(counts(), {a: 1, b: 1, c: 1})
+        self.assertEqual(counts(date_from="2020"), {b: 1})
+        self.assertEqual(counts(date_to="2019-12"), {a: 1})
+        self.assertEqual(counts(date_from="2019-06-15", date_to="2020-02"), {a: 1, b: 1})
+        self.assertEqual(counts(date_from="2021"), {})
+
+    def test_invalid_parameters(self):
+        self.assertRaises(ValueError, get_aggregates, nodes=["nothing"])
+        self.assertRaises(ValueError, get_aggregates, grids=["not a uuid"])
+        self.assertRaises(ValueError, get_aggregates, date_from="last year")
+
+    def test_rebuild(self):
+        a, b, c = self.values
+        update_aggregates([self.create(country=a, grids=[self.grids[0]])])
+        self.create(country=b)
+        # Resources saved without signals, counts that have drifted and facts of a resource that no
+        # longer exists are all put right
+        with connection.cursor() as cursor:
+            apply_deltas(cursor, {(COUNTRY, a, str(ALL_GRIDS), aggregates.UNDATED): 3})
+            insert_facts(cursor, [(str(uuid.uuid4()), COUNTRY, c, str(ALL_GRIDS), aggregates.UNDATED)])
+            apply_deltas(cursor, {(COUNTRY, c, str(ALL_GRIDS), aggregates.UNDATED): 1})
+        done = list(rebuild_aggregates(batch_size=1))
+        self.assertEqual(done[-1], len(done))
+        self.assertEqual(counts(), {a: 1, b: 1})
+        self.assertEqual(counts(grids=[self.grids[0]]), {a: 1})
+
+class TestAggregatesView(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.user = User.objects.create_user("aggregates_test", password=str(uuid.uuid4()))
+
+    def get(self, user, **params):
+        request = self.factory.get("/statistics/aggregates", params)
+        request.user = user
+        return aggregates_view(request)
+
+    def test_not_logged_in(self):
+        self.assertEqual(self.get(AnonymousUser()).status_code, 403)
+
+    def test_bad_parameters(self):
+        for params in [{"node": "country,nothing"}, {"grid": "not a uuid"}, {"from": "last year"}, {"to": "soon"}]:
+            with self.subTest(params):
+                response = self.get(self.user, **params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("error", json.loads(response.content))
+
+    def test_counts(self):
+        response = self.get(self.user, node="country,threat_type", grid=str(uuid.uuid4()), **{"from": "2020-01", "to": "2021"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(json.loads(response.content).keys()), ["country", "threat_type"])